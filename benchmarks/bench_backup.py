@@ -0,0 +1,111 @@
+"""Microbenchmark: backing up and restoring npm packages (with versions and
+api-style payloads) as a dill pickle of the whole dataset (the old backup
+format) vs. the record stream (see Archive), with each compression.
+
+msgpack, zstandard and lz4 are optional; without msgpack the records are
+json lines, and the compressions whose package is missing are skipped.
+Peak memory is measured in a second, traced pass (tracing slows python
+down, so times come from the untraced pass). Usage:
+
+    python benchmarks/bench_backup.py [n_projects] [versions_per_project]
+"""
+import io
+import os
+import sys
+import time
+import random
+import tempfile
+import tracemalloc
+import dill as pickle
+from contextlib import redirect_stdout, redirect_stderr
+
+from r2c_isg.structures import Dataset
+from r2c_isg.structures import archive
+from r2c_isg.structures.archive import Archive
+from r2c_isg.structures.projects import NpmPackage
+from r2c_isg.structures.versions import NpmVersion
+
+
+def make_dataset(n: int, n_versions: int) -> Dataset:
+    rand = random.Random(0)
+    uuids = {'name': lambda p: p.name}
+    meta = {'org': lambda p: p.name.split('-')[0]}
+    v_uuids = {'version': lambda v: v.version}
+    ds = Dataset(registry='npm', nocache=True, name='bench', version='1')
+    for i in range(n):
+        p = NpmPackage(uuids_=uuids, meta_=meta, name='package-%d' % i,
+                       dependents_rank=i + 1,
+                       download_count=rand.randrange(10 ** 6),
+                       api_response={'description': 'package %d' % i,
+                                     'keywords': ['a', 'b', 'c'],
+                                     'license': 'MIT'})
+        p.versions = [NpmVersion(uuids_=v_uuids, version='1.%d.0' % j,
+                                 date='2019-%02d-01' % rand.randrange(1, 13),
+                                 api_response={'shasum': '%040x' % j})
+                      for j in range(n_versions)]
+        ds.projects.append(p)
+    return ds
+
+
+def dill_dump(ds: Dataset, path: str) -> None:
+    with open(path, 'wb') as file:
+        pickle.dump(ds, file)
+
+
+def dill_load(path: str) -> Dataset:
+    with open(path, 'rb') as file:
+        return pickle.load(file)
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        func(*args)
+    return time.perf_counter() - start
+
+
+def peak(func, *args) -> float:
+    tracemalloc.start()
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        func(*args)
+    _, size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size / 1e6
+
+
+def run(label: str, dump, load, ds: Dataset, path: str) -> None:
+    write = timed(dump, ds, path)
+    read = timed(load, path)
+    mb = os.path.getsize(path) / 1e6
+    write_peak = peak(dump, ds, path)
+    read_peak = peak(load, path)
+    print('%-16s write %6.2fs (peak %7.1f MB)  read %6.2fs (peak %7.1f MB)'
+          '  %7.1f MB on disk'
+          % (label, write, write_peak, read, read_peak, mb))
+
+
+def main(n: int = 100000, n_versions: int = 10):
+    ds = make_dataset(n, n_versions)
+    print('backing up {:,} projects ({:,} versions); records encoded as {}'
+          .format(n, n * n_versions,
+                  'msgpack' if archive.msgpack else 'json lines'))
+
+    path = os.path.join(tempfile.mkdtemp(), 'bench.p')
+    run('dill', dill_dump, dill_load, ds, path)
+
+    available = {'zstd': archive.zstandard, 'lz4': archive.lz4}
+    for compression in Archive.compressions:
+        if available.get(compression, True) is None:
+            print('%-16s skipped (not installed)' % compression)
+            continue
+
+        def dump(ds, path, compression=compression):
+            Archive.dump(ds, path, compression)
+
+        run('records/' + compression, dump, Archive.load, ds, path)
+
+    os.remove(path)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,91 @@
+"""Microbenchmark: exporting a GitRepoCommit input set (github repos with
+their commit histories) the old way (the whole input set built in memory
+by to_inputset, then pretty-printed by json.dump) vs. the streamed export
+(inputs encoded compactly and written one project at a time), plain,
+gzipped and as ndjson.
+
+Peak memory is measured in a second, traced pass (tracing slows python
+down, so times come from the untraced pass). Usage:
+
+    python benchmarks/bench_export.py [n_repos] [commits_per_repo]
+"""
+import io
+import os
+import sys
+import json
+import time
+import tempfile
+import tracemalloc
+from contextlib import redirect_stdout, redirect_stderr
+
+from r2c_isg.structures import Dataset
+from r2c_isg.structures.field_spec import field_specs
+from r2c_isg.structures.projects import GithubRepo
+from r2c_isg.structures.versions import GithubCommit
+
+
+def make_dataset(n: int, n_commits: int) -> Dataset:
+    uuids, _ = field_specs('''
+        uuid name = attr "name"
+        uuid url = attr "html_url"
+    ''')
+    v_uuids, _ = field_specs('''
+        uuid commit = attr "sha"
+    ''')
+    ds = Dataset(registry='github', nocache=True, name='bench', version='1')
+    for i in range(n):
+        p = GithubRepo(uuids_=uuids, name='repo-%d' % i,
+                       html_url='https://github.com/org/repo-%d' % i)
+        p.versions = [GithubCommit(uuids_=v_uuids,
+                                   sha='%040x' % (i * n_commits + j))
+                      for j in range(n_commits)]
+        ds.projects.append(p)
+    return ds
+
+
+def old_export(ds: Dataset, path: str) -> None:
+    """Mimics the old export: build the input set, then pretty-print it."""
+    inputset = ds.to_inputset()
+    with open(path, 'w') as file:
+        json.dump(inputset, file, indent=4)
+
+
+def quiet(func, *args) -> None:
+    with redirect_stdout(io.StringIO()), redirect_stderr(io.StringIO()):
+        func(*args)
+
+
+def run(label: str, export, ds: Dataset, path: str) -> None:
+    start = time.perf_counter()
+    quiet(export, ds, path)
+    elapsed = time.perf_counter() - start
+    mb = os.path.getsize(path) / 1e6
+
+    tracemalloc.start()
+    quiet(export, ds, path)
+    _, size = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-16s %6.2fs  peak %7.1f MB  %7.1f MB on disk'
+          % (label, elapsed, size / 1e6, mb))
+
+
+def main(n: int = 20000, n_commits: int = 100):
+    ds = make_dataset(n, n_commits)
+    print('exporting {:,} repos ({:,} inputs)'.format(n, n * n_commits))
+
+    tmp_dir = tempfile.mkdtemp()
+    path = os.path.join(tmp_dir, 'bench.json')
+    run('json.dump', old_export, ds, path)
+    run('streamed', lambda ds, path: ds.export_inputset(path), ds, path)
+    run('streamed/gzip',
+        lambda ds, path: ds.export_inputset(path), ds, path + '.gz')
+    run('streamed/ndjson',
+        lambda ds, path: ds.export_inputset(path, ndjson=True), ds, path)
+
+    for name in os.listdir(tmp_dir):
+        os.remove(os.path.join(tmp_dir, name))
+    os.rmdir(tmp_dir)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,74 @@
+"""Microbenchmark: memory per npm package loaded from a name list (as by
+the npm allbydependents loader) with the old project layout vs. the
+current compact one.
+
+The old layout gave every project an instance dict holding its versions
+list and dicts of its own bound uuid/meta methods; the current one keeps
+fixed fields in slots and shares one dict of uuid/meta functions between
+all of a loader's projects. Usage:
+
+    python benchmarks/bench_memory.py [n_projects] [names.json]
+"""
+import sys
+import json
+import time
+import tracemalloc
+from types import MethodType
+
+from r2c_isg.loaders.web.npm_loader import NpmLoader
+from r2c_isg.structures import Dataset
+
+
+class LegacyPackage(object):
+    """Mimics the old Project layout."""
+
+    def __init__(self, uuids_: dict = {}, meta_: dict = {}, **kwargs):
+        self.versions = []
+        self.uuids_ = {k: MethodType(f, self) for k, f in uuids_.items()}
+        self.meta_ = {k: MethodType(f, self) for k, f in meta_.items()}
+        for k, val in kwargs.items():
+            setattr(self, k, val)
+
+
+def legacy_parse(ds: Dataset, names: list):
+    """Mimics NpmLoader._parse_niceregistry with the old layout."""
+    uuids = {'name': lambda p: p.name}
+    ds.projects = [LegacyPackage(uuids_=uuids, name=name, dependents_rank=i)
+                   for i, name in enumerate(names, 1)]
+
+
+def compact_parse(ds: Dataset, names: list):
+    # tqdm writes to stderr; the progress bar doesn't change the result
+    NpmLoader._parse_niceregistry(ds, names)
+
+
+def run(label: str, parse, names: list) -> float:
+    ds = Dataset(registry='npm', nocache=True)
+    tracemalloc.start()
+    start = time.perf_counter()
+    parse(ds, names)
+    elapsed = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    per_project = size / len(names)
+    print('%-16s %8.0f bytes/project %8.1f MB total %6.2fs'
+          % (label, per_project, size / 1e6, elapsed))
+    return per_project
+
+
+def main(n: int = 1000000, names_path: str = None):
+    if names_path:
+        with open(names_path) as file:
+            names = json.load(file)[:n]
+    else:
+        names = ['package-%d' % i for i in range(n)]
+
+    before = run('old layout', legacy_parse, names)
+    after = run('compact layout', compact_parse, names)
+    print('saving: %.0f%%' % (100 * (1 - after / before)))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    main(*([int(a) for a in args[:1]] + args[1:2]))
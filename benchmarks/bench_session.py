@@ -0,0 +1,87 @@
+"""Microbenchmark: requests/sec with a fresh http session per request (the
+old Api.request behavior) vs. the api's pooled keep-alive session.
+
+Runs against a local stub http server, so no network access is needed.
+Note that loopback connections skip the dns lookup, the network round
+trips and the tls handshake that pooling saves against the real registries,
+so the local speedup understates the real one; the connection count shows
+how many handshakes each approach pays for. Usage:
+
+    python benchmarks/bench_session.py [n_requests]
+"""
+import sys
+import json
+import time
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from r2c_isg.apis import Pypi
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    # http/1.1 so the server honors keep-alive connections
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes; without this, nagle +
+    # delayed acks add ~40ms to every keep-alive response
+    disable_nagle_algorithm = True
+    payload = json.dumps({'info': {'version': '1.0'}, 'releases': {}}).encode()
+    connections = 0
+
+    def setup(self):
+        KeepAliveHandler.connections += 1
+        super().setup()
+
+    def do_GET(self):
+        # drain the request body so the connection can be reused
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *_):
+        pass
+
+
+def fresh_session_get(url: str) -> int:
+    """Mimics the old Api.request: a new session/adapter per call."""
+    s = requests.Session()
+    retries = Retry(total=3, backoff_factor=1,
+                    status_forcelist=[502, 503, 504])
+    s.mount('', HTTPAdapter(max_retries=retries))
+    r = s.get(url, headers={}, data=json.dumps({}))
+    r.json()
+    return r.status_code
+
+
+def run(label: str, func, n: int) -> float:
+    KeepAliveHandler.connections = 0
+    start = time.perf_counter()
+    for i in range(n):
+        func(i)
+    rate = n / (time.perf_counter() - start)
+    print('%-28s %8.0f requests/sec %8d connections opened'
+          % (label, rate, KeepAliveHandler.connections))
+    return rate
+
+
+def main(n: int = 2000):
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%d/pypi/%%d/json' % httpd.server_port
+
+    api = Pypi(nocache=True)
+    before = run('fresh session per request', lambda i: fresh_session_get(url % i), n)
+    after = run('pooled api session', lambda i: api.request(url % i), n)
+    print('speedup: %.2fx' % (after / before))
+
+    httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,98 @@
+"""Microbenchmark: multi-key sorts of 1M npm packages, and of 1M versions
+(50 per package), with the old sort (one full sort of the projects, or of
+every project's versions, per key) vs. the column store (each key read
+once, one index permutation, one reorder).
+
+numpy is optional; without it, the column store sorts item indexes with
+python's list sort, and with it the permutation is a vectorized lexsort.
+Usage:
+
+    python benchmarks/bench_sort.py [n_projects]
+"""
+import io
+import sys
+import time
+import random
+from contextlib import redirect_stdout
+
+from r2c_isg.functions.sort import sort
+from r2c_isg.structures import Dataset
+from r2c_isg.structures import columns
+from r2c_isg.structures.projects import NpmPackage
+from r2c_isg.structures.versions import NpmVersion
+
+PARAMS = ['desc', 'download_count', 'asc', 'dependents_rank', 'name']
+V_PARAMS = ['desc', 'v.date', 'asc', 'v.version']
+
+
+def make_dataset(n: int, n_versions: int = 0) -> Dataset:
+    rand = random.Random(0)
+    uuids = {'name': lambda p: p.name}
+    v_uuids = {'version': lambda v: v.version}
+    ds = Dataset(registry='npm', nocache=True)
+    ds.projects = [NpmPackage(uuids_=uuids, name='package-%d' % i,
+                              dependents_rank=rand.randrange(n // 10 + 1),
+                              download_count=rand.randrange(1000))
+                   for i in range(n)]
+    for p in ds.projects:
+        p.versions = [NpmVersion(uuids_=v_uuids, version='1.%d.0' % j,
+                                 date='2019-%02d' % rand.randrange(1, 13))
+                      for j in range(n_versions)]
+    return ds
+
+
+def old_sort(ds: Dataset, params: list) -> None:
+    """Mimics the old sort: a stable sort of the objects per key, least
+    significant key first."""
+    keys, desc = [], False
+    for param in params:
+        if param in ['asc', 'desc']:
+            desc = (param == 'desc')
+        else:
+            keys.append((param, desc))
+
+    for param, desc in reversed(keys):
+        def sort_attr(o, attr=param.split('.')[-1]):
+            val = getattr(o, attr, '')
+            if isinstance(val, str):
+                val = val.lower()
+            return val
+
+        if param.startswith('v.'):
+            for p in ds.projects:
+                p.versions = sorted(p.versions, key=sort_attr, reverse=desc)
+        else:
+            ds.projects = sorted(ds.projects, key=sort_attr, reverse=desc)
+
+
+def run(label: str, func, ds: Dataset, params: list) -> list:
+    start = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        func(ds, list(params))
+    print('%-28s %6.2fs' % (label, time.perf_counter() - start))
+    return [(p.name, [v.version for v in p.versions]) for p in ds.projects]
+
+
+def compare(n: int, n_versions: int, params: list):
+    print('sorting {:,} projects ({:,} versions) by {}'.format(
+        n, n * n_versions, ' '.join(params)))
+    before = run('one sort per key', old_sort,
+                 make_dataset(n, n_versions), params)
+    after = run('column store (%s)' % ('numpy' if columns.np else 'python'),
+                sort, make_dataset(n, n_versions), params)
+    assert before == after
+
+    if columns.np:
+        np, columns.np = columns.np, None
+        run('column store (python)', sort, make_dataset(n, n_versions),
+            params)
+        columns.np = np
+
+
+def main(n: int = 1000000):
+    compare(n, 0, PARAMS)
+    compare(n // 50, 50, V_PARAMS)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
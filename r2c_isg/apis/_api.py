@@ -1,32 +1,86 @@
 import os
+import glob
+import gzip
 import json
-import shutil
 import requests
-from typing import Optional, Union
+import threading
+from typing import (Callable, Iterable, Iterator, List, Mapping, Optional,
+                    Union)
 from datetime import datetime, timedelta
 from hashlib import md5
+from urllib.parse import urlparse
 from abc import ABC, abstractmethod
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+from r2c_isg.apis.ratelimit import Cancelled
+from r2c_isg.caches import Cache, cache_map
+from r2c_isg.json_stream import JsonStream
 from r2c_isg.structures import Project
 
 
 class Api(ABC):
+    # max number of simultaneous requests to any one host (applies when
+    # projects are fetched concurrently; see Dataset.get_projects_meta)
+    max_host_concurrency = 8
+
+    # number of times a rate limited request is retried (after waiting for
+    # the limit to reset) before giving up
+    max_rate_limit_retries = 3
+
+    # response headers saved alongside each cached response
+    cached_headers = ['ETag', 'Last-Modified']
+
     def __init__(self, **kwargs):
         self.cache_dir = '.requests_cache'
+        self.cache_backend = 'sqlite'
         self.cache_timeout = timedelta(weeks=1)
         self.nocache = False
 
+        # whether api responses are trimmed to the fields the uuid/meta
+        # functions read, plus payload_fields (see _trim_payload); by
+        # default, whole payloads are kept
+        self.trim_payloads = False
+        self.payload_fields = []
+
+        # connection pool/retry policy for the api's http session
+        self.pool_size = 10
+        self.retries = 3
+        self.backoff_factor = 1
+
+        # per-host request semaphores (created on demand)
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+
+        # long-lived http session and response cache (created on demand;
+        # see _get_session and _get_cache)
+        self._session = None
+        self._cache = None
+        self._lock = threading.Lock()
+
+        # set to stop the api's requests (see cancel_requests)
+        self._cancel = threading.Event()
+
         # call update to add any user-modifiable values
         self.configure(**kwargs)
 
     def configure(self, **kwargs):
         """Populates the api with data from a dictionary."""
         # set/create the cache dir
-        self.cache_dir = kwargs.pop('cache_dir', None) or self.cache_dir
-        if not os.path.exists(self.cache_dir):
-            os.makedirs(self.cache_dir)
+        cache_dir = kwargs.pop('cache_dir', None) or self.cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        # set the cache storage format
+        cache_backend = kwargs.pop('cache_backend', None) or self.cache_backend
+        if cache_backend not in cache_map:
+            raise Exception('Invalid cache backend. Valid backends '
+                            'are: %s' % list(cache_map))
+
+        if (cache_dir, cache_backend) != (self.cache_dir, self.cache_backend):
+            # reopen the cache with the new settings on next use
+            self.cache_dir, self.cache_backend = cache_dir, cache_backend
+            self._close_cache()
 
         # set how long a cached file is valid
         self.cache_timeout = kwargs.pop('cache_timeout', None) \
@@ -35,57 +89,104 @@ class Api(ABC):
         # set nocache (can be overridden by individual requests)
         self.nocache = kwargs.pop('nocache', None) or self.nocache
 
-    def request(
+        # set which payload fields are kept (naming fields to keep turns
+        # trimming on)
+        payload_fields = kwargs.pop('payload_fields', None)
+        if payload_fields is not None:
+            self.payload_fields = list(payload_fields)
+            self.trim_payloads = bool(self.payload_fields)
+        trim_payloads = kwargs.pop('trim_payloads', None)
+        if trim_payloads is not None:
+            self.trim_payloads = trim_payloads
+
+        # set the connection pool size and retry policy (0 is a valid
+        # retry count/backoff, so only skip values that weren't provided)
+        changed = False
+        for attr in ['pool_size', 'retries', 'backoff_factor']:
+            val = kwargs.pop(attr, None)
+            if val is not None and val != getattr(self, attr):
+                setattr(self, attr, val)
+                changed = True
+        if changed:
+            # rebuild the session with the new settings on next use
+            self._close_session()
+
+    def request(self, url: str,
+                **kwargs) -> (int, Optional[Union[dict, list]]):
+        """Loads a url from cache or downloads it from the web."""
+        status, data, _ = self.request_with_headers(url, **kwargs)
+        return status, data
+
+    def request_with_headers(
             self, url: str, request_type: str = 'get',
             nocache: bool = None, cache_timeout: timedelta = None,
-            headers: dict = {}, data: dict = {}, **_
-    ) -> (int, Optional[Union[dict, list]]):
-        """Loads a url from cache or downloads it from the web."""
+            headers: dict = {}, data: dict = {},
+            projection: Callable[[dict], dict] = None, **_
+    ) -> (int, Optional[Union[dict, list]], dict):
+        """Like request, but also returns the response's headers (only the
+        cached_headers, since cached responses keep only those). If given,
+        projection trims a successful response's json (eg, to the fields
+        that are used) before it's cached and returned."""
 
-        # url + request type + headers + data uniquely identifies a
-        # request in the cache
-        uuid = '%s%s%s%s' % (url, request_type, str(headers), str(data))
-        filename = md5(uuid.encode()).hexdigest()
-        filepath = '%s/%s.json' % (self.cache_dir, filename)
+        key = self._cache_key(url, request_type, headers, data,
+                              projection.__qualname__ if projection else '')
+        cache = self._get_cache()
 
         # request-specific nocache setting overrides the api-level setting
         nocache = nocache if nocache is not None else self.nocache
+        cached = None
         if not nocache:
             # try loading the data from cache
             # use default cache timeout if caller hasn't provided one
-            cache_timeout = cache_timeout or self.cache_timeout
-            if os.path.isfile(filepath):
-                # load the file from disk
-                with open(filepath) as f:
-                    cached = json.load(f)
-                cached_date = datetime.strptime(cached['timestamp'],
-                                                '%Y-%m-%d %H:%M:%S.%f')
-
-                if datetime.utcnow() < cached_date + cache_timeout:
-                    # cached data isn't too old; return it
-                    return cached['status'], cached['json']
+            # (a zero timeout always revalidates the cached entry)
+            if cache_timeout is None:
+                cache_timeout = self.cache_timeout
+            # Note: Only the entry's metadata is read here; the (possibly
+            # huge) body is only decoded if the entry is still fresh.
+            cached = cache.get_meta(key)
+            if cached and \
+                    datetime.utcnow() < cached['timestamp'] + cache_timeout:
+                # cached data isn't too old; return it
+                return cached['status'], cache.get_body(key), \
+                       cached['headers']
 
         # get/post to request the data (if not loaded from file)
-        s = requests.Session()
-        # retry 3 times--after 0, 2, and 4 seconds--for basic connection
-        # issues (eg, DNS lookup errors) and 502/503/504
-        retries = Retry(total=3, backoff_factor=1,
-                        status_forcelist=[502, 503, 504])
-        # the first arg applies the adapter to only urls matching that
-        # prefix; in this case, we want to match all urls, so we use ''
-        s.mount('', HTTPAdapter(max_retries=retries))
-        try:
-            if request_type == 'post':
-                r = s.post(url, headers=headers, data=json.dumps(data))
-            else:
-                r = s.get(url, headers=headers, data=json.dumps(data))
-        except KeyboardInterrupt:
-            # allow ctrl-c to cancel the request
-            raise
-        except:
-            print('Warning: Could not load %s.' % url)
-            # 0 status code means error
-            return 0, None
+        s = self._get_session()
+        if cached:
+            # the cached data is stale; ask the server to send the data
+            # only if it changed since it was cached (a 304 response means
+            # it hasn't, and doesn't count against github's rate limit)
+            headers = self._revalidation_headers(headers, cached)
+        for attempt in range(self.max_rate_limit_retries + 1):
+            # wait for the api's rate limit to allow another request (and
+            # add any credentials chosen for it)
+            self._check_cancelled()
+            send_headers = dict(headers, **self._pace(url))
+            try:
+                with self._host_slot(url):
+                    if request_type == 'post':
+                        r = s.post(url, headers=send_headers,
+                                   data=json.dumps(data))
+                    else:
+                        r = s.get(url, headers=send_headers,
+                                  data=json.dumps(data))
+            except KeyboardInterrupt:
+                # allow ctrl-c to cancel the request
+                raise
+            except:
+                print('Warning: Could not load %s.' % url)
+                # 0 status code means error
+                return 0, None, {}
+
+            # rate limited responses are retried once the limit allows
+            if not self._is_rate_limited(url, r):
+                break
+
+        if r.status_code == 304 and cached:
+            # cached data is still valid; reset its age and return it
+            cached['timestamp'] = datetime.utcnow()
+            cache.touch(key, cached['timestamp'])
+            return cached['status'], cache.get_body(key), cached['headers']
 
         # get response json
         try:
@@ -93,25 +194,258 @@ class Api(ABC):
         except json.JSONDecodeError as e:
             print('Warning: Non-json response from %s.' % url)
             # 0 status code means error
-            return 0, None
+            return 0, None, {}
 
         # save the response json to cache (only 2xx response codes are cached)
+        r_headers = {k: r.headers[k] for k in self.cached_headers
+                     if k in r.headers}
         if r.status_code in range(200, 300):
-            with open(filepath, 'w') as json_file:
-                cached = {
-                    'url': url,
-                    'status': r.status_code,
-                    'timestamp': datetime.utcnow(),
-                    'json': data
-                }
-                json.dump(cached, json_file, indent=4, default=str)
+            if projection:
+                # drop unused fields before they're cached
+                data = projection(data)
+            cache.set(key, {
+                'url': url,
+                'status': r.status_code,
+                'timestamp': datetime.utcnow(),
+                'headers': r_headers,
+                'json': data
+            })
+
+        return r.status_code, data, r_headers
+
+    def request_stream(
+            self, url: str, nocache: bool = None,
+            cache_timeout: timedelta = None, headers: dict = {}, **_
+    ) -> (int, Optional[Iterator]):
+        """Gets a url whose json is a (huge) array; returns the status and
+        an iterator over the array's items, which are decoded as the
+        response downloads."""
+
+        # Note: Streamed responses are cached as raw gzipped json files in
+        # the cache dir (rather than in the cache backend, which would need
+        # the whole decoded response at once). The file's age is the
+        # cached response's age.
+        key = self._cache_key(url, 'get', headers, {}, 'stream')
+        path = os.path.join(self.cache_dir, '%s.stream.json.gz' % key)
+
+        nocache = nocache if nocache is not None else self.nocache
+        if cache_timeout is None:
+            cache_timeout = self.cache_timeout
+        if not nocache and os.path.exists(path) and datetime.utcnow() < \
+                datetime.utcfromtimestamp(os.path.getmtime(path)) \
+                + cache_timeout:
+            # cached data isn't too old; stream it from disk
+            return 200, self._stream_file(path)
+
+        s = self._get_session()
+        for attempt in range(self.max_rate_limit_retries + 1):
+            self._check_cancelled()
+            send_headers = dict(headers, **self._pace(url))
+            try:
+                with self._host_slot(url):
+                    r = s.get(url, headers=send_headers, stream=True)
+            except KeyboardInterrupt:
+                # allow ctrl-c to cancel the request
+                raise
+            except:
+                print('Warning: Could not load %s.' % url)
+                # 0 status code means error
+                return 0, None
+
+            if not self._is_rate_limited(url, r):
+                break
+            r.close()
+
+        if r.status_code != 200:
+            r.close()
+            return r.status_code, None
+
+        return r.status_code, self._stream_response(r, None if nocache
+                                                    else path)
+
+    @staticmethod
+    def _stream_file(path: str) -> Iterator:
+        """Yields the items of a cached streamed response."""
+        with gzip.open(path, 'rb') as file:
+            yield from JsonStream.from_file(file).items()
+
+    @staticmethod
+    def _stream_response(r: requests.Response,
+                         path: Optional[str]) -> Iterator:
+        """Yields the items of a streamed response, copying the raw json
+        to a cache file (if a path is given) as it goes."""
+
+        def chunks(file):
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                if file:
+                    file.write(chunk)
+                yield chunk
+
+        # write to a temporary file; it only replaces the cached one once
+        # the whole response has been read
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident()) if path \
+            else None
+        file = gzip.open(tmp_path, 'wb', compresslevel=1) if path else None
+        try:
+            yield from JsonStream(chunks(file)).items()
+            if file:
+                file.close()
+                os.replace(tmp_path, path)
 
-        return r.status_code, data
+        finally:
+            r.close()
+            if file and not file.closed:
+                # abandoned/failed; drop the partial copy
+                file.close()
+                os.remove(tmp_path)
+
+    @staticmethod
+    def _cache_key(url: str, request_type: str, headers: dict, data: dict,
+                   variant: str = '') -> str:
+        """Gets the cache key of a request."""
+        # url + request type + headers + data uniquely identifies a
+        # request in the cache (credentials don't change the response, so
+        # they're left out of the key); variant separates different
+        # treatments of the same response (eg, projected, streamed)
+        key_headers = {k: v for k, v in headers.items()
+                       if k.lower() != 'authorization'}
+        uuid = '%s%s%s%s%s' % (url, request_type, str(key_headers), str(data),
+                               variant)
+        return md5(uuid.encode()).hexdigest()
+
+    def _trim_payload(self, data: dict, *funcs: Mapping,
+                      fields: Iterable[str] = ()) -> dict:
+        """If trim_payloads is set, drops the fields of an api payload that
+        the given uuid/meta function dicts don't read and that aren't in
+        payload_fields or fields (the ones the api itself relies on)."""
+        if not self.trim_payloads:
+            return data
+
+        # Note: The fields a uuid/meta function reads are listed by its
+        # field spec, or for plain functions, are the attribute names in
+        # its code (eg, lambda p: p.html_url reads 'html_url'). If neither
+        # is available (eg, for a builtin callable), nothing is dropped.
+        keep = set(self.payload_fields).union(fields)
+        for func_dict in funcs:
+            for func in func_dict.values():
+                read = getattr(func, 'fields', None)
+                if read is None:
+                    code = getattr(getattr(func, '__func__', func),
+                                   '__code__', None)
+                    if code is None:
+                        return data
+                    read = code.co_names
+                keep.update(read)
+
+        return {k: val for k, val in data.items() if k in keep}
+
+    def cancel_requests(self) -> None:
+        """Stops the api's requests: from now on (until allow_requests),
+        requests, and waits for the rate limit, raise Cancelled. Lets a run
+        that failed or was interrupted stop its workers promptly."""
+        self._cancel.set()
+
+    def allow_requests(self) -> None:
+        """Lets requests through again after cancel_requests."""
+        self._cancel.clear()
+
+    def _check_cancelled(self) -> None:
+        """Raises Cancelled if the api's requests have been cancelled."""
+        if self._cancel.is_set():
+            raise Cancelled('Cancelled before sending a request.')
+
+    def _pace(self, url: str) -> dict:
+        """Waits until the api's rate limit allows a request to url;
+        returns any headers (eg, credentials) to send with it."""
+        # no rate limit bookkeeping by default
+        return {}
+
+    def _is_rate_limited(self, url: str, response: requests.Response) -> bool:
+        """Records a response's rate limit info; returns True if the
+        request was rejected by the rate limit (and should be retried)."""
+        # no rate limit bookkeeping by default
+        return False
+
+    def status(self) -> str:
+        """Describes the api's request budget (for progress bars)."""
+        return ''
+
+    @staticmethod
+    def _revalidation_headers(headers: dict, cached: dict) -> dict:
+        """Adds conditional request headers for a stale cache entry."""
+        headers = dict(headers)
+        if 'ETag' in cached['headers']:
+            headers['If-None-Match'] = cached['headers']['ETag']
+        if 'Last-Modified' in cached['headers']:
+            headers['If-Modified-Since'] = cached['headers']['Last-Modified']
+
+        return headers
+
+    def _get_session(self) -> requests.Session:
+        """Gets the api's http session, creating it if necessary."""
+        with self._lock:
+            if self._session is None:
+                s = requests.Session()
+                # retry (by default 3 times--after 0, 2, and 4 seconds) for
+                # basic connection issues (eg, DNS lookup errors) and
+                # 502/503/504
+                retries = Retry(total=self.retries,
+                                backoff_factor=self.backoff_factor,
+                                status_forcelist=[502, 503, 504])
+                # keep up to pool_size connections alive per host, so
+                # requests reuse tcp/tls connections; the first arg
+                # applies the adapter to only urls matching that prefix;
+                # in this case, we want to match all urls, so we use ''
+                s.mount('', HTTPAdapter(pool_connections=self.pool_size,
+                                        pool_maxsize=self.pool_size,
+                                        max_retries=retries))
+                self._session = s
+
+            return self._session
+
+    def _close_session(self) -> None:
+        """Closes the api's http session (and its pooled connections)."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def _host_slot(self, url: str) -> threading.BoundedSemaphore:
+        """Gets the semaphore capping concurrent requests to url's host."""
+        host = urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(
+                    self.max_host_concurrency)
+            return self._host_slots[host]
+
+    def _get_cache(self) -> Cache:
+        """Gets the api's response cache, opening it if necessary."""
+        with self._lock:
+            if self._cache is None:
+                if self.cache_backend == 'sqlite':
+                    _hint_migration(self.cache_dir)
+                self._cache = cache_map[self.cache_backend](self.cache_dir)
+
+            return self._cache
+
+    def _close_cache(self) -> None:
+        """Flushes and closes the api's response cache."""
+        with self._lock:
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+
+    def flush_cache(self):
+        """Writes any buffered cache entries to disk."""
+        self._get_cache().flush()
 
     def clear_cache(self):
-        """Deletes all cached files."""
-        shutil.rmtree(self.cache_dir)
-        os.mkdir(self.cache_dir)
+        """Deletes all cached responses."""
+        self._get_cache().clear()
+        for path in glob.glob(os.path.join(self.cache_dir,
+                                           '*.stream.json.gz')):
+            os.remove(path)
 
     @abstractmethod
     def get_project(self, project: Project, **kwargs) -> None: pass
@@ -120,5 +454,82 @@ class Api(ABC):
     def get_versions(self, project: Project,
                      hist: str = 'all', **kwargs) -> None: pass
 
+    def get_project_and_versions(self, project: Project,
+                                 historical: str = 'all', **kwargs) -> None:
+        """Gets a project's metadata and versions. Apis whose metadata
+        and versions come from the same response override this to make a
+        single request."""
+        self.get_project(project, **kwargs)
+        self.get_versions(project, historical=historical, **kwargs)
+
+    def get_changed_projects(
+            self, projects: List[Project],
+            checkpoint: Optional[Union[int, str]] = None
+    ) -> (Optional[List[Project]], Optional[Union[int, str]]):
+        """Picks the projects the registry's change feed lists as changed
+        since a checkpoint. Returns them (or None if all of the projects
+        need refreshing--ie, the registry has no change feed or there's no
+        checkpoint yet) and the feed's new checkpoint."""
+        # no change feed by default
+        return None, None
+
+    def __getstate__(self):
+        # locks/sessions/caches can't be pickled/copied; they're recreated
+        # on restore (make sure buffered cache writes hit the disk first)
+        if self.__dict__.get('_cache') is not None:
+            self._cache.flush()
+
+        state = self.__dict__.copy()
+        for attr in ['_host_slots', '_host_slots_lock',
+                     '_session', '_cache', '_lock', '_cancel']:
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        # fill in settings missing from backups made by older versions
+        self.cache_backend = 'sqlite'
+        self.trim_payloads = False
+        self.payload_fields = []
+        self.pool_size = 10
+        self.retries = 3
+        self.backoff_factor = 1
+
+        self.__dict__.update(state)
+        # (older versions marked whole payloads as None, or trimmed them
+        # unless full_payloads was set)
+        if self.payload_fields is None:
+            self.payload_fields = []
+        if 'full_payloads' in state:
+            del self.full_payloads
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+        self._session = None
+        self._cache = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
     def __repr__(self):
         return self.__class__.__name__
+
+
+# cache dirs whose old-format responses have been pointed out
+_hinted_dirs = set()
+
+
+def _hint_migration(cache_dir: str) -> None:
+    """Points out an old-format cache (ie, one json file per response,
+    which the sqlite backend doesn't read) the first time a sqlite cache
+    would be made next to it."""
+    from r2c_isg.caches import SqliteCache
+
+    if cache_dir in _hinted_dirs or not os.path.isdir(cache_dir) or \
+            os.path.exists(os.path.join(cache_dir, SqliteCache.filename)):
+        return
+    _hinted_dirs.add(cache_dir)
+
+    # Note: Only the first match is needed, so the dir isn't listed in full.
+    with os.scandir(cache_dir) as entries:
+        if any(e.name.endswith('.json') for e in entries):
+            print(' ' * 9 + "Note: %s holds an old 'dir' format cache, which "
+                  'the sqlite backend ignores; run "migrate-cache dir '
+                  'sqlite" to reuse its responses.' % cache_dir)
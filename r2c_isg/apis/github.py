@@ -1,45 +1,117 @@
-from typing import Optional, Union
+import os
+import requests
+from datetime import timedelta
+from typing import Iterator, List, Optional, Union
 from itertools import count
 from tqdm import tqdm
 
 from r2c_isg.apis import Api
+from r2c_isg.apis.ratelimit import TokenPool
+from r2c_isg.structures.field_spec import field_specs
 from r2c_isg.structures.projects import GithubRepo
 from r2c_isg.structures.versions import GithubCommit
 
 MAX_RETRY_COUNT = 3
 
+# uuid functions of the commits the api creates (shared by all of them)
+COMMIT_UUIDS, _ = field_specs('''
+    uuid commit = attr "sha"
+''')
+
+# graphql query for a page of a repo's commit history (newest first)
+COMMIT_HISTORY_QUERY = """
+query($owner: String!, $name: String!, $first: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    defaultBranchRef {
+      target {
+        ... on Commit {
+          history(first: $first, after: $cursor) {
+            pageInfo { hasNextPage endCursor }
+            nodes { oid committedDate }
+          }
+        }
+      }
+    }
+  }
+}
+"""
+
 class Github(Api):
+    # github asks that clients avoid hammering the api with concurrent
+    # requests (which can trigger its secondary rate limits)
+    max_host_concurrency = 4
+
+    # github pages list responses; the Link header points to the other pages
+    cached_headers = Api.cached_headers + ['Link']
+
+    # github's separately metered rate limit budgets (the search and
+    # graphql apis are metered apart from the rest of the api)
+    rate_limit_resources = ['core', 'search', 'graphql']
+
+    # how commit histories are fetched: 'graphql' (100 commits/request,
+    # needs a personal access token) or 'rest'
+    commits_api = 'graphql'
+    commits_apis = ['graphql', 'rest']
+
     def __init__(self, **kwargs):
         # set base url for github's api
         self._base_api_url = 'https://api.github.com'
 
-        # set the default github personal access token
-        self.github_pat = None
-        
+        # set the default github personal access tokens (a comma-separated
+        # list may also be given in the GITHUB_PAT environment variable)
+        self.github_pats = self._parse_pats(os.getenv('GITHUB_PAT'))
+
         # retry count per url
         self.retry_count = {}
+
+        # request scheduler spreading requests over the tokens' budgets
+        self._token_pool = TokenPool(self.github_pats,
+                                     self.rate_limit_resources)
         super().__init__(**kwargs)
 
     def configure(self, **kwargs):
         """Populates the github api with data from a dictionary."""
         super().configure(**kwargs)
 
-        # set the personal access token
-        self.github_pat = kwargs.pop('github_pat', None) or self.github_pat
+        # set the commit history api
+        commits_api = kwargs.pop('commits_api', None)
+        if commits_api:
+            if commits_api not in self.commits_apis:
+                raise Exception('Invalid commits api. Valid apis '
+                                'are: %s' % self.commits_apis)
+            self.commits_api = commits_api
+
+        # set the personal access token(s)
+        pats = self._parse_pats(kwargs.pop('github_pat', None))
+        if pats and pats != self.github_pats:
+            self.github_pats = pats
+            self._token_pool = TokenPool(self.github_pats,
+                                         self.rate_limit_resources)
 
-    def request(self, url: str, headers: dict = {},
-                **kwargs) -> (int, Optional[Union[dict, list]]):
-        """Manages API rate limitations before calling super().request()."""
+    @staticmethod
+    def _parse_pats(pats: Optional[Union[str, List[str]]]) -> List[str]:
+        """Converts a token or list of tokens (or a comma-separated string
+        of tokens) to a list of tokens."""
+        if not pats:
+            return []
+        if isinstance(pats, str):
+            pats = pats.split(',')
 
-        # add github personal access token to request headers
-        if self.github_pat:
-            headers['Authorization'] = 'token %s' % self.github_pat
+        return [pat.strip() for pat in pats if pat and pat.strip()]
+
+    def request_with_headers(
+            self, url: str, **kwargs
+    ) -> (int, Optional[Union[dict, list]], dict):
+        """Manages API rate limitations after calling
+        super().request_with_headers()."""
 
         # get the response code/data
-        status, data = super().request(url, headers=headers, **kwargs)
+        # Note: The personal access token is added per request by _pace(),
+        # which picks the token with the most budget left.
+        status, data, headers = super().request_with_headers(url, **kwargs)
 
-        # Note: Github's api limits requests to 5,000/hour if the
-        # requester is authenticated, and 60/hour if not. See:
+        # Note: Github's api limits requests to 5,000/hour per personal
+        # access token, and 60/hour if unauthenticated. See:
         # https://developer.github.com/v3/#rate-limiting
         if self._base_api_url in url:
             if status == 401:
@@ -47,12 +119,12 @@ class Github(Api):
                 raise Exception('Incorrect/invalid personal access token. '
                                 'Please double check your token and try again')
             elif status == 403:
-                # rate limiting--critical error
+                # rate limiting that outlasted all retries--critical error
                 raise Exception(
                     'The github api is limiting your request rate (HTTP %d). '
                     '%s' % (
                         status,
-                        'Please try again in an hour.' if self.github_pat else
+                        'Please try again in an hour.' if self.github_pats else
                         'You can provide a github personal access token '
                         '(using the command "set-api --github_pat TOKEN") to '
                         'obtain a significantly higher request rate limit. '
@@ -61,9 +133,71 @@ class Github(Api):
                         'the-command-line.'
                     ))
 
-        return status, data
+        return status, data, headers
 
-    def _make_api_url(self, project: GithubRepo) -> str:
+    def _rate_limit_resource(self, url: str) -> Optional[str]:
+        """Gets the rate limit budget url counts against."""
+        if self._base_api_url not in url:
+            # not an api url (eg, a raw file); not rate limited
+            return None
+        elif '/search/' in url:
+            return 'search'
+        elif url.rstrip('/').endswith('/graphql'):
+            return 'graphql'
+        return 'core'
+
+    def _pace(self, url: str) -> dict:
+        """Waits until one of the tokens' rate limits allows a request to
+        url; returns the authorization header for that token."""
+        resource = self._rate_limit_resource(url)
+        if not resource:
+            return {}
+
+        pat = self._token_pool.acquire(resource, self._cancel)
+        return {'Authorization': 'token %s' % pat} if pat else {}
+
+    def _is_rate_limited(self, url: str, response: requests.Response) -> bool:
+        """Reads github's rate limit headers from a response; returns True
+        if the request was rejected by a rate limit."""
+        resource = self._rate_limit_resource(url)
+        if not resource:
+            return False
+
+        # Note: Every response carries the budget left in the token's
+        # current window (X-RateLimit-Remaining) and when it resets.
+        # Secondary rate limits (eg, too many concurrent requests) instead
+        # send a Retry-After header. Either way, the token pool holds back
+        # that token until it's allowed again. See:
+        # https://developer.github.com/v3/#rate-limiting
+        auth = response.request.headers.get('Authorization', '')
+        pat = auth[len('token '):] if auth else None
+        self._token_pool.update(pat, resource, response.headers)
+
+        if response.status_code in [403, 429] and (
+                response.headers.get('X-RateLimit-Remaining') == '0'
+                or 'Retry-After' in response.headers):
+            print(' ' * 9 + 'Warning: The github api is limiting your request '
+                            'rate; waiting to retry (%s).'
+                  % self._token_pool.status(resource))
+            return True
+
+        return False
+
+    def status(self) -> str:
+        """Describes the remaining github api budget."""
+        return self._token_pool.status('core')
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+
+        # convert backups made by older versions (single token, no pool)
+        if 'github_pat' in state:
+            self.github_pats = self._parse_pats(self.__dict__.pop('github_pat'))
+        if '_token_pool' not in state:
+            self._token_pool = TokenPool(self.github_pats,
+                                         self.rate_limit_resources)
+
+    def _get_org_and_name(self, project: GithubRepo) -> (str, str):
         if 'name' in project.uuids_ and 'org' in project.meta_:
             name = project.uuids_['name']()
             org = project.meta_['org']()
@@ -74,7 +208,11 @@ class Github(Api):
             name = project.get_name()
             org = url.strip('/').split('/')[-2]
 
-        return '%s/repos/%s/%s' % (self._base_api_url, org, name)
+        return org, name
+
+    def _make_api_url(self, project: GithubRepo) -> str:
+        return '%s/repos/%s/%s' % ((self._base_api_url,)
+                                   + self._get_org_and_name(project))
 
     def get_project(self, project: GithubRepo, **kwargs) -> None:
         """Gets a repo's metadata."""
@@ -94,21 +232,88 @@ class Github(Api):
         data['api_url'] = data.pop('url', '')
 
         # update the project
-        project.update(**data)
+        project.update(**self._trim_payload(data, project._uuid_funcs,
+                                            project._meta_funcs))
 
-    def get_versions(self, project: GithubRepo,
-                     historical: str = 'all', **kwargs) -> None:
-        """Gets a repo's commits."""
+    def get_versions(self, project: GithubRepo, historical: str = 'all',
+                     incremental: bool = False, **kwargs) -> None:
+        """Gets a repo's commits. If incremental, only the commits newer
+        than the ones the repo already has are fetched."""
+
+        # Note: Commits come newest first, so an incremental refresh stops
+        # at the first page holding an already-known commit. Those first
+        # pages are likely to have changed, so cached copies of them are
+        # always revalidated (an unchanged page costs a 304, which doesn't
+        # count against github's rate limit).
+        incremental = incremental and historical != 'latest' \
+                      and bool(project.versions)
+        if incremental:
+            kwargs['cache_timeout'] = timedelta(0)
+        n_known = len(project.versions)
+
+        # Note: The graphql api needs a personal access token; without one
+        # (or if it fails), the commits are paged through the rest api.
+        if self.commits_api == 'graphql' and self.github_pats:
+            pages = self._get_graphql_commit_pages(project, historical,
+                                                   **kwargs)
+            resource = 'graphql'
+        else:
+            pages = self._get_rest_commit_pages(project, **kwargs)
+            resource = 'core'
 
-        # github commit json is paginated--30 commits per page
-        api_url = self._make_api_url(project)
         desc = '             %s' % project.get_name()
-        iterator = tqdm(count(start=1), leave=False, unit='page', desc=desc)
-        for i in iterator:
+        iterator = tqdm(pages, leave=False, unit='page', desc=desc)
+        for data in iterator:
+            iterator.set_postfix_str(self._token_pool.status(resource),
+                                     refresh=False)
+
+            if historical == 'latest':
+                # trim the new versions data to the latest commit only
+                data = data[:1]
+
+            reached_known = False
+            for v_data in data:
+                # (the commit's date is kept, as it's what the graphql
+                # query fetches besides the sha)
+                v_data = self._trim_payload(v_data, COMMIT_UUIDS,
+                                            fields=['commit'])
+                commit = project.find_version(**v_data)
+                if historical == 'latest':
+                    # trim existing commits to the latest commit only
+                    project.versions = [commit] if commit else []
+
+                if commit:
+                    # update the existing commit
+                    project.update_version(commit, **v_data)
+                    reached_known = True
+
+                else:
+                    # create a new commit
+                    commit = GithubCommit(uuids_=COMMIT_UUIDS, **v_data)
+                    project.versions.append(commit)
+
+            if historical == 'latest' or (incremental and reached_known):
+                # stop after the first page of results (or once the rest
+                # of the history is already known)
+                iterator.close()
+                break
+
+        if incremental and len(project.versions) > n_known:
+            # the new commits are newer than the known ones; move them
+            # to the front
+            project.versions = project.versions[n_known:] \
+                               + project.versions[:n_known]
+
+    def _get_rest_commit_pages(self, project: GithubRepo,
+                               **kwargs) -> Iterator[list]:
+        """Yields pages of a repo's commits from the rest api."""
+
+        # github commit json is paginated--up to 100 commits per page
+        api_url = self._make_api_url(project)
+        for i in count(start=1):
             # load the url from cache or from the web
-            url = '%s/commits?page=%d' % (api_url, i)
+            url = '%s/commits?per_page=100&page=%d' % (api_url, i)
             status, data = self.request(url, **kwargs)
-            i += 1
             # return if 400x or 300x-s
             if status > 300 and status < 500:
                 print(' ' * 9 + 'Warning: Github api returned (HTTP: %d) for url %s;'
@@ -125,33 +330,55 @@ class Github(Api):
                 else:
                     return
             if not data:
-                # no more pages; break
-                iterator.close()
-                break
+                # no more pages
+                return
 
-            if historical == 'latest':
-                # trim the new versions data to the latest commit only
-                data = data[:1]
+            yield data
 
-            for v_data in data:
-                commit = project.find_version(**v_data)
-                if historical == 'latest':
-                    # trim existing commits to the latest commit only
-                    project.versions = [commit] if commit else []
+    def _get_graphql_commit_pages(self, project: GithubRepo,
+                                  historical: str = 'all',
+                                  **kwargs) -> Iterator[list]:
+        """Yields pages of a repo's commits from the graphql api."""
 
-                if commit:
-                    # update the existing commit
-                    commit.update(**v_data)
+        # Note: The graphql api pages through the default branch's history
+        # with a cursor, 100 commits at a time, and returns only the fields
+        # asked for (the sha and commit date). The commits are shaped like
+        # the rest api's (eg, {'sha': ..., 'commit': {'committer': {'date':
+        # ...}}}), so they're interchangeable with rest-loaded ones.
+        # See: https://developer.github.com/v4/object/commit/
+        org, name = self._get_org_and_name(project)
+        url = '%s/graphql' % self._base_api_url
+        variables = {
+            'owner': org,
+            'name': name,
+            'first': 1 if historical == 'latest' else 100,
+            'cursor': None
+        }
+        while True:
+            status, data = self.request(url, request_type='post',
+                                        data={'query': COMMIT_HISTORY_QUERY,
+                                              'variables': variables},
+                                        **kwargs)
+            try:
+                history = data['data']['repository']['defaultBranchRef'][
+                    'target']['history']
+            except (KeyError, TypeError):
+                # error response (eg, the repo doesn't exist or is empty)
+                errors = data.get('errors') if isinstance(data, dict) else None
+                print(' ' * 9 + 'Warning: Unexpected response from github '
+                                'graphql api (HTTP %d%s); falling back to the '
+                                'rest api for %s.'
+                      % (status, '; %s' % errors[0].get('message')
+                         if errors else '', project.get_name()))
+                yield from self._get_rest_commit_pages(project, **kwargs)
+                return
 
-                else:
-                    # create a new commit
-                    uuids = {
-                        'commit': lambda v: v.sha
-                    }
-                    commit = GithubCommit(uuids_=uuids, **v_data)
-                    project.versions.append(commit)
+            yield [{'sha': c['oid'],
+                    'commit': {'committer': {'date': c['committedDate']}}}
+                   for c in history['nodes']]
 
-            if historical == 'latest':
-                # stop after the first page of results
-                iterator.close()
-                break
+            if not history['pageInfo']['hasNextPage']:
+                # no more pages
+                return
+            variables = dict(variables,
+                             cursor=history['pageInfo']['endCursor'])
@@ -1,17 +1,48 @@
-from typing import Optional, Union
+from typing import List, Optional, Union
 
 from r2c_isg.apis import Api
+from r2c_isg.structures.field_spec import field_specs
 from r2c_isg.structures.projects import NpmPackage
 from r2c_isg.structures.versions import NpmVersion
 
+# media type of the registry's abbreviated package metadata
+ABBREVIATED_METADATA = 'application/vnd.npm.install-v1+json'
+
+# uuid functions of the versions the api creates (shared by all of them)
+VERSION_UUIDS, _ = field_specs('''
+    uuid version = attr "version"
+''')
+
 
 class Npm(Api):
+    # number of change feed entries requested at once
+    changes_page_size = 10000
+
+    # packument fields kept (per version and overall) when versions are
+    # fetched as abbreviated metadata (see get_versions); versions also
+    # keep these (plus their date) when payloads are trimmed
+    version_fields = ['version', 'dist', 'deprecated']
+    packument_fields = ['name', 'dist-tags', 'modified', 'time']
+
     def __init__(self, **kwargs):
+        # fetch versions as abbreviated metadata (see get_versions)
+        self.abbreviated = False
+
         super().__init__(**kwargs)
 
         # set the base url for npm's api
         self._base_api_url = 'https://registry.npmjs.com'
 
+        # set the url of the registry's couchdb replica (for its change feed)
+        self._replicate_url = 'https://replicate.npmjs.com'
+
+    def configure(self, **kwargs):
+        """Populates the npm api with data from a dictionary."""
+        super().configure(**kwargs)
+
+        # set whether versions are fetched as abbreviated metadata
+        self.abbreviated = kwargs.pop('abbreviated', None) or self.abbreviated
+
     def request(self, url, **kwargs) -> (int, Optional[Union[dict, list]]):
         """Manages API rate limitations before calling super().request()."""
 
@@ -43,46 +74,140 @@ class Npm(Api):
         """Gets a package's metadata."""
 
         # load the url from cache or the web
-        url = self._make_api_url(project)
-        status, data = self.request(url, **kwargs)
-
-        # skip this project if non-200 response (just return now)
-        if status != 200:
-            print(' ' * 9 + 'Warning: Unexpected response from npm registry '
-                            '(HTTP %d); failed to retrieve metadata for %s.'
-                  % (status, project.get_name()))
-            return
-
-        # ignore version-related data--use get_versions() for that
-        data.pop('versions', None)
-
-        # update the project
-        project.update(**data)
+        data = self._request_package(project, 'metadata', **kwargs)
+        if data is not None:
+            self._update_project(project, data)
 
     def get_versions(self, project: NpmPackage,
                      historical: str = 'all', **kwargs) -> None:
         """Gets a version's historical releases."""
 
+        if self.abbreviated:
+            # Note: The full packument includes readmes and every version's
+            # complete package.json, which can add up to tens of megabytes;
+            # the abbreviated "install" metadata holds just what installers
+            # need. Of that, only the version strings, dist info,
+            # deprecation notices and dates (if there's a time map) are
+            # kept. See: https://github.com/npm/registry/blob/master/
+            # docs/responses/package-metadata.md#abbreviated-metadata-format
+            kwargs = dict(kwargs, projection=self._slim_packument,
+                          headers={'Accept': ABBREVIATED_METADATA})
+
         # load the url from cache or from the web
+        data = self._request_package(project, 'versions', **kwargs)
+        if data is not None:
+            self._update_versions(project, data, historical)
+
+    def get_project_and_versions(self, project: NpmPackage,
+                                 historical: str = 'all', **kwargs) -> None:
+        """Gets a package's metadata and historical releases from a single
+        request (both live in the same packument)."""
+
+        # load the url from cache or the web
+        data = self._request_package(project, 'metadata and versions',
+                                     **kwargs)
+        if data is not None:
+            # versions first; updating the project consumes the data
+            self._update_versions(project, data, historical)
+            self._update_project(project, data)
+
+    def _request_package(self, project: NpmPackage, what: str,
+                         **kwargs) -> Optional[dict]:
+        """Requests a package's packument; returns None on failure."""
+
         url = self._make_api_url(project)
         status, data = self.request(url, **kwargs)
 
         # skip this project if non-200 response (just return now)
         if status != 200:
             print(' ' * 9 + 'Warning: Unexpected response from npm registry '
-                            '(HTTP %d); failed to retrieve versions for %s.'
-                  % (status, project.get_name()))
-            return
+                            '(HTTP %d); failed to retrieve %s for %s.'
+                  % (status, what, project.get_name()))
+            return None
+
+        return data
+
+    def get_changed_projects(
+            self, projects: List[NpmPackage],
+            checkpoint: Optional[Union[int, str]] = None
+    ) -> (Optional[List[NpmPackage]], Optional[Union[int, str]]):
+        """Picks the packages changed since a checkpoint (a sequence number
+        in the registry's change feed)."""
+
+        # Note: The registry is a couchdb database; its _changes feed lists
+        # every package change in order, each with a sequence number. See:
+        # https://github.com/npm/registry/blob/master/docs/REPLICATE-API.md
+        # https://docs.couchdb.org/en/stable/api/database/changes.html
+        if checkpoint is None:
+            # no checkpoint yet; start the feed from its current end
+            status, data = self.request(self._replicate_url, nocache=True)
+            if status != 200:
+                print(' ' * 9 + 'Warning: Unexpected response from npm '
+                                'replicate api (HTTP %d); failed to read the '
+                                'change feed.' % status)
+                return None, None
+            return None, data['update_seq']
+
+        # page through the changes since the checkpoint
+        changed = set()
+        while True:
+            url = '%s/_changes?since=%s&limit=%d' % (
+                self._replicate_url, checkpoint, self.changes_page_size)
+            status, data = self.request(url, nocache=True)
+            if status != 200:
+                print(' ' * 9 + 'Warning: Unexpected response from npm '
+                                'replicate api (HTTP %d); failed to read the '
+                                'change feed.' % status)
+                return None, None
+
+            changed.update(change['id'] for change in data['results'])
+            checkpoint = data['last_seq']
+            if len(data['results']) < self.changes_page_size:
+                # reached the end of the feed
+                break
+
+        return [p for p in projects if p.get_name() in changed], checkpoint
+
+    @classmethod
+    def _slim_packument(cls, data: dict) -> dict:
+        """Drops the packument fields that versions don't use."""
+        slim = {k: data[k] for k in cls.packument_fields if k in data}
+        slim['versions'] = {
+            v_str: {k: v_data[k] for k in cls.version_fields if k in v_data}
+            for v_str, v_data in data.get('versions', {}).items()
+        }
+
+        return slim
+
+    def _update_project(self, project: NpmPackage, data: dict) -> None:
+        """Updates a package with the metadata in its packument."""
+
+        # ignore version-related data--use get_versions() for that
+        data.pop('versions', None)
 
-        # get the versions list from the data
+        # update the project
+        project.update(**self._trim_payload(data, project._uuid_funcs,
+                                            project._meta_funcs))
+
+    def _update_versions(self, project: NpmPackage, data: dict,
+                         historical: str) -> None:
+        """Updates a package's versions from its packument."""
+
+        # get the versions list from the data, and their publish dates
+        # (which live apart from them, in the packument's time map)
         versions = data['versions']
+        times = data.get('time') or {}
 
         if historical == 'latest':
             # trim the new versions data to the latest version only
             latest_key = data['dist-tags']['latest']
             versions = {latest_key: versions[latest_key]}
 
-        for _, v_data in versions.items():
+        for v_str, v_data in versions.items():
+            if v_str in times:
+                v_data = dict(v_data, date=times[v_str])
+            v_data = self._trim_payload(v_data, VERSION_UUIDS,
+                                        fields=self.version_fields + ['date'])
             version = project.find_version(**v_data)
             if historical == 'latest':
                 # trim existing versions to the version release only
@@ -90,12 +215,15 @@ class Npm(Api):
 
             if version:
                 # update the existing version
-                version.update(**v_data)
+                project.update_version(version, **v_data)
 
             else:
                 # create a new version
-                uuids = {
-                    'version': lambda v: v.version
-                }
-                version = NpmVersion(uuids_=uuids, **v_data)
+                version = NpmVersion(uuids_=VERSION_UUIDS, **v_data)
                 project.versions.append(version)
+
+    def __setstate__(self, state):
+        # fill in settings missing from backups made by older versions
+        self._replicate_url = 'https://replicate.npmjs.com'
+        self.abbreviated = False
+        super().__setstate__(state)
@@ -1,9 +1,17 @@
-from typing import Optional, Union
+import re
+import xmlrpc.client
+from typing import List, Optional, Union
 
 from r2c_isg.apis import Api
+from r2c_isg.structures.field_spec import field_specs
 from r2c_isg.structures.projects import PypiProject
 from r2c_isg.structures.versions import PypiRelease
 
+# uuid functions of the versions the api creates (shared by all of them)
+VERSION_UUIDS, _ = field_specs('''
+    uuid version = attr "version"
+''')
+
 
 class Pypi(Api):
     def __init__(self, **kwargs):
@@ -35,15 +43,86 @@ class Pypi(Api):
         """Gets a project's metadata."""
 
         # load the url from cache or the web
+        data = self._request_project(project, 'metadata', **kwargs)
+        if data is not None:
+            self._update_project(project, data)
+
+    def get_versions(self, project: PypiProject,
+                     historical: str = 'all', **kwargs) -> None:
+        """Gets a project's historical releases."""
+
+        # load the url from cache or from the web
+        data = self._request_project(project, 'versions', **kwargs)
+        if data is not None:
+            self._update_versions(project, data, historical)
+
+    def get_project_and_versions(self, project: PypiProject,
+                                 historical: str = 'all', **kwargs) -> None:
+        """Gets a project's metadata and historical releases from a single
+        request (both live in the same json document)."""
+
+        # load the url from cache or the web
+        data = self._request_project(project, 'metadata and versions',
+                                     **kwargs)
+        if data is not None:
+            # versions first; updating the project consumes the data
+            self._update_versions(project, data, historical)
+            self._update_project(project, data)
+
+    def _request_project(self, project: PypiProject, what: str,
+                         **kwargs) -> Optional[dict]:
+        """Requests a project's json document; returns None on failure."""
+
         url = self._make_api_url(project)
         status, data = self.request(url, **kwargs)
 
         # skip this project if non-200 response (just return now)
         if status != 200:
             print(' ' * 9 + 'Warning: Unexpected response from pypi api '
-                            '(HTTP %d); failed to retrieve metadata for %s.'
-                  % (status, project.get_name()))
-            return
+                            '(HTTP %d); failed to retrieve %s for %s.'
+                  % (status, what, project.get_name()))
+            return None
+
+        return data
+
+    def get_changed_projects(
+            self, projects: List[PypiProject],
+            checkpoint: Optional[Union[int, str]] = None
+    ) -> (Optional[List[PypiProject]], Optional[Union[int, str]]):
+        """Picks the projects changed since a checkpoint (a serial number
+        in pypi's changelog)."""
+
+        # Note: Every change to pypi (eg, a new release or file) gets an
+        # incrementing serial number; the xml-rpc api lists the changes
+        # since a serial. See:
+        # https://warehouse.readthedocs.io/api-reference/xml-rpc/#mirroring-support
+        client = xmlrpc.client.ServerProxy('%s/pypi' % self._base_api_url)
+        try:
+            if checkpoint is None:
+                # no checkpoint yet; start the changelog from its current end
+                return None, client.changelog_last_serial()
+
+            # changes are (name, version, timestamp, action, serial) tuples
+            changes = client.changelog_since_serial(int(checkpoint))
+
+        except (xmlrpc.client.Error, OSError) as e:
+            print(' ' * 9 + 'Warning: Failed to read the pypi changelog '
+                            '(%s).' % e)
+            return None, None
+
+        changed = {self._normalize(c[0]) for c in changes}
+        checkpoint = max([c[4] for c in changes], default=int(checkpoint))
+        return [p for p in projects
+                if self._normalize(p.get_name()) in changed], checkpoint
+
+    @staticmethod
+    def _normalize(name: str) -> str:
+        """Normalizes a project name (pypi names are case-insensitive and
+        treat runs of '-', '_' and '.' alike; see pep 503)."""
+        return re.sub(r'[-_.]+', '-', name).lower()
+
+    def _update_project(self, project: PypiProject, data: dict) -> None:
+        """Updates a project with the metadata in its json document."""
 
         # ignore version-related data--use get_versions() for that
         data.pop('releases', None)
@@ -53,22 +132,12 @@ class Pypi(Api):
             data[k] = v
 
         # update the project
-        project.update(**data)
+        project.update(**self._trim_payload(data, project._uuid_funcs,
+                                            project._meta_funcs))
 
-    def get_versions(self, project: PypiProject,
-                     historical: str = 'all', **kwargs) -> None:
-        """Gets a project's historical releases."""
-
-        # load the url from cache or from the web
-        url = self._make_api_url(project)
-        status, data = self.request(url, **kwargs)
-
-        # skip this project if non-200 response (just return now)
-        if status != 200:
-            print(' ' * 9 + 'Warning: Unexpected response from pypi api '
-                            '(HTTP %d); failed to retrieve versions for %s.'
-                  % (status, project.get_name()))
-            return
+    def _update_versions(self, project: PypiProject, data: dict,
+                         historical: str) -> None:
+        """Updates a project's releases from its json document."""
 
         # get the releases list from the data
         releases = data['releases']
@@ -95,6 +164,7 @@ class Pypi(Api):
             v_data['version'] = v_str
 
             # add the data to the version
+            v_data = self._trim_payload(v_data, VERSION_UUIDS)
             release = project.find_version(**v_data)
             if historical == 'latest':
                 # trim existing releases to the latest release only
@@ -102,12 +172,9 @@ class Pypi(Api):
 
             if release:
                 # update the existing release
-                release.update(**v_data)
+                project.update_version(release, **v_data)
 
             else:
                 # create a new release
-                uuids = {
-                    'version': lambda v: v.version
-                }
-                release = PypiRelease(uuids_=uuids, **v_data)
+                release = PypiRelease(uuids_=VERSION_UUIDS, **v_data)
                 project.versions.append(release)
@@ -0,0 +1,234 @@
+import time
+import threading
+from typing import List, Mapping, Optional
+
+
+class Cancelled(Exception):
+    """Raised in place of a request once the api's requests have been
+    cancelled (see Api.cancel_requests)."""
+    pass
+
+
+class RateLimiter(object):
+    """Paces requests against an api's published rate limit budget.
+
+    The budget is read from the X-RateLimit-* headers of every response
+    (see update). Requests pass freely while plenty of budget is left; once
+    it drops below the reserve, they're spread evenly over the time left
+    until the budget resets, and when it runs out they wait for the reset.
+    A Retry-After header (eg, github's secondary rate limits) pauses all
+    requests for the given number of seconds.
+    """
+
+    def __init__(self, reserve: float = 0.1):
+        # fraction of the budget below which requests are paced
+        self.reserve = reserve
+
+        self.limit = None           # requests allowed per window
+        self.remaining = None       # requests left in this window
+        self.reset = None           # epoch time the window resets at
+        self.blocked_until = 0.0    # epoch time a Retry-After ends at
+        self.next_at = 0.0          # epoch time the next paced request may go
+        self.waiting = 0            # requests currently held back
+
+        self._lock = threading.Lock()
+
+    def acquire(self, cancel: threading.Event = None) -> None:
+        """Blocks until a request may be sent, then spends one unit of
+        budget on it. Setting cancel (eg, on ctrl-c) ends the wait with
+        Cancelled."""
+        counted = False
+        try:
+            while True:
+                with self._lock:
+                    now = time.time()
+                    delay = self._delay(now)
+                    if delay <= 0:
+                        self._spend(now)
+                        return
+
+                    if not counted:
+                        self.waiting += 1
+                        counted = True
+
+                # Note: The wait can last until the budget resets (up to an
+                # hour), so it's cut short if the run is cancelled.
+                if cancel is None:
+                    time.sleep(min(delay, 60))
+                elif cancel.wait(min(delay, 60)):
+                    raise Cancelled('Cancelled while waiting for the rate '
+                                    'limit to allow a request.')
+
+        finally:
+            if counted:
+                with self._lock:
+                    self.waiting -= 1
+
+    def delay(self) -> float:
+        """Gets how long a request would currently have to wait."""
+        with self._lock:
+            return max(self._delay(time.time()), 0)
+
+    def _delay(self, now: float) -> float:
+        """Gets how long to wait before sending a request (the caller must
+        hold the lock)."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+
+        if self.remaining is None or self.reset is None or now >= self.reset:
+            # no (current) budget info; let the request through
+            return 0
+
+        if self.remaining <= 0:
+            # budget spent; wait for the reset (plus a little clock slack)
+            return self.reset - now + 1
+
+        return self.next_at - now
+
+    def _spend(self, now: float) -> None:
+        """Spends one unit of budget (the caller must hold the lock)."""
+        if self.remaining is None or self.reset is None or now >= self.reset:
+            return
+
+        self.remaining -= 1
+        if self.remaining < self.limit * self.reserve:
+            # running low; spread what's left over the rest of the window
+            self.next_at = now + (self.reset - now) / max(self.remaining, 1)
+
+    def update(self, headers: Mapping[str, str]) -> None:
+        """Updates the budget from a response's headers."""
+        with self._lock:
+            now = time.time()
+
+            retry_after = _to_number(headers.get('Retry-After'))
+            if retry_after is not None:
+                self.blocked_until = max(self.blocked_until,
+                                         now + retry_after)
+
+            limit = _to_number(headers.get('X-RateLimit-Limit'))
+            remaining = _to_number(headers.get('X-RateLimit-Remaining'))
+            reset = _to_number(headers.get('X-RateLimit-Reset'))
+            if remaining is None or reset is None:
+                return
+
+            if self.reset is not None and reset == self.reset:
+                # same window; responses can arrive out of order, so keep
+                # the lowest count (it's the most recent)
+                remaining = min(remaining, self.remaining)
+
+            self.limit = int(limit or self.limit or remaining)
+            self.remaining = int(remaining)
+            self.reset = reset
+
+    def status(self) -> str:
+        """Describes the remaining budget (for progress bars)."""
+        with self._lock:
+            if self.remaining is None:
+                return ''
+
+            now = time.time()
+            parts = ['budget {:,}/{:,}'.format(max(self.remaining, 0),
+                                               self.limit)]
+            if self.reset and self.reset > now:
+                parts.append('resets in %dm' % ((self.reset - now) // 60 + 1))
+            if now < self.blocked_until:
+                parts.append('paused %ds' % (self.blocked_until - now))
+            if self.waiting:
+                parts.append('%d queued' % self.waiting)
+
+            return ', '.join(parts)
+
+    def __getstate__(self):
+        # locks can't be pickled/copied
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.waiting = 0
+        self._lock = threading.Lock()
+
+
+class TokenPool(object):
+    """Spreads requests across several api tokens, each with its own rate
+    limit budgets.
+
+    Each request goes out with the token that can send it soonest, and of
+    those the one with the most budget left; tokens whose budget is spent
+    are skipped until they reset. Throughput therefore scales with the
+    number of tokens.
+    """
+
+    def __init__(self, tokens: List[Optional[str]], resources: List[str]):
+        # None stands for an unauthenticated client
+        self.tokens = list(tokens) or [None]
+        self.resources = resources
+        self._limiters = {token: {r: RateLimiter() for r in resources}
+                          for token in self.tokens}
+        self._lock = threading.Lock()
+
+    def acquire(self, resource: str,
+                cancel: threading.Event = None) -> Optional[str]:
+        """Blocks until one of the tokens may send a request against the
+        resource's budget (or cancel is set; see RateLimiter.acquire);
+        returns that token."""
+        with self._lock:
+            def rank(token):
+                limiter = self._limiters[token][resource]
+                remaining = limiter.remaining
+                # untried tokens (no budget info yet) go first
+                return (limiter.delay(),
+                        -(float('inf') if remaining is None else remaining))
+
+            token = min(self.tokens, key=rank)
+
+        self._limiters[token][resource].acquire(cancel)
+        return token
+
+    def update(self, token: Optional[str], resource: str,
+               headers: Mapping[str, str]) -> None:
+        """Updates a token's budget from a response's headers."""
+        limiters = self._limiters.get(token)
+        if limiters:
+            limiters[resource].update(headers)
+
+    def limiter(self, token: Optional[str],
+                resource: str) -> Optional[RateLimiter]:
+        return self._limiters.get(token, {}).get(resource)
+
+    def status(self, resource: str) -> str:
+        """Describes the combined budget of all tokens."""
+        limiters = [self._limiters[t][resource] for t in self.tokens]
+        if len(limiters) == 1:
+            return limiters[0].status()
+
+        known = [l for l in limiters if l.remaining is not None]
+        if not known:
+            return ''
+
+        parts = ['budget {:,}/{:,} over {:,} tokens'.format(
+            sum(max(l.remaining, 0) for l in known),
+            sum(l.limit for l in known), len(limiters))]
+        waiting = sum(l.waiting for l in limiters)
+        if waiting:
+            parts.append('%d queued' % waiting)
+
+        return ', '.join(parts)
+
+    def __getstate__(self):
+        # locks can't be pickled/copied
+        state = self.__dict__.copy()
+        state.pop('_lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+def _to_number(val: Optional[str]) -> Optional[float]:
+    try:
+        return float(val)
+    except (TypeError, ValueError):
+        return None
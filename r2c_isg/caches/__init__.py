@@ -0,0 +1,8 @@
+from ._cache import Cache
+from .dir_cache import DirCache
+from .sqlite_cache import SqliteCache
+
+cache_map = {
+    'dir': DirCache,
+    'sqlite': SqliteCache
+}
@@ -0,0 +1,71 @@
+from typing import Iterator, Optional, Tuple
+from datetime import datetime
+from abc import ABC, abstractmethod
+
+
+class Cache(ABC):
+    """A store of http responses, keyed by a request hash.
+
+    Each entry is a dict with the keys 'url', 'status', 'timestamp' (a utc
+    datetime), 'headers' (a dict of the response's caching-related headers)
+    and 'json' (the decoded response body). The body is stored apart from
+    the rest of the entry, so freshness can be checked without decoding it.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    @abstractmethod
+    def get_meta(self, key: str) -> Optional[dict]:
+        """Gets an entry without its body (ie, without the 'json' key)."""
+        pass
+
+    @abstractmethod
+    def get_body(self, key: str) -> Optional[object]:
+        """Gets (and decodes) an entry's body."""
+        pass
+
+    @abstractmethod
+    def set(self, key: str, entry: dict) -> None: pass
+
+    @abstractmethod
+    def items(self) -> Iterator[Tuple[str, dict]]: pass
+
+    @abstractmethod
+    def clear(self) -> None: pass
+
+    def get(self, key: str) -> Optional[dict]:
+        """Gets a complete entry."""
+        entry = self.get_meta(key)
+        if entry is not None:
+            entry['json'] = self.get_body(key)
+
+        return entry
+
+    def touch(self, key: str, timestamp: datetime) -> None:
+        """Updates an entry's timestamp (eg, after revalidating it)."""
+        entry = self.get(key)
+        if entry is not None:
+            entry['timestamp'] = timestamp
+            self.set(key, entry)
+
+    def flush(self) -> None:
+        """Writes any buffered entries to disk."""
+        pass
+
+    def close(self) -> None:
+        """Flushes the cache and releases any open files."""
+        self.flush()
+
+    def migrate_to(self, other: 'Cache') -> int:
+        """Copies all entries into another cache; returns the count."""
+        count = 0
+        for key, entry in self.items():
+            other.set(key, entry)
+            count += 1
+        other.flush()
+
+        return count
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__, self.cache_dir)
@@ -0,0 +1,92 @@
+import os
+import json
+from typing import Iterator, Optional, Tuple
+from datetime import datetime
+from pathlib import Path
+
+from r2c_isg.caches import Cache
+
+
+class DirCache(Cache):
+    """One pretty-printed json file per response, named by request hash.
+
+    Each response also gets a small sidecar file (KEY.meta) holding the
+    entry minus its body, so checking an entry's freshness doesn't mean
+    parsing a (potentially huge) json file.
+    """
+
+    def _path(self, key: str) -> str:
+        return '%s/%s.json' % (self.cache_dir, key)
+
+    def _meta_path(self, key: str) -> str:
+        return '%s/%s.meta' % (self.cache_dir, key)
+
+    @staticmethod
+    def _parse(cached: dict) -> dict:
+        cached['timestamp'] = datetime.strptime(cached['timestamp'],
+                                                '%Y-%m-%d %H:%M:%S.%f')
+        cached.setdefault('headers', {})
+        return cached
+
+    def _load(self, key: str) -> Optional[dict]:
+        filepath = self._path(key)
+        if not os.path.isfile(filepath):
+            return None
+
+        # load the file from disk
+        with open(filepath) as f:
+            return self._parse(json.load(f))
+
+    def get_meta(self, key: str) -> Optional[dict]:
+        meta_path = self._meta_path(key)
+        if os.path.isfile(meta_path):
+            with open(meta_path) as f:
+                return self._parse(json.load(f))
+
+        # entries written by older versions have no sidecar; fall back to
+        # reading the entire file
+        entry = self._load(key)
+        if entry is not None:
+            entry.pop('json', None)
+
+        return entry
+
+    def get_body(self, key: str) -> Optional[object]:
+        entry = self._load(key)
+        return entry['json'] if entry else None
+
+    def set(self, key: str, entry: dict) -> None:
+        entry = dict(entry, timestamp=entry['timestamp'].strftime(
+            '%Y-%m-%d %H:%M:%S.%f'))
+        with open(self._path(key), 'w') as json_file:
+            json.dump(entry, json_file, indent=4, default=str)
+
+        # write the sidecar last; its presence means the entry is complete
+        entry.pop('json', None)
+        with open(self._meta_path(key), 'w') as meta_file:
+            json.dump(entry, meta_file, separators=(',', ':'), default=str)
+
+    def touch(self, key: str, timestamp: datetime) -> None:
+        # only the sidecar needs updating (it takes precedence over the
+        # timestamp in the full file)
+        entry = self.get_meta(key)
+        if entry is not None:
+            entry['timestamp'] = timestamp.strftime('%Y-%m-%d %H:%M:%S.%f')
+            with open(self._meta_path(key), 'w') as meta_file:
+                json.dump(entry, meta_file, separators=(',', ':'),
+                          default=str)
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        for filepath in Path(self.cache_dir).glob('*.json'):
+            with open(str(filepath)) as f:
+                entry = self._parse(json.load(f))
+
+            # the sidecar holds the latest metadata (see touch)
+            entry.update(self.get_meta(filepath.stem))
+            yield filepath.stem, entry
+
+    def clear(self) -> None:
+        """Deletes all cached files."""
+        for pattern in ['*.json', '*.meta']:
+            for filepath in Path(self.cache_dir).glob(pattern):
+                filepath.unlink()
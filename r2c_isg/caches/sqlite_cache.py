@@ -0,0 +1,188 @@
+import json
+import zlib
+import atexit
+import sqlite3
+import weakref
+import threading
+from contextlib import closing
+from typing import Iterator, Optional, Tuple
+from datetime import datetime, timezone
+
+from r2c_isg.caches import Cache
+
+
+class SqliteCache(Cache):
+    """All responses in a single sqlite file, with zlib-compressed compact
+    json bodies. Writes are committed in batches.
+
+    An entry's url, status, timestamp and headers live in their own columns,
+    so freshness checks never read (or decompress) the body.
+    """
+
+    filename = 'cache.sqlite'
+
+    # number of writes buffered in the open transaction before committing
+    batch_size = 100
+
+    def __init__(self, cache_dir: str):
+        super().__init__(cache_dir)
+        self.filepath = '%s/%s' % (cache_dir, self.filename)
+
+        # Note: The connection is shared by all threads (see
+        # Dataset.get_projects_meta), so every access takes the lock.
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._conn = None
+        with self._lock:
+            self._connection()
+
+        # don't lose the last partial batch when the shell exits
+        _open_caches.add(self)
+
+    def _connection(self) -> sqlite3.Connection:
+        """Gets the (shared) connection, opening it if necessary."""
+        # the caller must hold the lock
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.filepath, timeout=60,
+                                         check_same_thread=False)
+            self._conn.executescript('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    timestamp REAL NOT NULL,
+                    headers TEXT NOT NULL DEFAULT '{}',
+                    body BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_url ON responses (url);
+                CREATE INDEX IF NOT EXISTS responses_status
+                    ON responses (status);
+                CREATE INDEX IF NOT EXISTS responses_timestamp
+                    ON responses (timestamp);
+            ''')
+
+            # add any columns missing from caches made by older versions
+            columns = [row[1] for row in self._conn.execute(
+                'PRAGMA table_info(responses)')]
+            if 'headers' not in columns:
+                self._conn.execute('ALTER TABLE responses ADD COLUMN '
+                                   "headers TEXT NOT NULL DEFAULT '{}'")
+                self._conn.commit()
+
+        return self._conn
+
+    @staticmethod
+    def _encode(data) -> bytes:
+        return zlib.compress(json.dumps(data, separators=(',', ':'),
+                                        default=str).encode())
+
+    @staticmethod
+    def _decode(body: bytes):
+        return json.loads(zlib.decompress(body).decode())
+
+    @staticmethod
+    def _to_meta(url: str, status: int, timestamp: float,
+                 headers: str) -> dict:
+        return {
+            'url': url,
+            'status': status,
+            'timestamp': datetime.utcfromtimestamp(timestamp),
+            'headers': json.loads(headers)
+        }
+
+    def get_meta(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT url, status, timestamp, headers FROM responses '
+                'WHERE key = ?', (key,)).fetchone()
+
+        return self._to_meta(*row) if row else None
+
+    def get_body(self, key: str) -> Optional[object]:
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT body FROM responses WHERE key = ?', (key,)).fetchone()
+
+        return self._decode(row[0]) if row else None
+
+    def set(self, key: str, entry: dict) -> None:
+        timestamp = entry['timestamp'].replace(tzinfo=timezone.utc)
+        row = (key, entry['url'], entry['status'], timestamp.timestamp(),
+               json.dumps(entry.get('headers', {}), separators=(',', ':')),
+               self._encode(entry['json']))
+
+        with self._lock:
+            self._connection().execute(
+                'INSERT OR REPLACE INTO responses (key, url, status, '
+                'timestamp, headers, body) VALUES (?, ?, ?, ?, ?, ?)', row)
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    def touch(self, key: str, timestamp: datetime) -> None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+        with self._lock:
+            self._connection().execute(
+                'UPDATE responses SET timestamp = ? WHERE key = ?',
+                (timestamp.timestamp(), key))
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._commit()
+
+    def items(self) -> Iterator[Tuple[str, dict]]:
+        self.flush()
+        # Note: Entries are read on a connection of their own, so the shared
+        # one isn't locked for as long as the caller takes to iterate.
+        with closing(sqlite3.connect(self.filepath, timeout=60)) as conn:
+            cursor = conn.execute(
+                'SELECT key, url, status, timestamp, headers, body '
+                'FROM responses')
+            for key, url, status, timestamp, headers, body in cursor:
+                entry = self._to_meta(url, status, timestamp, headers)
+                entry['json'] = self._decode(body)
+                yield key, entry
+
+    def clear(self) -> None:
+        """Deletes all cached responses."""
+        with self._lock:
+            conn = self._connection()
+            conn.execute('DELETE FROM responses')
+            conn.commit()
+            self._pending = 0
+            conn.execute('VACUUM')
+
+    def flush(self) -> None:
+        with self._lock:
+            self._commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._commit()
+                self._conn.close()
+                self._conn = None
+
+    def __del__(self):
+        # commit the last partial batch of a cache dropped without closing
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _commit(self) -> None:
+        # the caller must hold the lock
+        if self._conn is not None and self._pending:
+            self._conn.commit()
+            self._pending = 0
+
+
+# Note: Open caches are tracked weakly (rather than registering each one's
+# close with atexit, which would keep every cache ever opened alive), and
+# whichever are still open when the shell exits are closed then.
+_open_caches = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_caches() -> None:
+    for cache in list(_open_caches):
+        cache.close()
@@ -11,7 +11,9 @@ from datetime import timedelta
 from click import argument, option, Choice, Path
 from click_shell import shell
 
+from r2c_isg.caches import cache_map
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.archive import Archive
 from r2c_isg.structures.projects import project_map
 from r2c_isg.util import get_dataset, print_error
 from r2c_isg.loaders.file import fileloader_map
@@ -115,13 +117,26 @@ weblist_options = '; '.join(['%s: %s' % (
 @option('-p', '--parser', 'fileargs', type=str,
         help='Handle for a custom-build json parser. No json parsers '
              'are implemented by default.')
+@option('-n', '--sample', type=int,
+        help='Keeps only a random sample of N projects. Npm lists and csv '
+             'files are sampled as they load, so the full list is never '
+             'held in memory.')
+@option('-s', '--seed', type=str, help='Sets the random seed.')
+@option('-w', '--weight', type=str,
+        help='Samples projects with probability proportional to this '
+             "attribute (or its inverse, as in '1/dependents_rank').")
+@option('-t', '--strata', type=str,
+        help='Samples N projects for each value of this attribute.')
 @click.pass_context
-def load(ctx, registry, from_type, name_or_path, fileargs):
+def load(ctx, registry, from_type, name_or_path, fileargs, sample, seed,
+         weight, strata):
     """Generates a dataset from a weblist name or file path."""
     backup_ds = None
     
     try:
-        backup_ds = deepcopy(ctx.obj.get('dataset', None))
+        # Note: The current dataset isn't modified (a new one replaces it),
+        # so it's kept as is rather than copied.
+        backup_ds = ctx.obj.get('dataset', None)
 
         if registry == 'noreg':
             registry = None
@@ -132,12 +147,16 @@ def load(ctx, registry, from_type, name_or_path, fileargs):
             # read in a file (fileargs is either a header string for csv
             # or a parser handle for json)
             ds = Dataset.load_file(name_or_path, registry,
-                                   fileargs=fileargs, **TEMP_SETTINGS)
+                                   fileargs=fileargs, sample=sample,
+                                   seed=seed, weight=weight, strata=strata,
+                                   **TEMP_SETTINGS)
 
         else:
             # download a weblist or organization repo list
             ds = Dataset.load_web(name_or_path, registry,
-                                  from_type=from_type, **TEMP_SETTINGS)
+                                  from_type=from_type, sample=sample,
+                                  seed=seed, weight=weight, strata=strata,
+                                  **TEMP_SETTINGS)
 
         ctx.obj['dataset'] = ds
 
@@ -151,16 +170,18 @@ def load(ctx, registry, from_type, name_or_path, fileargs):
         ctx.obj['dataset'] = backup_ds
 
 
-@cli.command('restore', help='Restores a dataset from a pickle file. Use '
-                             'the "backup" command to pickle the dataset.')
+@cli.command('restore', help='Restores a dataset from a backup file. Use '
+                             'the "backup" command to back up the dataset.')
 @argument('filepath', type=Path(exists=True))
 @click.pass_context
 def restore(ctx, filepath):
-    """Restores a pickled dataset file."""
+    """Restores a dataset backup file."""
     backup_ds = None
 
     try:
-        backup_ds = deepcopy(ctx.obj.get('dataset', None))
+        # Note: The current dataset isn't modified (a new one replaces it),
+        # so it's kept as is rather than copied.
+        backup_ds = ctx.obj.get('dataset', None)
 
         ds = Dataset.restore(filepath)
         ctx.obj['dataset'] = ds
@@ -176,15 +197,18 @@ def restore(ctx, filepath):
         ctx.obj['dataset'] = backup_ds
 
 
-@cli.command('backup', help='Backs up the full dataset to a pickle file. Use '
+@cli.command('backup', help='Backs up the full dataset to a file. Use '
                             'the "restore" command to restore the file.')
 @argument('filepath', type=Path(), default=None)
+@option('-c', '--compression', type=Choice(Archive.compressions),
+        help='Compression type. Defaults to zstd (if the zstandard package '
+             'is installed; otherwise gzip).')
 @click.pass_context
-def backup(ctx, filepath):
-    """Pickles the complete dataset."""
+def backup(ctx, filepath, compression):
+    """Backs up the complete dataset."""
     try:
         ds = get_dataset(ctx)
-        ds.backup(filepath)
+        ds.backup(filepath, compression=compression)
 
     except Exception as e:
         print_error(e, DEBUG)
@@ -200,7 +224,9 @@ def import_(ctx, registry, filepath):
     backup_ds = None
 
     try:
-        backup_ds = deepcopy(ctx.obj.get('dataset', None))
+        # Note: The current dataset isn't modified (a new one replaces it),
+        # so it's kept as is rather than copied.
+        backup_ds = ctx.obj.get('dataset', None)
 
         if registry == 'noreg':
             registry = None
@@ -223,12 +249,17 @@ def import_(ctx, registry, filepath):
 @cli.command('export', help='Exports a dataset to an R2C input set json. '
                             'Use the "import" command to import an input set.')
 @argument('filepath', type=Path(), default=None)
+@option('-z', '--gzip', 'compress', is_flag=True, default=False,
+        help='Gzips the input set (as does a FILEPATH ending in .gz).')
+@option('-n', '--ndjson', is_flag=True, default=False,
+        help='Writes newline-delimited json: the metadata on the first '
+             'line, then one input per line.')
 @click.pass_context
-def export(ctx, filepath):
+def export(ctx, filepath, compress, ndjson):
     """Export a dataset to an input set json."""
     try:
         ds = get_dataset(ctx)
-        ds.export_inputset(filepath)
+        ds.export_inputset(filepath, compress=compress, ndjson=ndjson)
 
     except Exception as e:
         print_error(e, DEBUG)
@@ -248,16 +279,15 @@ def export(ctx, filepath):
 @click.pass_context
 def set_meta(ctx, name, version, description, readme, author, email):
     """Sets dataset metadata."""
-    backup_ds = None
+    ds = ctx.obj.get('dataset', None)
 
     try:
-        ds = ctx.obj.get('dataset', None)
-        backup_ds = deepcopy(ds)
-
         if ds:
             # update dataset's metadata
+            ds.begin()
             ds.update(name=name, version=version, description=description,
                       readme=readme, author=author, email=email)
+            ds.commit()
 
         else:
             global TEMP_SETTINGS
@@ -283,30 +313,64 @@ def set_meta(ctx, name, version, description, readme, author, email):
         print_error(e, DEBUG)
 
         # silently restore the dataset
-        ctx.obj['dataset'] = backup_ds
+        if ds:
+            ds.rollback()
 
 
 @cli.command('set-api', help='Sets API-specific settings.')
 @option('-d', '--cache_dir', type=Path(),
         help='The path to the requests cache. Defaults to ./.requests_cache.')
+@option('-c', '--cache_backend', type=Choice(list(cache_map)),
+        help='The cache storage format: a single sqlite file (default) or '
+             'one json file per request.')
 @option('-t', '--cache_timeout', type=int,
         help='The number of days before a cached request goes stale.')
 @option('-n', '--nocache', is_flag=True,
         help='Disables request caching for this dataset.')
-@option('-g', '--github_pat', type=str,
+@option('-g', '--github_pat', type=str, multiple=True,
         help='A github personal access token, used to increase the max '
-             'allowed hourly request rate from 60/hr to 5,000/hr. For '
+             'allowed hourly request rate from 60/hr to 5,000/hr. Repeat '
+             'the option to spread requests over several tokens. For '
              'instructions on how to obtain a token, see: https://help.'
              'github.com/en/articles/creating-a-personal-access-token-'
              'for-the-command-line.')
+@option('-a', '--commits_api', type=Choice(['graphql', 'rest']),
+        help="How github commit histories are fetched: github's graphql "
+             'api (default; 100 commits per request, needs a personal '
+             'access token) or its rest api.')
+@option('-m', '--abbreviated', is_flag=True,
+        help="Fetches npm versions from the registry's abbreviated "
+             'metadata, keeping only version strings, dist info and '
+             'deprecation notices, plus publish dates where the registry '
+             'includes them (much smaller than full packuments).')
+@option('-f', '--payload_field', type=str, multiple=True,
+        help='An api response field to keep on projects/versions (repeat '
+             'for several fields); turns on payload trimming.')
+@option('--trim_payloads/--full_payloads', default=None,
+        help='Trims api responses on projects/versions to the fields the '
+             'uuid/meta functions read (plus any --payload_field), '
+             'dropping the rest to save memory; or keeps whole responses '
+             '(the default).')
+@option('-p', '--pool_size', type=int,
+        help='The number of keep-alive connections pooled per host. '
+             'Defaults to 10.')
+@option('-r', '--retries', type=int,
+        help='The number of times to retry failed connections and '
+             '502/503/504 responses. Defaults to 3.')
+@option('-b', '--backoff_factor', type=float,
+        help='The retry backoff factor; retries wait {backoff factor} * '
+             '2 ^ ({retry number} - 1) seconds. Defaults to 1.')
 @click.pass_context
-def set_api(ctx, cache_dir, cache_timeout, nocache, github_pat):
+def set_api(ctx, cache_dir, cache_backend, cache_timeout, nocache,
+            github_pat, commits_api, abbreviated, payload_field,
+            trim_payloads, pool_size, retries, backoff_factor):
     """Sets API settings."""
-    backup_ds = None
+    backup_api = None
 
     try:
         ds = ctx.obj.get('dataset', None)
-        backup_ds = deepcopy(ds)
+        # Note: Only the api is modified, so only it is copied.
+        backup_api = deepcopy(ds.api) if ds else None
 
         # convert cache timeout string to timedelta
         if cache_timeout:
@@ -315,77 +379,159 @@ def set_api(ctx, cache_dir, cache_timeout, nocache, github_pat):
         if ds and ds.api:
             # configure the api
             ds.api.configure(cache_dir=cache_dir,
+                             cache_backend=cache_backend,
                              cache_timeout=cache_timeout,
                              nocache=nocache,
-                             github_pat=github_pat)
+                             github_pat=list(github_pat),
+                             commits_api=commits_api,
+                             abbreviated=abbreviated,
+                             payload_fields=list(payload_field) or None,
+                             trim_payloads=trim_payloads,
+                             pool_size=pool_size,
+                             retries=retries,
+                             backoff_factor=backoff_factor)
 
         else:
             # no ds/api; save the settings for when there is one
             global TEMP_SETTINGS
             if cache_dir: TEMP_SETTINGS['cache_dir'] = cache_dir
+            if cache_backend: TEMP_SETTINGS['cache_backend'] = cache_backend
             if cache_timeout: TEMP_SETTINGS['cache_timeout'] = cache_timeout
             if nocache: TEMP_SETTINGS['nocache'] = nocache
-            if github_pat: TEMP_SETTINGS['github_pat'] = github_pat
+            if github_pat: TEMP_SETTINGS['github_pat'] = list(github_pat)
+            if commits_api: TEMP_SETTINGS['commits_api'] = commits_api
+            if abbreviated: TEMP_SETTINGS['abbreviated'] = abbreviated
+            if payload_field:
+                TEMP_SETTINGS['payload_fields'] = list(payload_field)
+            if trim_payloads is not None:
+                TEMP_SETTINGS['trim_payloads'] = trim_payloads
+            if pool_size: TEMP_SETTINGS['pool_size'] = pool_size
+            if retries is not None: TEMP_SETTINGS['retries'] = retries
+            if backoff_factor is not None:
+                TEMP_SETTINGS['backoff_factor'] = backoff_factor
 
         # print the outcome
         settings = []
         if cache_dir: settings.append('cache_dir')
+        if cache_backend: settings.append('cache_backend')
         if cache_timeout: settings.append('cache_timeout')
         if nocache: settings.append('nocache')
         if github_pat: settings.append('github_pat')
+        if commits_api: settings.append('commits_api')
+        if abbreviated: settings.append('abbreviated')
+        if payload_field: settings.append('payload_fields')
+        if trim_payloads is not None: settings.append('trim_payloads')
+        if pool_size: settings.append('pool_size')
+        if retries is not None: settings.append('retries')
+        if backoff_factor is not None: settings.append('backoff_factor')
         set_str = ', '.join([s for s in settings if s])
         print("         Set the api's %s." % set_str)
 
     except Exception as e:
         print_error(e, DEBUG)
 
-        # silently restore the dataset
-        ctx.obj['dataset'] = backup_ds
+        # silently restore the api
+        if backup_api:
+            ds.api = backup_api
 
 
-@cli.command('get')
-@option('-m', '--metadata', is_flag=True,
-        help='Downloads project metadata.')
-@option('-v', '--versions', type=Choice(['all', 'latest']),
-        help='Downloads project versions.')
+@cli.command('migrate-cache', help='Copies all cached requests from one '
+                                   'cache backend to another.')
+@argument('source', type=Choice(list(cache_map)))
+@argument('dest', type=Choice(list(cache_map)))
+@option('-d', '--cache_dir', type=Path(),
+        help="The path to the requests cache. Defaults to the api's cache "
+             'dir (or ./.requests_cache).')
 @click.pass_context
-def get(ctx, metadata, versions):
-    """Downloads project and version information."""
-    backup_ds = None
-    rolled_back = False
+def migrate_cache(ctx, source, dest, cache_dir):
+    """Migrates a requests cache to another storage format."""
+    try:
+        ds = ctx.obj.get('dataset', None)
+        api = ds.api if ds else None
+        cache_dir = (cache_dir or (api.cache_dir if api else None)
+                     or TEMP_SETTINGS.get('cache_dir', '.requests_cache'))
 
-    # load project metadata
-    if metadata:
-        try:
-            ds = get_dataset(ctx)
-            backup_ds = deepcopy(ds)
+        if source == dest:
+            raise Exception('The source and destination backends must differ.')
+        if api:
+            # make sure the api's buffered writes are on disk
+            api.flush_cache()
 
-            ds.get_projects_meta()
+        source_cache = cache_map[source](cache_dir)
+        dest_cache = cache_map[dest](cache_dir)
+        count = source_cache.migrate_to(dest_cache)
+        source_cache.close()
+        dest_cache.close()
 
-        except Exception as e:
-            print_error(e, DEBUG)
+        print('         Migrated {:,} cached requests from {} to {}.'
+              .format(count, source, dest))
 
-            # roll back the db
-            ctx.obj['dataset'] = backup_ds
-            rolled_back = True
+    except Exception as e:
+        print_error(e, DEBUG)
 
-    # load project versions
-    if versions:
-        try:
-            ds = get_dataset(ctx)
-            backup_ds = deepcopy(ds)
 
-            ds.get_project_versions(historical=versions)
+@cli.command('get')
+@option('-m', '--metadata', is_flag=True,
+        help='Downloads project metadata.')
+@option('-v', '--versions', type=Choice(['all', 'latest']),
+        help='Downloads project versions.')
+@option('-w', '--workers', type=int, default=1,
+        help='Number of projects to download concurrently. Defaults to 1.')
+@option('-i', '--incremental', is_flag=True,
+        help='Only refreshes what changed since the last incremental '
+             "refresh: npm/pypi packages listed in the registry's change "
+             'feed, and github commits newer than the ones already in the '
+             'dataset.')
+@option('-r', '--resume', is_flag=True,
+        help='Resumes a get that stopped partway (eg, on an error or '
+             'ctrl-c), skipping the projects it already finished.')
+@click.pass_context
+def get(ctx, metadata, versions, workers, incremental, resume):
+    """Downloads project and version information."""
+    ds = None
 
-        except Exception as e:
+    try:
+        ds = get_dataset(ctx)
+        ds.begin()
+
+        # load project metadata and versions in one pass (the registries
+        # that serve both from the same document are then only asked once)
+        if metadata and versions:
+            ds.get_projects_meta_and_versions(workers=workers,
+                                              historical=versions,
+                                              incremental=incremental,
+                                              resume=resume)
+
+        # load project metadata
+        elif metadata:
+            ds.get_projects_meta(workers=workers, resume=resume)
+
+        # load project versions
+        elif versions:
+            ds.get_project_versions(workers=workers, historical=versions,
+                                    incremental=incremental, resume=resume)
+
+        ds.commit()
+
+    except (Exception, KeyboardInterrupt) as e:
+        if isinstance(e, KeyboardInterrupt):
+            print('         Interrupted.')
+        else:
             print_error(e, DEBUG)
 
-            # roll back the db
-            ctx.obj['dataset'] = backup_ds
-            rolled_back = True
-
-    if rolled_back:
-        print('         The dataset was not modified.')
+        # roll back the db, except for the projects that were finished
+        if not ds:
+            return
+        kept = ds.rollback()
+        if kept and ds.name:
+            print('         Kept the {:,} projects that were finished; use '
+                  '"get --resume" (with the same options) to get the rest.'
+                  .format(kept))
+        elif kept:
+            print('         Kept the {:,} projects that were finished.'
+                  .format(kept))
+        else:
+            print('         The dataset was not modified.')
 
 
 @cli.command('trim', help='Trims to the first N projects (default) or '
@@ -396,19 +542,21 @@ def get(ctx, metadata, versions):
 @click.pass_context
 def trim(ctx, n, on_versions):
     """Trims projects or versions from a dataset."""
-    backup_ds = None
+    ds = None
 
     try:
         ds = get_dataset(ctx)
-        backup_ds = deepcopy(ds)
+        ds.begin()
 
         ds.trim(n, on_versions)
+        ds.commit()
 
     except Exception as e:
         print_error(e, DEBUG)
 
         # roll back the db
-        ctx.obj['dataset'] = backup_ds
+        if ds:
+            ds.rollback()
         print('         The dataset was not modified.')
 
 
@@ -434,19 +582,21 @@ def trim(ctx, n, on_versions):
 @click.pass_context
 def sort(ctx, keywords_string):
     """Sorts a dataset."""
-    backup_ds = None
+    ds = None
 
     try:
         ds = get_dataset(ctx)
-        backup_ds = deepcopy(ds)
+        ds.begin()
 
         ds.sort(keywords_string.split())
+        ds.commit()
 
     except Exception as e:
         print_error(e, DEBUG)
 
         # roll back the db
-        ctx.obj['dataset'] = backup_ds
+        if ds:
+            ds.rollback()
         print('         The dataset was not modified.')
 
 
@@ -456,22 +606,29 @@ def sort(ctx, keywords_string):
 @option('-v', '--versions', 'on_versions', is_flag=True, default=False,
         help='Sample N versions per project.')
 @option('-s', '--seed', type=str, help='Sets the random seed.')
+@option('-w', '--weight', type=str,
+        help='Samples with probability proportional to this attribute (or '
+             "its inverse, as in '1/dependents_rank').")
+@option('-t', '--strata', type=str,
+        help='Samples N items for each value of this attribute.')
 @click.pass_context
-def sample(ctx, n, on_versions, seed):
+def sample(ctx, n, on_versions, seed, weight, strata):
     """Samples projects or versions from a dataset."""
-    backup_ds = None
+    ds = None
 
     try:
         ds = get_dataset(ctx)
-        backup_ds = deepcopy(ds)
+        ds.begin()
 
-        ds.sample(n, on_versions, seed)
+        ds.sample(n, on_versions, seed, weight, strata)
+        ds.commit()
 
     except Exception as e:
         print_error(e, DEBUG)
 
         # roll back the db
-        ctx.obj['dataset'] = backup_ds
+        if ds:
+            ds.rollback()
         print('         The dataset was not modified.')
 
 
@@ -1,34 +1,49 @@
 import random
 
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.reservoir import Reservoir
 
 
-def sample(ds: Dataset, n: int,
-           on_versions: bool = True, seed: str = None) -> None:
-    """Samples n projects in place."""
+def sample(ds: Dataset, n: int, on_versions: bool = True, seed: str = None,
+           weight: str = None, strata: str = None) -> None:
+    """Samples n projects in place. If weight (an attribute name, or
+    '1/attr' for its inverse) is given, items are sampled with probability
+    proportional to it; if strata (an attribute name) is given, n items are
+    sampled for each of its values."""
 
     # seed random, if a seed was provided
     if seed:
         random.seed(seed)
 
+    # Note: Weighted/stratified samples go through a reservoir (see
+    # Reservoir), seeded with the seed; plain samples use random.sample, so
+    # existing seeds keep selecting the same items.
+    def select(items: list) -> list:
+        if weight or strata:
+            reservoir = Reservoir(n, seed, weight, strata)
+            reservoir.extend(items)
+            return reservoir.items()
+        return random.sample(items, n)
+
     # select a sample of versions in each project
     if on_versions:
         dropped = 0
         for project in ds.projects:
             dropped += len(project.versions)
-            if len(project.versions) > n:
-                project.versions = random.sample(project.versions, n)
+            if len(project.versions) > n or strata:
+                ds.replace_versions(project, select(project.versions))
             dropped -= len(project.versions)
 
         print('         Sampled {:,} versions from each of {:,} projects ({:,} '
               'total versions dropped).'.format(n, len(ds.projects), dropped))
 
     # select a sample of projects
-    elif len(ds.projects) > n:
+    elif len(ds.projects) > n or (strata and ds.projects):
         orig_count = len(ds.projects)
-        ds.projects = random.sample(ds.projects, n)
+        ds.projects = select(ds.projects)
         print('         Sampled {:,} projects from {:,} (dropped {:,}).'
-              .format(n, orig_count, max(orig_count - n, 0)))
+              .format(len(ds.projects), orig_count,
+                      max(orig_count - len(ds.projects), 0)))
 
     else:
         # this should never happen...
@@ -1,103 +1,111 @@
-from typing import List
+from typing import Callable, List, Tuple
 
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.columns import Columns
 
 
 def sort(ds: Dataset, params: List[str]) -> None:
     """Sorts the projects/versions based on the given parameters."""
     # useful url: https://realpython.com/python-sort/
 
-    # organize the params list--sort by last param first
-    # default sort order is ascending
-    if params[0] not in ['asc', 'desc']:
-        params.insert(0, 'asc')
-    # reverse the list
-    params = params[::-1]
-    # re-insert the sort orders before their associated sort keys
-    insert_at = 0
-    for i in range(len(params)):
-        if params[i] in ['asc', 'desc']:
-            param = params.pop(i)
-            params.insert(insert_at, param)
-            insert_at = i + 1
+    # compile the params into one composite sort key each for projects
+    # and versions
+    p_keys, v_keys = _compile(params)
 
     # sort the dataset
-    reverse = True
-    for param in params:
-        if param in ['asc', 'desc']:
-            # set the sort order
-            reverse = (param == 'desc')
-
-        else:
-            # sort on this parameter
-            # Note: Parameter strings can follow these formats:
-            #   'attr'               sort on project attribute
-            #   'uuids.key'          sort on project uuid
-            #   'meta.key'           sort on project meta
-            #   'v.attr'             sort on version attribute
-            #   'v.uuids.key'   sort on version uuid
-            #   'v.meta.key'         sort on version meta
-
-            p_list = param.split('.')
-
-            # determine if we're sorting on project or version
-            on_project = True
-            if p_list[0] == 'v':
-                on_project = False
-                p_list.pop(0)
-
-            # build a sort function
-            attr = p_list[0]
-            if attr == 'uuids':
-                # sort on a uuid value
-                def sort_uuid(o: object):
-                    if not key in o.uuids_:
-                        raise Exception('Nonexistent sort key.')
-
-                    return o.uuids_[key]()
-
-                key = p_list[1]
-                sort_func = lambda o: sort_uuid(o)
-
-            elif attr == 'meta':
-                # sort on a meta value
-                def sort_meta(o: object):
-                    if not key in o.meta_:
-                        raise Exception('Nonexistent sort key.')
-
-                    return o.meta_[key]()
-
-                key = p_list[1]
-                sort_func = lambda o: sort_meta(o)
-
-            else:
-                # sort on a regular attribute
-                def sort_attr(o: object):
-                    if not hasattr(o, attr) and not sort.keyerr_warning:
-                        print("         Warning: Sort key '%s' was not "
-                              'found in all projects/versions; assuming '
-                              "'' for those items." % attr)
-                        sort.keyerr_warning = True
-
-                    # get & clean up the attribute
-                    val = getattr(o, attr, '')
-                    if isinstance(val, str):
-                        val = val.lower()
-
-                    return val
-
-                sort.keyerr_warning = False
-                sort_func = lambda o: sort_attr(o)
-
-            # perform the sort
-            if on_project:
-                # sort on project
-                ds.projects.sort(key=sort_func, reverse=reverse)
-            else:
-                # sort on version
-                for project in ds.projects:
-                    project.versions.sort(key=sort_func, reverse=reverse)
+    # Note: Each sort key is read once per project/version into a column
+    # store, which works out the final order; the lists are then reordered
+    # in one go (and reassigned, so the uuid indexes see the new order).
+    sort.keyerr_warning = False
+    if p_keys:
+        ds.projects = _sorted(ds.projects, p_keys)
+    if v_keys:
+        for project in ds.projects:
+            ds.replace_versions(project, _sorted(project.versions, v_keys))
 
     total_versions = sum([len(p.versions) for p in ds.projects])
     print('         Sorted {:,} projects and {:,} versions by {}.'
           .format(len(ds.projects), total_versions, str(params)))
+
+
+def _compile(params: List[str]) -> Tuple[list, list]:
+    """Organizes the params into lists of (column reader, descending)
+    pairs for projects and versions, from primary to least significant.
+    Each sort order (default ascending) applies to the keys after it."""
+    p_keys, v_keys = [], []
+    descending = False
+    for param in params:
+        if param in ['asc', 'desc']:
+            # set the sort order
+            descending = (param == 'desc')
+            continue
+
+        # Note: Parameter strings can follow these formats:
+        #   'attr'               sort on project attribute
+        #   'uuids.key'          sort on project uuid
+        #   'meta.key'           sort on project meta
+        #   'v.attr'             sort on version attribute
+        #   'v.uuids.key'   sort on version uuid
+        #   'v.meta.key'         sort on version meta
+        p_list = param.split('.')
+
+        # determine if we're sorting on project or version
+        keys = p_keys
+        if p_list[0] == 'v':
+            keys = v_keys
+            p_list.pop(0)
+
+        keys.append((_key_func(p_list), descending))
+
+    return p_keys, v_keys
+
+
+def _sorted(items: list, keys: list) -> list:
+    """Sorts items by a list of (column reader, descending) pairs."""
+    columns = Columns(items, [read for read, _ in keys])
+    return columns.take(columns.order([desc for _, desc in keys]))
+
+
+def _key_func(p_list: List[str]) -> Callable[[list], list]:
+    """Builds a function that reads the sort values of a list of objects."""
+    attr = p_list[0]
+    if attr in ['uuids', 'meta']:
+        # sort on a uuid/meta value
+        key = p_list[1]
+
+        def read_funcs(objs: list) -> list:
+            vals = []
+            for o in objs:
+                funcs = o._uuid_funcs if attr == 'uuids' else o._meta_funcs
+                if not key in funcs:
+                    raise Exception('Nonexistent sort key.')
+
+                vals.append(funcs[key](o))
+            return vals
+
+        return read_funcs
+
+    # sort on a regular attribute
+    def read_attr(objs: list) -> list:
+        vals = [getattr(o, attr, _missing) for o in objs]
+        types = set(map(type, vals))
+        if object in types:
+            if not sort.keyerr_warning:
+                print("         Warning: Sort key '%s' was not "
+                      'found in all projects/versions; assuming '
+                      "'' for those items." % attr)
+                sort.keyerr_warning = True
+            vals = ['' if v is _missing else v for v in vals]
+
+        # clean up the attributes
+        if types == {str}:
+            vals = list(map(str.lower, vals))
+        elif str in types:
+            vals = [v.lower() if isinstance(v, str) else v for v in vals]
+        return vals
+
+    return read_attr
+
+
+# placeholder for missing attributes
+_missing = object()
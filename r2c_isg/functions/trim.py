@@ -9,7 +9,7 @@ def trim(ds: Dataset, n: int, on_versions: bool = False) -> None:
         dropped = 0
         for project in ds.projects:
             dropped += len(project.versions)
-            project.versions = project.versions[:n]
+            ds.replace_versions(project, project.versions[:n])
             dropped -= len(project.versions)
 
         print('         Trimmed to first {:,} versions in each project '
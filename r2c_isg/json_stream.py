@@ -0,0 +1,155 @@
+import json
+import codecs
+from typing import Any, Collection, Iterable, Iterator, Tuple, Union
+
+# characters that can continue a json number
+_NUMBER_CHARS = '.eE+-0123456789'
+
+
+class JsonStream(object):
+    """Incrementally decodes a json document from a stream of text (or
+    utf-8 bytes) chunks, eg, a file or a streamed http response.
+
+    Only the document's top level is walked incrementally: a top-level
+    array's items (see items) or a top-level object's members (see
+    members) are decoded one at a time, so huge lists never have to be
+    held in memory at once.
+    """
+
+    def __init__(self, chunks: Iterable[Union[str, bytes]]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder('utf-8')()
+        self._decoder = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    @classmethod
+    def from_file(cls, file, chunk_size: int = 1 << 16) -> 'JsonStream':
+        """Streams an open (text or binary) file."""
+        return cls(iter(lambda: file.read(chunk_size), file.read(0)))
+
+    def peek(self) -> str:
+        """Gets the next (non-whitespace) character of the document, eg,
+        '[' if it's an array."""
+        return self._peek()
+
+    def value(self) -> Any:
+        """Decodes the (rest of the) document whole."""
+        val = self._value()
+        self._end()
+        return val
+
+    def items(self) -> Iterator[Any]:
+        """Yields the items of a top-level array."""
+        yield from self._array()
+        self._end()
+
+    def members(self, stream: Collection[str] = ()
+                ) -> Iterator[Tuple[str, Any]]:
+        """Yields the (key, value) members of a top-level object. The
+        values of keys in stream are arrays yielded item by item (as an
+        iterator, which must be consumed before moving on to the next
+        member)."""
+        self._expect('{')
+        if self._peek() == '}':
+            self._pos += 1
+            self._end()
+            return
+
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key in stream and self._peek() == '[':
+                items = self._array()
+                yield key, items
+                # skip whatever the caller didn't read
+                for _ in items:
+                    pass
+            else:
+                yield key, self._value()
+
+            if self._expect(',}') == '}':
+                break
+        self._end()
+
+    def _array(self) -> Iterator[Any]:
+        """Yields the items of the array starting at the current position."""
+        self._expect('[')
+        if self._peek() == ']':
+            self._pos += 1
+            return
+
+        while True:
+            yield self._value()
+            if self._expect(',]') == ']':
+                return
+
+    def _value(self) -> Any:
+        """Decodes the (complete) json value at the current position."""
+        self._peek()
+        while True:
+            try:
+                val, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            else:
+                # Note: A number/literal that runs to the end of the buffer
+                # may continue in the next chunk (eg, '12' + '34'), as may
+                # a number cut off before its fraction/exponent (eg, '-7'
+                # of '-7.' + '5', or '1.5' of '1.5e' + '3').
+                if self._eof or (end < len(self._buf) and not (
+                        type(val) in (int, float)
+                        and self._buf[end] in _NUMBER_CHARS)):
+                    self._pos = end
+                    return val
+
+            # incomplete value; read more (at least doubling the buffered
+            # value, so huge values aren't re-decoded once per chunk)
+            self._fill(len(self._buf) - self._pos)
+
+    def _peek(self) -> str:
+        """Skips whitespace; returns the next character ('' at the end)."""
+        while True:
+            while self._pos < len(self._buf) \
+                    and self._buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buf) or not self._fill():
+                return self._buf[self._pos:self._pos + 1]
+
+    def _expect(self, chars: str) -> str:
+        """Consumes the next (non-whitespace) character, which must be one
+        of chars."""
+        c = self._peek()
+        if not c or c not in chars:
+            raise json.JSONDecodeError('Expecting %s' % ' or '.join(
+                repr(c) for c in chars), self._buf, self._pos)
+        self._pos += 1
+        return c
+
+    def _end(self) -> None:
+        """Checks that nothing but whitespace follows the document."""
+        if self._peek():
+            raise json.JSONDecodeError('Extra data', self._buf, self._pos)
+
+    def _fill(self, at_least: int = 1) -> bool:
+        """Reads at least at_least more characters into the buffer;
+        returns False if the stream had nothing more."""
+        # drop the consumed part of the buffer
+        self._buf, self._pos = self._buf[self._pos:], 0
+
+        added = []
+        n_added = 0
+        while n_added < max(at_least, 1) and not self._eof:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                chunk = self._utf8.decode(b'', final=True)
+            elif isinstance(chunk, bytes):
+                chunk = self._utf8.decode(chunk)
+            added.append(chunk)
+            n_added += len(chunk)
+
+        self._buf += ''.join(added)
+        return n_added > 0
@@ -4,6 +4,10 @@ from r2c_isg.structures import Dataset
 
 
 class Loader(ABC):
+    # whether load accepts a sampler (see Reservoir) and samples projects
+    # as they're loaded, rather than loading all of them first
+    streams_samples = False
+
     @classmethod
     @abstractmethod
     def load(cls, handle: str, **kwargs) -> Dataset: pass
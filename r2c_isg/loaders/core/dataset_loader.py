@@ -2,19 +2,22 @@ import dill as pickle
 
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.archive import Archive
 
 
 class DatasetLoader(Loader):
     @classmethod
     def load(cls, filepath: str, **_) -> Dataset:
-        """Loads a complete dataset from a pickle file."""
+        """Loads a complete dataset from a backup file (see Archive), or a
+        pickle file made by older versions."""
+        if Archive.is_archive(filepath):
+            return Archive.load(filepath)
 
-        # Note: This may fail to load or produce unexpected behavior if
-        # dataset/project/version models have been altered after the
-        # backup was made. For now, this scenario has been left
-        # unaddressed, as the backup functionality is intended to be
-        # used more for quick and easy checkpointing than a full-
-        # featured archiving system.
+        # Note: Pickled backups may fail to load or produce unexpected
+        # behavior if dataset/project/version models have been altered
+        # after the backup was made. Backups in the current format store
+        # plain records instead, so they survive most model changes.
 
         # load the file
-        return pickle.load(open(filepath, 'rb'))
+        with open(filepath, 'rb') as file:
+            return pickle.load(file)
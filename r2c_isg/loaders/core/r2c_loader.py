@@ -1,8 +1,10 @@
-import json
+from typing import Iterable
 from tqdm import tqdm
 
+from r2c_isg.json_stream import JsonStream
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset, DefaultProject, DefaultVersion
+from r2c_isg.structures.field_spec import FieldSpec
 from r2c_isg.structures.projects import project_map
 from r2c_isg.structures.versions import version_map
 
@@ -15,12 +17,20 @@ class R2cLoader(Loader):
         # initialize the dataset
         ds = Dataset(**kwargs)
 
-        # load the file
-        data = json.load(open(filepath))
-
         # remove any existing projects
         ds.projects = []
 
+        # stream the file
+        # Note: The inputs are decoded (and turned into projects/versions)
+        # one at a time, so huge input sets needn't fit in memory twice.
+        data = {}
+        with open(filepath) as file:
+            for key, val in JsonStream.from_file(file).members({'inputs'}):
+                if key == 'inputs':
+                    cls._load_inputs(ds, val)
+                else:
+                    data[key] = val
+
         # don't overwrite previously set metadata
         ds.name = ds.name or data['name']
         ds.version = ds.version or data['version']
@@ -31,8 +41,15 @@ class R2cLoader(Loader):
         ds.author = ds.author or data.get('author', None)
         ds.email = ds.email or data.get('email', None)
 
+        return ds
+
+    @staticmethod
+    def _load_inputs(ds: Dataset, inputs: Iterable[dict]) -> None:
+        """Adds input set inputs to a dataset as projects/versions."""
+
         # generate the projects and versions
-        for input_ in tqdm(data['inputs'], desc='         Importing',
+        shared_funcs = {}
+        for input_ in tqdm(inputs, desc='         Importing',
                            unit=' inputs', leave=False):
             # split out project- vs. version-level information
             p_data, v_data = {}, {}
@@ -49,17 +66,21 @@ class R2cLoader(Loader):
             project = ds.find_project(**p_data)
             if project:
                 # update the existing project
-                project.update(**p_data)
+                ds.update_project(project, **p_data)
 
             else:
                 # map json headers to project keywords, as applicable
                 uuids = {}
                 if 'package_name' in p_data:
-                    uuids['name'] = lambda p: p.package_name
+                    uuids['name'] = FieldSpec.parse('attr "package_name"')
                 if 'repo_url' in p_data:
-                    uuids['url'] = lambda p: p.repo_url
+                    uuids['url'] = FieldSpec.parse('attr "repo_url"')
                 if 'url' in p_data:
-                    uuids['url'] = lambda p: p.url
+                    uuids['url'] = FieldSpec.parse('attr "url"')
+
+                # share the function dicts of projects with the same
+                # fields (rather than a copy per project)
+                uuids = shared_funcs.setdefault(frozenset(p_data), uuids)
 
                 # create the new project & add it to the dataset
                 p_class = project_map.get(ds.registry, DefaultProject)
@@ -71,18 +92,19 @@ class R2cLoader(Loader):
                 version = project.find_version(**v_data)
                 if version:
                     # update the existing version
-                    version.update(**v_data)
+                    project.update_version(version, **v_data)
 
                 else:
                     # map csv headers to version keywords, as applicable
                     uuids = {}
                     if 'version' in v_data:
-                        uuids['version'] = lambda v: v.version
+                        uuids['version'] = FieldSpec.parse('attr "version"')
                     if 'commit_hash' in v_data:
-                        uuids['commit'] = lambda v: v.commit_hash
+                        uuids['commit'] = FieldSpec.parse('attr "commit_hash"')
+
+                    uuids = shared_funcs.setdefault(
+                        ('v', frozenset(v_data)), uuids)
 
                     # create the new version & add it to the project
                     v_class = version_map.get(ds.registry, DefaultVersion)
                     project.versions.append(v_class(uuids_=uuids, **v_data))
-
-        return ds
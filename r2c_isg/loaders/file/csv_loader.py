@@ -2,11 +2,14 @@ import csv
 
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset, DefaultProject, DefaultVersion
+from r2c_isg.structures.field_spec import FieldSpec
 from r2c_isg.structures.projects import project_map
 from r2c_isg.structures.versions import version_map
 
 
 class CsvLoader(Loader):
+    streams_samples = True
+
     @classmethod
     def load(cls, filepath: str, **kwargs) -> Dataset:
         """Loads a csv file."""
@@ -22,11 +25,18 @@ class CsvLoader(Loader):
             headers = ['name', 'v.version']
 
         # initialize a dataset
+        sampler = kwargs.pop('sampler', None)
         ds = Dataset(**kwargs)
 
+        # Note: When sampling, only the sampled projects are kept (looked
+        # up by their uuid values in kept), and the uuid values of dropped
+        # projects are remembered, so their remaining rows are skipped.
+        kept, dropped = {}, set()
+
         # load the file
         with open(filepath, mode='r', encoding='utf-8-sig') as file:
             csv_file = csv.reader(file, delimiter=',')
+            shared_funcs = {}
             for row in csv_file:
                 if row[0].startswith('!'):
                     # read in a header row
@@ -52,43 +62,89 @@ class CsvLoader(Loader):
                             p_data[attr] = val
 
                     # get or create the new project
-                    project = ds.find_project(**p_data)
+                    if sampler is None:
+                        project = ds.find_project(**p_data)
+                    else:
+                        keys = {(k, p_data[k]) for k in _UUID_COLUMNS
+                                if k in p_data}
+                        if keys & dropped:
+                            continue
+                        project = next((kept[k] for k in keys
+                                        if k in kept), None)
+
                     if project:
                         # update the existing project
-                        project.update(**p_data)
+                        if sampler is None:
+                            ds.update_project(project, **p_data)
+                        else:
+                            project.update(**p_data)
+                            kept.update(dict.fromkeys(_uuid_keys(project),
+                                                      project))
 
                     else:
                         # map csv headers to project keywords, as applicable
                         uuids, meta = {}, {}
                         if 'name' in p_data:
-                            uuids['name'] = lambda p: p.name
+                            uuids['name'] = FieldSpec.parse('attr "name"')
                         if 'org' in p_data:
-                            meta['org'] = lambda p: p.org
+                            meta['org'] = FieldSpec.parse('attr "org"')
                         if 'url' in p_data:
-                            uuids['url'] = lambda p: p.url
+                            uuids['url'] = FieldSpec.parse('attr "url"')
+
+                        # share the function dicts of projects with the
+                        # same fields (rather than a copy per project)
+                        uuids, meta = shared_funcs.setdefault(
+                            (tuple(uuids), tuple(meta)), (uuids, meta))
 
                         # create the new project & add it to the dataset
                         p_class = project_map.get(ds.registry, DefaultProject)
                         project = p_class(uuids_=uuids, meta_=meta, **p_data)
-                        ds.projects.append(project)
+                        if sampler is None:
+                            ds.projects.append(project)
+                        else:
+                            # offer the project to the sample
+                            out = sampler.add(project)
+                            if out is not None:
+                                for k in _uuid_keys(out):
+                                    kept.pop(k, None)
+                                    dropped.add(k)
+                            if out is project:
+                                continue
+                            kept.update(dict.fromkeys(_uuid_keys(project),
+                                                      project))
 
                     # create the new version, if it doesn't already exist
                     if v_data:
                         version = project.find_version(**v_data)
                         if version:
                             # update the existing version
-                            version.update(**v_data)
+                            project.update_version(version, **v_data)
 
                         else:
                             # map csv headers to version keywords, as applicable
                             uuids = {}
                             if 'version' in v_data:
-                                uuids['version'] = lambda v: v.version
+                                uuids['version'] = FieldSpec.parse('attr "version"')
                             if 'commit' in v_data:
-                                uuids['commit'] = lambda v: v.commit
+                                uuids['commit'] = FieldSpec.parse('attr "commit"')
+
+                            uuids = shared_funcs.setdefault(
+                                ('v',) + tuple(uuids), uuids)
 
                             # create the new version & add it to the project
                             v_class = version_map.get(ds.registry, DefaultVersion)
                             project.versions.append(v_class(uuids_=uuids, **v_data))
 
+        if sampler is not None:
+            ds.projects = sampler.items()
+
         return ds
+
+
+# the csv columns that are project uuids (see the uuids in load)
+_UUID_COLUMNS = ['name', 'url']
+
+
+def _uuid_keys(project) -> list:
+    """Gets a project's (uuid name, value) pairs."""
+    return [(k, func()) for k, func in project.uuids_.items()]
@@ -1,5 +1,4 @@
-import json
-
+from r2c_isg.json_stream import JsonStream
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset, DefaultProject, DefaultVersion
 from r2c_isg.structures.projects import project_map
@@ -10,6 +9,10 @@ class JsonLoader(Loader):
     @classmethod
     def parsers(cls):
         # no parsers programmed by default
+        # Note: Parsers are called with the dataset and the file's json.
+        # If the json is an array, they get an iterator over its items,
+        # which are decoded as the file is read (so it can be iterated
+        # only once); otherwise, they get the whole decoded json.
         return {}
 
     @classmethod
@@ -31,10 +34,14 @@ class JsonLoader(Loader):
         # initialize a dataset
         ds = Dataset(**kwargs)
 
-        # load the file
-        data = json.load(open(filepath))
-
-        # run the appropriate parser
-        cls.parsers()[parser](ds, data)
+        # load the file and run the appropriate parser
+        with open(filepath) as file:
+            stream = JsonStream.from_file(file)
+            if stream.peek() == '[':
+                # stream the array's items into the parser
+                data = stream.items()
+            else:
+                data = stream.value()
+            cls.parsers()[parser](ds, data)
 
         return ds
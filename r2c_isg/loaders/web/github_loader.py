@@ -1,7 +1,12 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from urllib.parse import parse_qs, urlparse
+from requests.utils import parse_header_links
 from tqdm import tqdm
 
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.field_spec import field_specs
 
 
 class GithubLoader(Loader):
@@ -51,61 +56,102 @@ class GithubLoader(Loader):
     @staticmethod
     def _get_org_or_user_repos(api, name, name_type, **kwargs):
         # load the (paginated) list of repos for this organization
-        all_data = []
-        url = 'https://api.github.com/%ss/%s/repos?page=' % (name_type, name)
-        page_num = 1
-
-        while True:
-            status, data = api.request(url + str(page_num), **kwargs)
+        url_format = '%s/%ss/%s/repos?per_page=100&page=%%d' % (
+            api._base_api_url, name_type, name)
+
+        # the first page's Link header tells how many pages there are
+        url = url_format % 1
+        status, data, headers = api.request_with_headers(url, **kwargs)
+        if status != 200:
+            print('         Error downloading %s; is the url accessible?' % url)
+            return []
+        last_page = GithubLoader._get_last_page(headers)
+
+        # fetch the remaining pages concurrently
+        all_data = list(data)
+        pages = GithubLoader._get_pages(
+            api, [url_format % d for d in range(2, last_page + 1)], **kwargs)
+        for url, (status, data) in pages:
             if status != 200:
-                print('         Error downloading %s; is the url accessible?', url)
-                break
+                print('         Error downloading %s; is the url accessible?'
+                      % url)
+                return all_data
+            all_data.extend(data)
 
-            if len(data) == 0:
-                # we've reached the last page of the repos list; stop
+        # repos added since the Link header was (cached and) read spill over
+        # onto further pages; walk them until the first partial page
+        page_num = last_page
+        while len(data) == 100:
+            page_num += 1
+            url = url_format % page_num
+            status, data = api.request(url, **kwargs)
+            if status != 200:
+                print('         Error downloading %s; is the url accessible?'
+                      % url)
                 break
-
             all_data.extend(data)
-            page_num += 1
 
         return all_data
 
+    @staticmethod
+    def _get_last_page(headers: dict) -> int:
+        """Gets the last page number from a github response's Link header
+        (1 if there's only one page)."""
+        # Note: Github's Link header lists the urls of the next/last/etc.
+        # pages, eg: <https://api.github.com/...&page=2>; rel="next", ...
+        # See: https://developer.github.com/v3/#pagination
+        for link in parse_header_links(headers.get('Link', '')):
+            if link.get('rel') == 'last':
+                page = parse_qs(urlparse(link['url']).query).get('page')
+                if page:
+                    return int(page[0])
+
+        return 1
+
+    @staticmethod
+    def _get_pages(api, urls: List[str], **kwargs) -> List[tuple]:
+        """Requests urls concurrently; returns their (url, (status, data))
+        in order."""
+        if not urls:
+            return []
+
+        # the api caps how many of the requests run at once
+        with ThreadPoolExecutor(max_workers=api.max_host_concurrency) as ex:
+            responses = ex.map(lambda u: api.request(u, **kwargs), urls)
+            return list(zip(urls, tqdm(responses, total=len(urls),
+                                       unit=' pages', leave=False,
+                                       desc='         Downloading')))
+
     @staticmethod
     def _get_top1kstarred(api, **kwargs) -> list:
         # url courtesy of: https://stackoverflow.com/questions/19855552/
         # how-to-find-out-the-most-popular-repositories-on-github
-        url_format = 'https://api.github.com/search/repositories?' \
-                     'q=stars%%3A>0&sort=stars&per_page=100&page=%d'
+        url_format = '%s/search/repositories?' \
+                     'q=stars%%%%3A>0&sort=stars&per_page=100&page=%%d' \
+                     % api._base_api_url
 
         # github limits results to the top 1k at 100 per page
-        projects = []
-        for url in [(url_format % d) for d in tqdm(range(1, 11), unit=' pages',
-                                                   desc='         Downloading',
-                                                   leave=False)]:
-            # request the data via the github api
-            status, data = api.request(url, **kwargs)
-            if status != 200:
-                raise Exception('Error downloading %s; '
-                                'is the url accessible?' % url)
-
-            projects.extend(data['items'])
-
-        return projects
+        return GithubLoader._get_search_pages(
+            api, [(url_format % d) for d in range(1, 11)], **kwargs)
 
     @staticmethod
     def _get_top1kforked(api, **kwargs) -> list:
         # url courtesy of: https://stackoverflow.com/questions/19855552/
         # how-to-find-out-the-most-popular-repositories-on-github
-        url_format = 'https://api.github.com/search/repositories?' \
-                     'q=forks%%3A>0&sort=forks&per_page=100&page=%d'
+        url_format = '%s/search/repositories?' \
+                     'q=forks%%%%3A>0&sort=forks&per_page=100&page=%%d' \
+                     % api._base_api_url
 
         # github limits results to the top 1k at 100 per page
+        return GithubLoader._get_search_pages(
+            api, [(url_format % d) for d in range(1, 11)], **kwargs)
+
+    @staticmethod
+    def _get_search_pages(api, urls: List[str], **kwargs) -> list:
+        # request the data via the github api
         projects = []
-        urls = [(url_format % d) for d in range(1, 11)]
-        for url in tqdm(urls, unit=' pages', desc='         Downloading',
-                        leave=False):
-            # request the data via the github api
-            status, data = api.request(url, **kwargs)
+        for url, (status, data) in GithubLoader._get_pages(api, urls,
+                                                           **kwargs):
             if status != 200:
                 raise Exception('Error downloading %s; '
                                 'is the url accessible?' % url)
@@ -119,13 +165,11 @@ class GithubLoader(Loader):
         from r2c_isg.structures.projects import GithubRepo
 
         # map data keys to project keywords
-        uuids = {
-            'name': lambda p: p.name,
-            'url': lambda p: p.html_url
-        }
-        meta = {
-            'org': lambda p: p.url.split('/')[-2],
-        }
+        uuids, meta = field_specs('''
+            uuid name = attr "name"
+            uuid url = attr "html_url"
+            meta org = attr "url" split "/" -2
+        ''')
 
         # create the projects
         ds.projects = [GithubRepo(uuids_=uuids, meta_=meta, **d)
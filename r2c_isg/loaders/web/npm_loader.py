@@ -1,10 +1,15 @@
+from typing import Iterable, Iterator
 from tqdm import tqdm
 
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.field_spec import field_specs
+from r2c_isg.structures.reservoir import Reservoir
 
 
 class NpmLoader(Loader):
+    streams_samples = True
+
     @classmethod
     def weblists(cls) -> dict:
         """
@@ -41,6 +46,7 @@ class NpmLoader(Loader):
             raise Exception('NPM does not support loading package lists from user/org names.')
 
         # initialize a registry
+        sampler = kwargs.pop('sampler', None)
         ds = Dataset(**kwargs)
 
         # select the correct weblist loader/parser
@@ -53,15 +59,17 @@ class NpmLoader(Loader):
         data = weblists[name]['getter'](api=ds.api, **kwargs)
 
         # parse the data
-        weblists[name]['parser'](ds, data)
+        weblists[name]['parser'](ds, data, sampler)
 
         return ds
 
     @staticmethod
-    def _get_allbydependents(api, **kwargs) -> list:
+    def _get_allbydependents(api, **kwargs) -> Iterator[str]:
         url = 'https://github.com/nice-registry/all-the-package-names/raw/master/names.json'
 
-        status, data = api.request(url, **kwargs)
+        # Note: The list holds over a million names; they're decoded (and
+        # turned into packages by the parser) as the list downloads.
+        status, data = api.request_stream(url, **kwargs)
         if status != 200:
             raise Exception('Error downloading %s; '
                             'is the url accessible?' % url)
@@ -69,27 +77,36 @@ class NpmLoader(Loader):
         return data
 
     @staticmethod
-    def _parse_niceregistry(ds: Dataset, data: list):
+    def _parse_niceregistry(ds: Dataset, data: Iterable[str],
+                            sampler: Reservoir = None):
         from r2c_isg.structures.projects import NpmPackage
 
         # map data keys to package keywords
-        uuids = {
-            'name': lambda p: p.name
-        }
+        uuids, _ = field_specs('''
+            uuid name = attr "name"
+        ''')
 
         # create the projects
         # Note: data list is ordered from most dependents to fewest
         ds.projects = []
         i = 1
-        for name in data:
+        for name in tqdm(data, desc='         Loading', unit='project',
+                         leave=False):
             package = NpmPackage(
                 uuids_=uuids,
                 name=name,
                 dependents_rank=i
             )
-            ds.projects.append(package)
+            if sampler is None:
+                ds.projects.append(package)
+            else:
+                # keep only a sample of the (1M+) packages in memory
+                sampler.add(package)
             i += 1
 
+        if sampler is not None:
+            ds.projects = sampler.items()
+
     '''
     @staticmethod
     def _get_[incomplete--see problem in approach #4](api, **kwargs) -> list:
@@ -2,6 +2,7 @@ from tqdm import tqdm
 
 from r2c_isg.loaders import Loader
 from r2c_isg.structures import Dataset
+from r2c_isg.structures.field_spec import field_specs
 
 
 class PypiLoader(Loader):
@@ -70,9 +71,9 @@ class PypiLoader(Loader):
         from r2c_isg.structures.projects import PypiProject
 
         # map data keys to project keywords
-        uuids = {
-            'name': lambda p: p.project
-        }
+        uuids, _ = field_specs('''
+            uuid name = attr "project"
+        ''')
 
         # create the projects
         ds.projects = [PypiProject(uuids_=uuids, **d)
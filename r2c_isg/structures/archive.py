@@ -0,0 +1,404 @@
+import gc
+import io
+import os
+import json
+import gzip
+import base64
+import dill as pickle
+from tqdm import tqdm
+from functools import lru_cache
+from typing import Iterator, Optional, Tuple
+
+from r2c_isg.structures.field_spec import FieldSpec
+
+# Note: msgpack, zstandard and lz4 are optional. Without msgpack, records
+# are encoded as json lines; without zstandard, backups are gzipped.
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+
+class Archive(object):
+    """Reads and writes dataset backups in a compact, streamable format.
+
+    Rather than pickling the whole object graph, a backup is a header
+    followed by a stream of plain records: the dataset's settings, then
+    one record per project (holding its versions). Projects/versions are
+    stored as their class name and attribute dict; their uuid/meta
+    function dicts (shared by all items made by the same loader) are
+    stored once each, in records of their own, and referred to by number;
+    field specs (see FieldSpec) are stored as their source. Only values
+    msgpack/json can't represent exactly (eg, hand-written uuid/meta
+    functions, or tuples) are pickled.
+
+    Backups are written and read one project at a time, so neither side
+    holds a second copy of the dataset. The records are msgpack-encoded
+    (or json lines, if msgpack isn't installed) and compressed with zstd,
+    lz4 or gzip.
+    """
+
+    # identifies backups in this format (vs. dill pickles)
+    magic = b'R2C-ISG-BACKUP\n'
+    # the newest format version this code reads and writes (2: uuid/meta
+    # field specs are stored as their source)
+    format_version = 2
+
+    compressions = ['zstd', 'lz4', 'gzip', 'none']
+
+    @classmethod
+    def is_archive(cls, filepath: str) -> bool:
+        """Checks if a file is a backup in this format."""
+        with open(filepath, 'rb') as file:
+            return file.read(len(cls.magic)) == cls.magic
+
+    @classmethod
+    def dump(cls, ds, filepath: str, compression: str = None) -> None:
+        """Writes a dataset to a backup file."""
+        compression = compression or ('zstd' if zstandard else 'gzip')
+        header = {
+            'format_version': cls.format_version,
+            'encoding': 'msgpack' if msgpack else 'json',
+            'compression': compression,
+            'projects': len(ds.projects)
+        }
+
+        # Note: The backup is written to a temporary file, which replaces
+        # the target only once it's complete, so a failed or interrupted
+        # backup doesn't destroy the previous one.
+        tmp_path = filepath + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as file:
+                file.write(cls.magic)
+                file.write(json.dumps(header).encode() + b'\n')
+
+                stream = _compressed(file, compression)
+                encode = _encoder(header['encoding'])
+                for record in cls._records(ds):
+                    stream.write(encode(record))
+                stream.close()
+
+            os.replace(tmp_path, filepath)
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, filepath: str):
+        """Reads a dataset from a backup file."""
+        # Note: A restore allocates millions of (acyclic) projects, versions
+        # and attribute dicts, which makes python's cyclic garbage collector
+        # rescan the growing heap over and over; it's paused meanwhile,
+        # which more than halves the restore time.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls._load(filepath)
+        finally:
+            if enabled:
+                gc.enable()
+
+    @classmethod
+    def _load(cls, filepath: str):
+        """Reads a dataset from a backup file (see load)."""
+        from r2c_isg.structures import Dataset
+
+        with open(filepath, 'rb') as file:
+            if file.read(len(cls.magic)) != cls.magic:
+                raise Exception('Invalid backup file.')
+
+            header = json.loads(file.readline())
+            if header['format_version'] > cls.format_version:
+                raise Exception('The backup was made by a newer version of '
+                                'the input set generator; please upgrade.')
+
+            stream = _decompressed(file, header['compression'])
+            records = _decoder(header['encoding'])(stream)
+            ds = None
+            funcs = {}
+            count = 0
+            with tqdm(total=header['projects'], unit='project',
+                      desc='         Restoring', leave=False) as progress:
+                for record in records:
+                    kind = record[0]
+                    if kind == 'd':
+                        # dataset settings (always the first record)
+                        _, state, api_class, api_state = record
+                        ds = Dataset.__new__(Dataset)
+                        ds.__setstate__(state)
+                        ds.projects = []
+                        ds.api = _build_api(api_class, api_state)
+                        ds._bind_functions()
+
+                    elif kind == 'f':
+                        # a uuid/meta function dict
+                        _, num, func_dict = record
+                        funcs[num] = {
+                            k: FieldSpec.parse(f) if isinstance(f, str) else f
+                            for k, f in func_dict.items()}
+
+                    elif kind == 'p':
+                        ds.projects.append(_build_item(record, funcs))
+                        progress.update()
+
+                    elif kind == 'e':
+                        count = record[1]
+                        break
+
+            stream.close()
+
+        # Note: The end record is written last, so a backup cut short (eg,
+        # by a full disk) is caught here rather than silently losing data.
+        if ds is None or count != len(ds.projects):
+            raise Exception('The backup file is incomplete.')
+
+        return ds
+
+    @classmethod
+    def _records(cls, ds) -> Iterator[list]:
+        """Converts a dataset to a stream of plain records."""
+        # dataset settings (minus its projects and bound functions)
+        state = {k: v for k, v in ds.__getstate__().items()
+                 if k not in ['projects', 'api'] and not callable(v)}
+        api = ds.api
+        yield ['d', state,
+               type(api).__name__ if api else None,
+               api.__getstate__() if api else None]
+
+        # uuid/meta function dicts are numbered as they're first seen
+        numbers = {}
+        seen = []
+
+        def number(func_dict: dict) -> int:
+            num = numbers.get(id(func_dict))
+            if num is None:
+                num = numbers[id(func_dict)] = len(seen)
+                # keep the dict alive, so its id isn't reused
+                seen.append(func_dict)
+                new.append(['f', num, {
+                    k: f.source if isinstance(f, FieldSpec) else f
+                    for k, f in func_dict.items()}])
+            return num
+
+        for project in tqdm(ds.projects, unit='project',
+                            desc='         Backing up', leave=False):
+            new = []
+            versions = [[type(v).__name__, number(v._uuid_funcs),
+                         number(v._meta_funcs), v.__dict__]
+                        for v in project.versions]
+            record = ['p', type(project).__name__,
+                      number(project._uuid_funcs),
+                      number(project._meta_funcs),
+                      project.__dict__, versions]
+            yield from new
+            yield record
+
+        yield ['e', len(ds.projects)]
+
+
+def _build_api(class_name: Optional[str], state: Optional[dict]):
+    """Rebuilds a dataset's api from its state."""
+    from r2c_isg.apis import api_map
+
+    if class_name is None:
+        return None
+
+    classes = {c.__name__: c for c in api_map.values()}
+    if class_name not in classes:
+        raise Exception("Unknown api type '%s' in backup." % class_name)
+
+    api = classes[class_name].__new__(classes[class_name])
+    api.__setstate__(state)
+    return api
+
+
+@lru_cache()
+def _item_classes() -> Tuple[dict, dict]:
+    """Gets the project and version classes by name."""
+    from r2c_isg.structures.projects import project_map, DefaultProject
+    from r2c_isg.structures.versions import version_map, DefaultVersion
+
+    p_classes = [DefaultProject] + list(project_map.values())
+    v_classes = [DefaultVersion] + list(version_map.values())
+    return ({c.__name__: c for c in p_classes},
+            {c.__name__: c for c in v_classes})
+
+
+def _build_item(record: list, funcs: dict):
+    """Rebuilds a project (and its versions) from a project record."""
+    from r2c_isg.structures.projects import DefaultProject
+    from r2c_isg.structures.versions import DefaultVersion
+
+    _, class_name, uuids, meta, attrs, versions = record
+
+    # Note: Items of a class that no longer exists (ie, the models changed
+    # since the backup was made) are restored as default projects/versions
+    # rather than failing the whole restore.
+    p_classes, v_classes = _item_classes()
+
+    # Note: Records are in the current layout, so the items' attributes
+    # are set directly (rather than through __setstate__, which also
+    # converts older layouts); the decoded attribute dicts are used as is.
+    v_list = []
+    for v_name, v_uuids, v_meta, v_attrs in versions:
+        v_class = v_classes.get(v_name, DefaultVersion)
+        version = v_class.__new__(v_class)
+        version._uuid_funcs = funcs[v_uuids]
+        version._meta_funcs = funcs[v_meta]
+        version.__dict__ = v_attrs
+        v_list.append(version)
+
+    p_class = p_classes.get(class_name, DefaultProject)
+    project = p_class.__new__(p_class)
+    project.versions = v_list
+    project._version_index = None
+    project._uuid_funcs = funcs[uuids]
+    project._meta_funcs = funcs[meta]
+    project.__dict__ = attrs
+    return project
+
+
+def _compressed(file, compression: str):
+    """Wraps a binary file in a compressing stream."""
+    if compression == 'zstd':
+        if not zstandard:
+            raise Exception('zstd compression requires the zstandard '
+                            'package (pip install zstandard).')
+        return zstandard.ZstdCompressor().stream_writer(file,
+                                                        closefd=False)
+    if compression == 'lz4':
+        if not lz4:
+            raise Exception('lz4 compression requires the lz4 package '
+                            '(pip install lz4).')
+        return lz4.LZ4FrameFile(file, 'wb')
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode='wb', compresslevel=6)
+    if compression == 'none':
+        return _Unclosed(file)
+
+    raise Exception('Invalid compression type. Valid types are: %s.'
+                    % Archive.compressions)
+
+
+def _decompressed(file, compression: str):
+    """Wraps a binary file in a decompressing stream."""
+    if compression == 'zstd':
+        if not zstandard:
+            raise Exception('This backup is zstd compressed; restoring it '
+                            'requires the zstandard package.')
+        return io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(file, closefd=False))
+    if compression == 'lz4':
+        if not lz4:
+            raise Exception('This backup is lz4 compressed; restoring it '
+                            'requires the lz4 package.')
+        return lz4.LZ4FrameFile(file, 'rb')
+    if compression == 'gzip':
+        return gzip.GzipFile(fileobj=file, mode='rb')
+    if compression == 'none':
+        return io.BufferedReader(_Unclosed(file))
+
+    raise Exception("Unknown compression type '%s' in backup."
+                    % compression)
+
+
+class _Unclosed(io.RawIOBase):
+    """Passes reads/writes through to a file, without closing it."""
+
+    def __init__(self, file):
+        self._file = file
+
+    def readable(self) -> bool:
+        return True
+
+    def writable(self) -> bool:
+        return True
+
+    def readinto(self, buf) -> int:
+        data = self._file.read(len(buf))
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data) -> int:
+        return self._file.write(data)
+
+
+# Note: Values msgpack/json can't represent (eg, functions or datetimes)
+# are pickled: as msgpack extension type 1, or as json objects of the form
+# {"__pickle__": base64}. Values they'd represent, but restore as something
+# else (tuples, which come back as lists, and for json, dicts with non-str
+# keys) are pickled too, so records round trip exactly.
+_PICKLED = 1
+
+# types json restores as is
+_JSON_TYPES = {str, int, float, bool, type(None)}
+
+
+def _pickled_json(val) -> dict:
+    return {'__pickle__': base64.b64encode(pickle.dumps(val)).decode()}
+
+
+def _json_safe(val):
+    """Pickles (see above) the parts of a value json can't round trip."""
+    kind = type(val)
+    if kind is dict and all(type(k) is str for k in val):
+        return {k: _json_safe(v) for k, v in val.items()}
+    if kind is list:
+        return [_json_safe(v) for v in val]
+    if kind in _JSON_TYPES:
+        return val
+    return _pickled_json(val)
+
+
+def _encoder(encoding: str):
+    """Gets a function that encodes a record to bytes."""
+    if encoding == 'msgpack':
+        def pickled(val) -> 'msgpack.ExtType':
+            return msgpack.ExtType(_PICKLED, pickle.dumps(val))
+
+        # strict types, so tuples (etc.) are pickled rather than silently
+        # restored as lists
+        return msgpack.Packer(default=pickled, use_bin_type=True,
+                              strict_types=True).pack
+
+    # Note: json's encoder turns tuples into lists without consulting its
+    # default hook, so records are made json safe beforehand.
+    encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+    return lambda record: (encoder.encode(_json_safe(record))
+                           + '\n').encode()
+
+
+def _decoder(encoding: str):
+    """Gets a function that decodes a binary stream into records."""
+    if encoding == 'msgpack':
+        if not msgpack:
+            raise Exception('This backup is msgpack encoded; restoring it '
+                            'requires the msgpack package.')
+
+        def unpickled(code: int, data: bytes):
+            if code == _PICKLED:
+                return pickle.loads(data)
+            return msgpack.ExtType(code, data)
+
+        return lambda stream: msgpack.Unpacker(
+            stream, ext_hook=unpickled, raw=False, strict_map_key=False,
+            max_buffer_size=0)
+
+    def unpickled_json(obj: dict):
+        if len(obj) == 1 and '__pickle__' in obj:
+            return pickle.loads(base64.b64decode(obj['__pickle__']))
+        return obj
+
+    decoder = json.JSONDecoder(object_hook=unpickled_json)
+    return lambda stream: (decoder.decode(line.decode())
+                           for line in stream)
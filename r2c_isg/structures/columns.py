@@ -0,0 +1,84 @@
+from typing import Callable, List, Sequence
+
+# Note: numpy is optional. Without it, columns are plain lists and sorting
+# falls back to python's (stable) list sort on the item indexes.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Columns(object):
+    """The scalar fields of a list of projects/versions, stored column by
+    column.
+
+    Each field is read from all items in one pass (by a function that maps
+    the list of items to a list of values). Sorts then work out a
+    permutation of item indexes from the columns alone (vectorized, if
+    numpy is installed), and the items themselves are only gathered once,
+    into their final order (see take).
+    """
+
+    # below this many items, numpy's per-call overhead outweighs its speed
+    min_vectorized = 512
+
+    def __init__(self, items: Sequence,
+                 readers: List[Callable[[Sequence], list]]):
+        self.items = items
+        self.columns = [_to_column(read(items)) for read in readers]
+
+    def order(self, descending: List[bool]) -> List[int]:
+        """Gets the item indexes in sorted order. The first column is the
+        primary sort key; descending gives each column's direction. Items
+        with equal keys keep their relative order."""
+        if self.columns and all(_is_array(c) for c in self.columns):
+            keys = []
+            for col, desc in zip(self.columns, descending):
+                if desc and col.dtype.kind in 'biuf':
+                    # reverse numbers by negating them
+                    col = -col.astype(float if col.dtype.kind == 'f'
+                                      else 'int64')
+                elif desc:
+                    # Note: Strings can't be negated, but their ranks (ie,
+                    # indexes into the sorted unique values) can.
+                    col = -np.unique(col, return_inverse=True)[1].ravel()
+                keys.append(col)
+
+            # lexsort sorts by its last key first
+            return np.lexsort(keys[::-1]).tolist()
+
+        # sort the item indexes by the least significant column first; each
+        # (stable) sort keeps the order of the previous one among equal keys
+        # Note: Python compares tuples element by element, so one sort on a
+        # composite (tuple) key runs slower than a stable sort per column
+        # on the precomputed values.
+        index = list(range(len(self.items)))
+        for col, desc in reversed(list(zip(self.columns, descending))):
+            index.sort(key=col.__getitem__, reverse=desc)
+        return index
+
+    def take(self, index: List[int]) -> list:
+        """Gathers the items at the given indexes."""
+        items = self.items
+        return [items[i] for i in index]
+
+
+def _to_column(values: list):
+    """Packs a column into a numpy array, if numpy is installed and the
+    values are all numbers or all strings; otherwise keeps the list."""
+    if np is None or len(values) < Columns.min_vectorized:
+        return values
+
+    types = set(map(type, values))
+    if types <= {int, float, bool} or types == {str}:
+        # Note: Strings become fixed-width unicode arrays, which numpy
+        # sorts far faster than arrays of python objects.
+        col = np.array(values)
+        if col.dtype.kind in 'biufU':
+            return col
+
+    return values
+
+
+def _is_array(col) -> bool:
+    return np is not None and isinstance(col, np.ndarray)
@@ -1,12 +1,19 @@
+import os
+import gzip
 import json
-import dill as pickle
-from dill.source import getsource
 from tqdm import tqdm
-from typing import List, Optional
+from concurrent.futures import (Future, ThreadPoolExecutor, FIRST_COMPLETED,
+                                as_completed, wait)
+from typing import Callable, Iterable, List, Optional
 from types import MethodType
 from pathlib import Path
 
+from r2c_isg.structures.field_spec import describe
+from r2c_isg.structures.journal import Journal
+from r2c_isg.structures.progress_log import ProgressLog
 from r2c_isg.structures.projects import Project
+from r2c_isg.structures.reservoir import Reservoir
+from r2c_isg.structures.uuid_index import UuidIndex
 
 
 class Dataset(object):
@@ -14,12 +21,21 @@ class Dataset(object):
         from r2c_isg.apis import api_map
         from r2c_isg.structures.projects import project_map as registry_map
         from r2c_isg.structures import Project
-        from r2c_isg.functions import function_map
         from r2c_isg.util import get_name, get_email
 
         # a dataset contains projects
         self.projects: List[Project] = []
 
+        # hash index of project uuids (see find_project)
+        self._project_index = UuidIndex()
+
+        # position in the registry's change feed as of the last incremental
+        # refresh (see get_project_versions)
+        self.sync_checkpoint = None
+
+        # undo log of the current transaction, if any (see begin)
+        self._journal = None
+
         # set project metadata
         self.name = None
         self.version = None
@@ -42,6 +58,13 @@ class Dataset(object):
             self.api = api_class(**kwargs)
 
         # register the various transformation functions
+        self._bind_functions()
+
+    def _bind_functions(self) -> None:
+        """Registers the transformation functions (eg, self.sort) as
+        methods of the dataset."""
+        from r2c_isg.functions import function_map
+
         for name, function in function_map.items():
             setattr(self, name, MethodType(function, self))
 
@@ -74,7 +97,9 @@ class Dataset(object):
                             'are: %s.' % (extension, list(fileloader_map)))
 
         # load initial data from the file
+        sampler = cls._get_sampler(loader, kwargs)
         ds = loader.load(filepath, registry=registry, **kwargs)
+        cls._sample_loaded(ds, sampler)
 
         print('         Loaded {:,} projects containing {:,} total versions.'
               .format(len(ds.projects),
@@ -95,7 +120,9 @@ class Dataset(object):
                             % str(webloader_map.keys()))
 
         # load data from the weblist/org projects list
+        sampler = cls._get_sampler(loader, kwargs)
         ds = loader.load(name, registry=registry, **kwargs)
+        cls._sample_loaded(ds, sampler)
 
         print('         Loaded {:,} projects containing {:,} total versions.'
               .format(len(ds.projects),
@@ -103,6 +130,37 @@ class Dataset(object):
 
         return ds
 
+    @staticmethod
+    def _get_sampler(loader, kwargs: dict) -> Optional[Reservoir]:
+        """Pops the sampling kwargs (sample, seed, weight, strata) into a
+        sampler; it's handed to loaders that can sample as they load."""
+        n = kwargs.pop('sample', None)
+        seed = kwargs.pop('seed', None)
+        weight = kwargs.pop('weight', None)
+        strata = kwargs.pop('strata', None)
+        if n is None:
+            return None
+
+        sampler = Reservoir(n, seed, weight, strata)
+        if loader.streams_samples:
+            kwargs['sampler'] = sampler
+        return sampler
+
+    @staticmethod
+    def _sample_loaded(ds: 'Dataset', sampler: Optional[Reservoir]) -> None:
+        """Samples a freshly loaded dataset's projects (unless the loader
+        already did so as it loaded them)."""
+        if sampler is None:
+            return
+
+        if not sampler.seen:
+            sampler.extend(ds.projects)
+            ds.projects = sampler.items()
+
+        print('         Sampled {:,} projects from {:,} (dropped {:,}).'
+              .format(len(ds.projects), sampler.seen,
+                      sampler.seen - len(ds.projects)))
+
     @classmethod
     def restore(cls, filepath: str) -> 'Dataset':
         """Factory method that restores a pickled dataset."""
@@ -121,15 +179,17 @@ class Dataset(object):
 
         return ds
 
-    def backup(self, filepath: str = None) -> None:
-        """Pickles a dataset."""
+    def backup(self, filepath: str = None, compression: str = None) -> None:
+        """Backs up a dataset (see Archive). Compression is one of 'zstd'
+        (the default, if zstandard is installed), 'lz4', 'gzip' or
+        'none'."""
+        from r2c_isg.structures.archive import Archive
 
         # file name is dataset name, if not provided by user
         filepath = filepath or (self.name + '.p')
 
         # save to disk
-        with open(filepath, 'wb') as file:
-            pickle.dump(self, file)
+        Archive.dump(self, filepath, compression)
 
         print('         Backed up dataset to %s.' % filepath)
 
@@ -151,23 +211,88 @@ class Dataset(object):
         ))
         return ds
 
-    def export_inputset(self, filepath: str = None) -> None:
-        """Exports a dataset to an r2c input set json file."""
+    def export_inputset(self, filepath: str = None, compress: bool = False,
+                        ndjson: bool = False) -> None:
+        """Exports a dataset to an r2c input set json file. If compress,
+        the file is gzipped (as it is if the path ends in .gz). If ndjson,
+        the file holds one json object per line: the input set's metadata,
+        then each of its inputs."""
+        meta = self._inputset_meta()
 
         # file name is dataset name, if not provided by user
-        filepath = filepath or (self.name + '.json')
+        if not filepath:
+            filepath = self.name + ('.ndjson' if ndjson else '.json')
+            if compress:
+                filepath += '.gz'
+        compress = compress or filepath.endswith('.gz')
+
+        # Note: The inputs are encoded and written one project at a time
+        # (compactly, rather than pretty-printed), so the input set is
+        # never held in memory whole. It's written to a temporary file
+        # that replaces the destination once complete, so a failed export
+        # never leaves a partial input set behind.
+        encode = json.JSONEncoder(separators=(',', ':'),
+                                  check_circular=False).encode
+
+        tmp_path = filepath + '.tmp'
+        if compress:
+            file = gzip.open(tmp_path, 'wt', compresslevel=6)
+        else:
+            file = open(tmp_path, 'w')
+
+        try:
+            with file:
+                if ndjson:
+                    file.write(encode(meta) + '\n')
+                else:
+                    # the metadata members, then the inputs array
+                    file.write(encode(meta)[:-1] + ',"inputs":[')
+
+                # each project's inputs, one per line (ndjson) or
+                # separated by commas (encoded as one list, minus its
+                # brackets, which saves the encoder's per-call overhead)
+                lead = ''
+                for p in tqdm(self.projects, desc='         Exporting',
+                              unit='project', leave=False):
+                    inputs = p.to_inputset()
+                    if not inputs:
+                        continue
+
+                    if ndjson:
+                        file.write('\n'.join(map(encode, inputs)) + '\n')
+                    else:
+                        file.write(lead + encode(inputs)[1:-1])
+                        lead = ','
+
+                if not ndjson:
+                    file.write(']}')
+
+            os.replace(tmp_path, filepath)
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
 
-        # convert the dataset to an input set json
-        inputset = self.to_inputset()
-
-        # save to disk
-        with open(filepath, 'w') as file:
-            json.dump(inputset, file, indent=4)
         print('         Exported input set to %s.' % filepath)
 
     def to_inputset(self) -> dict:
         """Converts a dataset to an input set json."""
 
+        # jsonify the dataset's metadata
+        d = self._inputset_meta()
+
+        # jsonify the projects & versions
+        d['inputs'] = []
+        for p in tqdm(self.projects, desc='         Exporting',
+                      unit='project', leave=False):
+            d['inputs'].extend(p.to_inputset())
+
+        return d
+
+    def _inputset_meta(self) -> dict:
+        """Gets the input set's metadata (everything but its inputs)."""
+
         # name and version are mandatory
         if not (self.name and self.version):
             raise Exception('The dataset must have a name and version. '
@@ -183,12 +308,6 @@ class Dataset(object):
         if self.author: d['author'] = self.author
         if self.email: d['email'] = self.email
 
-        # jsonify the projects & versions
-        d['inputs'] = []
-        for p in tqdm(self.projects, desc='         Exporting',
-                      unit='project', leave=False):
-            d['inputs'].extend(p.to_inputset())
-
         return d
 
     def to_json(self) -> dict:
@@ -197,17 +316,23 @@ class Dataset(object):
         def extract_vars(obj: object) -> dict:
             """Extracts attributes from a dataset/project/version."""
             vars_dict = {}
+            for attr, funcs in [('uuids_', '_uuid_funcs'),
+                                ('meta_', '_meta_funcs')]:
+                if hasattr(obj, funcs):
+                    # convert uuid/meta functions to strings
+                    vars_dict[attr] = {
+                        key: describe(func)
+                        for key, func in getattr(obj, funcs).items()
+                    }
+
             for attr, val in vars(obj).items():
                 if callable(val):
                     # function; skip
                     pass
 
-                elif attr in ['uuids_', 'meta_']:
-                    # convert lambda functions to strings
-                    vars_dict[attr] = {
-                        key: getsource(func).split(': ', 1)[1].strip(',\n')
-                        for key, func in val.items()
-                    }
+                elif attr.startswith('_'):
+                    # internal bookkeeping (eg, uuid indices); skip
+                    pass
 
                 elif attr not in ['api', 'projects', 'versions']:
                     # regular attr, add to dict
@@ -233,55 +358,319 @@ class Dataset(object):
 
         return data_dict
 
-    def get_projects_meta(self, **kwargs) -> None:
-        """Gets the metadata for all projects."""
+    def get_projects_meta(self, workers: int = 1, resume: bool = False,
+                          **kwargs) -> None:
+        """Gets the metadata for all projects. If resume, the projects
+        finished by an earlier run that stopped partway are skipped."""
 
         if not self.api:
             raise Exception('No API is associated with this dataset; '
                             'cannot get project metadata.')
 
-        for p in tqdm(self.projects, unit='project', leave=False,
-                      desc='         Getting project metadata',):
+        self._run_on_projects(self.api.get_project, workers,
+                              '         Getting project metadata',
+                              task='meta', resume=resume, **kwargs)
 
-            self.api.get_project(p, **kwargs)
+        # project uuids may have changed; rebuild the index on next use
+        self._project_index.invalidate()
 
         print('         Retrieved metadata for {:,} projects.'
               .format(len(self.projects)))
 
-    def get_project_versions(self, **kwargs) -> None:
-        """Gets the historical versions for all projects."""
+    def get_project_versions(self, workers: int = 1,
+                             incremental: bool = False, resume: bool = False,
+                             **kwargs) -> None:
+        """Gets the historical versions for all projects. If incremental,
+        only the projects changed since the last incremental refresh are
+        refreshed. If resume, the projects finished by an earlier run that
+        stopped partway are skipped."""
 
         if not self.api:
             raise Exception('No API is associated with this dataset; '
                             'cannot get project versions.')
 
-        for p in tqdm(self.projects, unit='project', leave=False,
-                      desc='         Getting %s version'
-                           % kwargs.get('historical', 'all')):
-            self.api.get_versions(p, **kwargs)
+        projects, checkpoint, kwargs = self._get_changed_projects(
+            incremental, **kwargs)
+        historical = kwargs.get('historical', 'all')
+        self._run_on_projects(self.api.get_versions, workers,
+                              '         Getting %s version' % historical,
+                              projects=projects,
+                              task='versions_%s' % historical,
+                              resume=resume, **kwargs)
+        if checkpoint is not None:
+            self.sync_checkpoint = checkpoint
 
         print('         Retrieved {:,} total versions of {:,} projects.'
               .format(sum([len(p.versions) for p in self.projects]),
                       len(self.projects)))
 
+    def get_projects_meta_and_versions(self, workers: int = 1,
+                                       incremental: bool = False,
+                                       resume: bool = False,
+                                       **kwargs) -> None:
+        """Gets the metadata and historical versions for all projects,
+        in a single pass (and, where possible, a single request per
+        project). If incremental, only the projects changed since the last
+        incremental refresh are refreshed. If resume, the projects finished
+        by an earlier run that stopped partway are skipped."""
+
+        if not self.api:
+            raise Exception('No API is associated with this dataset; '
+                            'cannot get project metadata or versions.')
+
+        projects, checkpoint, kwargs = self._get_changed_projects(
+            incremental, **kwargs)
+        historical = kwargs.get('historical', 'all')
+        self._run_on_projects(self.api.get_project_and_versions, workers,
+                              '         Getting metadata and %s version'
+                              % historical, projects=projects,
+                              task='meta_versions_%s' % historical,
+                              resume=resume, **kwargs)
+        if checkpoint is not None:
+            self.sync_checkpoint = checkpoint
+
+        # project uuids may have changed; rebuild the index on next use
+        self._project_index.invalidate()
+
+        print('         Retrieved metadata and {:,} total versions of {:,} '
+              'projects.'.format(sum([len(p.versions) for p in self.projects]),
+                                 len(self.projects)))
+
+    def _get_changed_projects(self, incremental: bool,
+                              **kwargs) -> (List[Project], object, dict):
+        """Gets the projects to refresh, the registry's new change feed
+        checkpoint (if any) and the kwargs to refresh them with."""
+
+        if not incremental:
+            return self.projects, None, kwargs
+
+        # Note: Registries with a change feed (npm, pypi) list the packages
+        # changed since the checkpoint; only those are refetched (bypassing
+        # the cache, since they're known to have changed). Apis without
+        # one (github) refresh every project, incrementally where they can.
+        changed, checkpoint = self.api.get_changed_projects(
+            self.projects, self.sync_checkpoint)
+        if changed is None and checkpoint is not None:
+            # the first refresh of a change feed: the feed is followed from
+            # the checkpoint, so every project is refetched as of now (a
+            # cached response could predate it, missing changes for good)
+            return self.projects, checkpoint, dict(kwargs, nocache=True)
+        if changed is None:
+            return self.projects, checkpoint, dict(kwargs, incremental=True)
+
+        print('         {:,} projects changed since the last refresh.'
+              .format(len(changed)))
+        return changed, checkpoint, dict(kwargs, nocache=True)
+
+    def _run_on_projects(self, func: Callable, workers: int, desc: str,
+                         projects: List[Project] = None, task: str = None,
+                         resume: bool = False, **kwargs) -> None:
+        """Calls func(project, **kwargs) on every project (or just the
+        given ones), using up to `workers` threads. If a task name is given,
+        finished projects are logged to disk (see ProgressLog), and if
+        resume, the ones an earlier run of the task finished are skipped."""
+
+        projects = self.projects if projects is None else projects
+
+        # Note: Progress logs are found by the dataset's name, so unnamed
+        # datasets (which would all share one log) can't be resumed.
+        if resume and not self.name:
+            raise Exception('Only named datasets can be resumed; name the '
+                            'dataset (eg, with set-meta --name) before '
+                            'getting its projects.')
+
+        log = None
+        if task:
+            log = ProgressLog(self._progress_log_path(task))
+            if resume:
+                done = log.resume(self)
+                if done:
+                    print('         Resuming; {:,} projects were already '
+                          'done.'.format(len(done)))
+                projects = [p for p in projects if id(p) not in done]
+            else:
+                # a fresh run; forget any earlier, unfinished one
+                log.remove()
+
+        progress = tqdm(total=len(projects), unit='project',
+                        leave=False, desc=desc)
+        try:
+            self._run(func, workers, projects, progress, log, **kwargs)
+
+        except BaseException:
+            # keep the log of finished projects, to resume from
+            if log:
+                log.close()
+            raise
+
+        else:
+            if log:
+                log.remove()
+
+        finally:
+            progress.close()
+
+    def _run(self, func: Callable, workers: int, projects: List[Project],
+             progress: tqdm, log: Optional[ProgressLog], **kwargs) -> None:
+        """Runs func on the projects (see _run_on_projects)."""
+
+        if workers <= 1:
+            # serial; run everything in this thread
+            for p in projects:
+                self._start(p, log)
+                func(p, **kwargs)
+                self._finish(p, log)
+                self._advance(progress)
+            return
+
+        # Note: Each call only modifies its own project, so the results
+        # don't depend on the order the requests complete in. The number
+        # of in-flight requests per host is further capped by the api.
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                # keep a bounded window of queued projects (rather than one
+                # future per project) so huge datasets don't flood memory
+                pending = {}
+                try:
+                    for p in projects:
+                        if len(pending) >= workers * 2:
+                            done, _ = wait(pending,
+                                           return_when=FIRST_COMPLETED)
+                            self._collect(done, pending, progress, log)
+                        self._start(p, log)
+                        pending[pool.submit(func, p, **kwargs)] = p
+
+                    for future in as_completed(list(pending)):
+                        if future.exception() is not None:
+                            # finish whatever else completed before raising
+                            self._collect([f for f in pending if f.done()],
+                                          pending, progress, log)
+                        self._collect([future], pending, progress, log)
+
+                except BaseException:
+                    # stop queued work before re-raising (eg, rate
+                    # limiting), and the running workers' requests, so
+                    # leaving the pool (which waits for the workers) doesn't
+                    # wait out a rate limit or the rest of a paged history
+                    self.api.cancel_requests()
+                    for future in pending:
+                        future.cancel()
+                    raise
+
+        finally:
+            # the workers have stopped; later requests may go through
+            self.api.allow_requests()
+
+    def _collect(self, futures: Iterable[Future], pending: dict,
+                 progress: tqdm, log: Optional[ProgressLog]) -> None:
+        """Finishes the projects of completed futures (removing them from
+        pending); the first error is raised once the rest are finished, so
+        successful projects aren't lost along with the failed one."""
+        error = None
+        for future in futures:
+            project = pending.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            self._finish(project, log)
+            self._advance(progress)
+
+        if error is not None:
+            raise error
+
+    def _start(self, project: Project, log: Optional[ProgressLog]) -> None:
+        """Prepares to modify a project."""
+        self._touch(project)
+        if log:
+            log.start(project)
+
+    def _finish(self, project: Project, log: Optional[ProgressLog]) -> None:
+        """Records a finished project. Logged projects' changes are kept
+        even if the rest of the transaction is rolled back."""
+        if log:
+            if self._journal:
+                self._journal.keep(project)
+            log.finish(project)
+
+    def _progress_log_path(self, task: str) -> str:
+        """Gets the path of a get task's progress log."""
+        name = '%s_%s_%s.p' % (self.registry or 'noreg',
+                               self.name or 'dataset', task)
+        return os.path.join(self.api.cache_dir, 'progress', name)
+
+    def _advance(self, progress: tqdm) -> None:
+        """Advances a progress bar and shows the api's request budget."""
+        status = self.api.status()
+        if status:
+            progress.set_postfix_str(status, refresh=False)
+        progress.update()
+
     def find_project(self, **kwargs) -> Optional[Project]:
-        """Gets the first project with attributes matching all kwargs."""
+        """Gets the first project with a uuid matching the kwargs."""
 
         # build a temporary project containing the kwargs
         this_p = Project(**kwargs)
 
-        # linear search function for now; potentially quite slow...
-        for other_p in self.projects:
-            # copy over the other project's uuid lambda funcs so the two
-            # projects can be compared (need to rebind the lambda func
-            # to this_p instead of other_p--hence the __func__ ref)
-            for k, func in other_p.uuids_.items():
-                this_p.uuids_[k] = MethodType(func.__func__, this_p)
-
-            if this_p == other_p:
-                return other_p
-
-        return None
+        # look up the project in the uuid index (which syncs itself
+        # with any projects appended/replaced since the last lookup)
+        return self._project_index.find(self.projects, this_p)
+
+    def update_project(self, project_: Project, **kwargs) -> None:
+        """Updates a project and indexes it under its new uuids."""
+        # (named project_, so a row's own 'project' field can be passed)
+        self._touch(project_)
+        project_.update(**kwargs)
+        self._project_index.add(project_)
+
+    def replace_versions(self, project: Project, versions: list) -> None:
+        """Replaces a project's versions list (recording the old list, if
+        there's a transaction to roll back)."""
+        if self._journal:
+            self._journal.replace_versions(project, versions)
+        else:
+            project.versions = versions
+
+    def begin(self) -> None:
+        """Starts a transaction: changes made from now on can be undone
+        with rollback (or kept with commit)."""
+        self._journal = None
+        self._journal = Journal(self)
+
+    def commit(self) -> None:
+        """Ends the transaction, keeping its changes."""
+        self._journal = None
+
+    def rollback(self) -> int:
+        """Undoes the changes made since the transaction began, except to
+        projects that were finished (see _finish); returns how many
+        projects' changes were kept."""
+        kept = 0
+        if self._journal:
+            kept = self._journal.kept
+            self._journal.rollback(self)
+        self._journal = None
+        return kept
+
+    def _touch(self, project: Project) -> None:
+        """Records a project's state (if there's a transaction to roll
+        back) before it's modified."""
+        if self._journal:
+            self._journal.touch(project)
+
+    def __getstate__(self):
+        # don't pickle/copy the uuid index; it's rebuilt on demand
+        state = self.__dict__.copy()
+        state.pop('_project_index', None)
+        state.pop('_journal', None)
+        return state
+
+    def __setstate__(self, state):
+        # fill in attributes missing from backups made by older versions
+        self.sync_checkpoint = None
+        self._journal = None
+
+        self.__dict__.update(state)
+        self._project_index = UuidIndex()
 
     def __repr__(self):
         return 'Dataset(%s' % ', '.join([
@@ -289,6 +678,6 @@ class Dataset(object):
             for a in dir(self)
             if getattr(self, a, None)
                and a is not 'projects'                  # ignore projects list
-               and not a.startswith('__')          # ignore dunders
+               and not a.startswith('_')           # ignore private/dunders
                and not callable(getattr(self, a))  # ignore functions
         ]) + ', projects=[%s])' % ('...' if self.projects else '')
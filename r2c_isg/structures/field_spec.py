@@ -0,0 +1,161 @@
+import sys
+import shlex
+from operator import attrgetter
+from functools import lru_cache
+from typing import Callable, Tuple
+
+
+class FieldSpec(object):
+    """A declarative uuid/meta function: a path of steps that reads a
+    value from a project/version, eg, 'attr "html_url"' (its html_url
+    attribute) or 'attr "url" split "/" -2' (the second-to-last part of
+    its url).
+
+    A spec is parsed and compiled once (specs with the same source share
+    one FieldSpec; see parse) into an accessor built from operator's C
+    getters, so reading it costs no more than a lambda. It's stored and
+    serialized as its source, without pickling or source introspection.
+    """
+
+    __slots__ = ('source', 'fields', 'getter')
+
+    def __init__(self, source: str):
+        try:
+            tokens = shlex.split(source)
+        except ValueError:
+            tokens = None
+        if not tokens or tokens[0] != 'attr' or len(tokens) < 2:
+            raise Exception("Invalid field spec '%s'; specs start with "
+                            'attr "name".' % source)
+
+        self.source = source
+        # the top-level attributes the spec reads (eg, to keep in trimmed
+        # api payloads)
+        self.fields = (tokens[1].split('.')[0],)
+        self.getter = attrgetter(tokens[1])
+
+        # compile the remaining steps onto the getter
+        tokens = tokens[2:]
+        while tokens:
+            step = step_map.get(tokens[0])
+            if not step:
+                raise Exception("Invalid field spec step '%s'. Valid steps "
+                                'are: %s.' % (tokens[0], list(step_map)))
+
+            builder, n_args = step
+            args = tokens[1:n_args + 1]
+            if len(args) < n_args:
+                raise Exception("Missing arguments to '%s' in field spec "
+                                "'%s'." % (tokens[0], source))
+
+            self.getter = builder(self.getter, *args)
+            tokens = tokens[n_args + 1:]
+
+    @classmethod
+    @lru_cache(maxsize=None)
+    def parse(cls, source: str) -> 'FieldSpec':
+        """Gets the (shared) compiled spec for a spec source."""
+        return cls(source)
+
+    def __call__(self, obj: object):
+        return self.getter(obj)
+
+    def __reduce__(self):
+        # pickle/copy as the source (restored as the shared spec)
+        return _parse, (self.source,)
+
+    def __eq__(self, other):
+        return isinstance(other, FieldSpec) and other.source == self.source
+
+    def __hash__(self):
+        return hash(self.source)
+
+    def __repr__(self):
+        return 'FieldSpec(%r)' % self.source
+
+
+def _parse(source: str) -> FieldSpec:
+    """Unpickles a spec (see FieldSpec.__reduce__)."""
+    return FieldSpec.parse(source)
+
+
+def _split(getter: Callable, sep: str, index: str) -> Callable:
+    """Splits the value on sep and takes one part."""
+    index = int(index)
+    return lambda obj: getter(obj).split(sep)[index]
+
+
+def _lower(getter: Callable) -> Callable:
+    """Lowercases the value."""
+    return lambda obj: getter(obj).lower()
+
+
+# step name -> (function compiling the step onto a getter, argument count)
+step_map = {
+    'split': (_split, 2),
+    'lower': (_lower, 0),
+}
+
+
+def field_specs(text: str) -> Tuple[dict, dict]:
+    """Parses uuid/meta declarations (one per line) into uuid and meta
+    function dicts, eg:
+
+        uuid name = attr "name"
+        uuid url = attr "html_url"
+        meta org = attr "url" split "/" -2
+    """
+    uuids, meta = {}, {}
+    for line in text.strip().splitlines():
+        line = line.strip()
+        if not line:
+            continue
+
+        decl, _, source = line.partition('=')
+        decl = decl.split()
+        if len(decl) != 2 or decl[0] not in ['uuid', 'meta']:
+            raise Exception("Invalid field declaration '%s'; declarations "
+                            'look like: uuid name = attr "name".' % line)
+
+        funcs = uuids if decl[0] == 'uuid' else meta
+        funcs[decl[1]] = FieldSpec.parse(source.strip())
+
+    return uuids, meta
+
+
+def describe(func: Callable) -> str:
+    """Gets a readable description of a uuid/meta function (its spec
+    source, or for plain functions, their source code)."""
+    if isinstance(func, FieldSpec):
+        return func.source
+
+    # Note: Custom functions (eg, lambdas passed in by hand) are described
+    # by their source code, which isn't always available. Source is read
+    # from the function's file at its recorded line, so functions restored
+    # from old backups (whose file may have changed since) are only
+    # described by source that compiles to their own code.
+    from dill.source import getsource
+    code = getattr(func, '__code__', None)
+    module = sys.modules.get(getattr(func, '__module__', None))
+    if code is None or getattr(module, '__file__', None) != code.co_filename:
+        return repr(func)
+
+    try:
+        source = getsource(func).split(': ', 1)[1].strip(',\n')
+    except Exception:
+        return repr(func)
+
+    # (the line may close the dict/call the function was written in)
+    while source:
+        try:
+            compiled = compile(source, code.co_filename, 'eval').co_consts
+        except SyntaxError:
+            if source[-1] not in ',)]} \n':
+                break
+            source = source[:-1]
+            continue
+        if any(getattr(c, 'co_code', None) == code.co_code
+               and c.co_names == code.co_names for c in compiled):
+            return source
+        break
+    return repr(func)
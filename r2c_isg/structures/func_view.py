@@ -0,0 +1,46 @@
+from collections.abc import Mapping
+from types import MethodType
+
+from r2c_isg.structures.field_spec import FieldSpec
+
+
+class FuncView(Mapping):
+    """Read-only mapping of names to functions, bound to an object when
+    they're looked up.
+
+    Projects/versions expose their uuid/meta functions through this view,
+    so they can share one dict of (unbound) functions with every other
+    item made by the same loader, rather than each holding a dict of its
+    own bound methods. eg, item.uuids_['name']() is item's name.
+    """
+    __slots__ = ('_obj', '_funcs')
+
+    def __init__(self, obj: object, funcs: dict):
+        self._obj = obj
+        self._funcs = funcs
+
+    def __getitem__(self, key: str) -> MethodType:
+        # field specs are bound by their compiled getter (see FieldSpec),
+        # skipping a python-level call
+        func = self._funcs[key]
+        if type(func) is FieldSpec:
+            func = func.getter
+        return MethodType(func, self._obj)
+
+    def __contains__(self, key) -> bool:
+        return key in self._funcs
+
+    def __iter__(self):
+        return iter(self._funcs)
+
+    def __len__(self) -> int:
+        return len(self._funcs)
+
+    def __repr__(self):
+        return 'FuncView(%s)' % list(self._funcs)
+
+
+def unbind(funcs: dict) -> dict:
+    """Converts a dict of bound uuid/meta methods (as stored by backups
+    made by older versions) to plain functions."""
+    return {k: getattr(f, '__func__', f) for k, f in funcs.items()}
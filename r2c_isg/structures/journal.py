@@ -0,0 +1,70 @@
+from typing import List
+
+
+class Journal(object):
+    """Undo log of the changes made to a dataset since a transaction began
+    (see Dataset.begin).
+
+    Rather than copying the whole dataset up front, the journal records the
+    dataset's own attributes (a shallow copy; its projects list is replaced,
+    never modified in place) and the prior state of each project just
+    before it's first changed. Beginning a transaction is therefore cheap,
+    and rolling one back costs time proportional to what changed.
+    """
+
+    def __init__(self, ds):
+        self.state = ds.__dict__.copy()
+
+        # id(project) -> (project, state, versions, version states); full
+        # snapshots of projects about to be modified (see touch)
+        self.projects = {}
+        # id(project) -> (project, versions list); projects whose versions
+        # list was replaced (see replace_versions)
+        self.versions = {}
+        # number of projects whose changes were kept (see keep)
+        self.kept = 0
+
+    def touch(self, project) -> None:
+        """Records a project's state before it's first modified."""
+        if id(project) in self.projects:
+            return
+
+        versions = list(project.versions)
+        self.projects[id(project)] = (project, project.__getstate__(),
+                                      versions,
+                                      [v.__getstate__() for v in versions])
+
+    def replace_versions(self, project, versions: List) -> None:
+        """Replaces a project's versions list, recording the old one."""
+        if id(project) not in self.versions:
+            self.versions[id(project)] = (project, project.versions)
+        project.versions = versions
+
+    def keep(self, project) -> None:
+        """Keeps a project's changes (eg, once it's been fully fetched),
+        even if the rest of the transaction is rolled back."""
+        self.projects.pop(id(project), None)
+        self.kept += 1
+
+    def rollback(self, ds) -> None:
+        """Restores the dataset to its state when the journal began."""
+        for project, state, versions, v_states in self.projects.values():
+            for version, v_state in zip(versions, v_states):
+                version.__dict__.clear()
+                version.__setstate__(v_state)
+
+            project.__dict__.clear()
+            project.__setstate__(state)
+            project.versions[:] = versions
+
+        # Note: Replaced versions lists are restored after the snapshots,
+        # since a project's snapshot holds whichever list it had when it
+        # was touched (which may itself have replaced the original).
+        for project, versions in self.versions.values():
+            project.versions = versions
+
+        ds.__dict__.clear()
+        ds.__dict__.update(self.state)
+        if self.projects:
+            # restored projects may have had their uuids changed
+            ds._project_index.invalidate()
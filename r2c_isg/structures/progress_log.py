@@ -0,0 +1,110 @@
+import os
+import time
+import dill as pickle
+from typing import Set
+
+
+class ProgressLog(object):
+    """On-disk journal of the projects a get run has finished, so a run
+    that fails partway (eg, rate limiting, ctrl-c or running out of
+    memory) can be resumed without redoing them.
+
+    Each finished project is appended to the log as a (uuid key, project
+    state) record; the log is flushed to disk every flush_interval seconds
+    and when the run stops. Resuming (see resume) applies the records to
+    the dataset's matching projects, which can then be skipped.
+    """
+
+    # seconds between flushes of the log to disk
+    flush_interval = 30
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+        self._flushed_at = time.time()
+
+        # id(project) -> uuid key, as of when the project was started (its
+        # uuids may change once it's been fetched)
+        self._keys = {}
+
+    def resume(self, ds) -> Set[int]:
+        """Applies the logged projects to the dataset's matching projects;
+        returns their ids."""
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+
+        projects = {self.key(p): p for p in ds.projects}
+        with open(self.path, 'rb') as file:
+            while True:
+                try:
+                    key, state = pickle.load(file)
+                except EOFError:
+                    break
+                except Exception:
+                    # a record cut short by a crash; the rest is lost
+                    break
+
+                project = projects.get(key)
+                if project is not None:
+                    # keep the dataset's (shared) uuid/meta functions
+                    state['_uuid_funcs'] = project._uuid_funcs
+                    state['_meta_funcs'] = project._meta_funcs
+                    project.__dict__.clear()
+                    project.__setstate__(state)
+                    done.add(id(project))
+
+        if done:
+            # resumed projects may have had their uuids changed
+            ds._project_index.invalidate()
+        return done
+
+    def start(self, project) -> None:
+        """Notes a project's uuid key before it's modified."""
+        self._keys[id(project)] = self.key(project)
+
+    def finish(self, project) -> None:
+        """Logs a finished project."""
+        if self._file is None:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            self._file = open(self.path, 'ab')
+
+        key = self._keys.pop(id(project), None) or self.key(project)
+        pickle.dump((key, project.__getstate__()), self._file)
+
+        if time.time() - self._flushed_at > self.flush_interval:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the logged projects to disk."""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._flushed_at = time.time()
+
+    def close(self) -> None:
+        """Flushes and closes the log (keeping it, to resume from)."""
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def remove(self) -> None:
+        """Closes and deletes the log (eg, once the run has finished)."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    @staticmethod
+    def key(project) -> tuple:
+        """Gets a project's uuid key: its (uuid name, value) pairs."""
+        key = []
+        for k, func in project.uuids_.items():
+            try:
+                key.append((k, str(func())))
+            except Exception:
+                # a uuid the project can't produce (eg, a missing field)
+                continue
+        return tuple(sorted(key))
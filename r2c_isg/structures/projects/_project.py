@@ -1,25 +1,41 @@
 from typing import List, Optional
-from types import MethodType
 
+from r2c_isg.structures.func_view import FuncView, unbind
 from r2c_isg.structures.versions import Version
+from r2c_isg.structures.uuid_index import UuidIndex
 
 
 class Project(object):
+    # Note: The fixed fields live in slots; only the project's data (eg,
+    # api payloads) takes up the instance dict. The uuid/meta function
+    # dicts aren't copied, so projects made by the same loader share them.
+    __slots__ = ('versions', '_version_index', '_uuid_funcs', '_meta_funcs',
+                 '__dict__')
+
     def __init__(self, uuids_: dict = {}, meta_: dict = {}, **kwargs):
         # a project contains versions
         self.versions: List[Version] = []
 
-        # set the uuid/meta functions as method types (to autopass self)
-        self.uuids_ = {}
-        for attr, func in uuids_.items():
-            self.uuids_[attr] = MethodType(func, self)
-        self.meta_ = {}
-        for attr, func in meta_.items():
-            self.meta_[attr] = MethodType(func, self)
+        # hash index of version uuids (see find_version; built on demand)
+        self._version_index = None
+
+        # set the uuid/meta functions (bound to self when looked up)
+        self._uuid_funcs = uuids_
+        self._meta_funcs = meta_
 
         # load all attributes into the project
         self.update(**kwargs)
 
+    @property
+    def uuids_(self) -> FuncView:
+        """The project's uuid functions (eg, self.uuids_['name']())."""
+        return FuncView(self, self._uuid_funcs)
+
+    @property
+    def meta_(self) -> FuncView:
+        """The project's meta functions (eg, self.meta_['org']())."""
+        return FuncView(self, self._meta_funcs)
+
     def update(self, **kwargs) -> None:
         """Populates the project with data from a dictionary."""
         for k, val in kwargs.items():
@@ -40,23 +56,23 @@ class Project(object):
         return self.uuids_.get('name', '')
 
     def find_version(self, **kwargs) -> Optional[Version]:
-        """Gets a version matching all kwargs or returns None."""
+        """Gets the first version with a uuid matching the kwargs."""
 
-        # build a temporary project containing the kwargs
+        # build a temporary version containing the kwargs
         this_v = Version(**kwargs)
 
-        # linear search function for now; potentially quite slow...
-        for other_v in self.versions:
-            # copy over the other project's uuid lambda funcs so the two
-            # projects can be compared (need to rebind the lambda func
-            # to this_p instead of other_p--hence the __func__ ref)
-            for k, func in other_v.uuids_.items():
-                this_v.uuids_[k] = MethodType(func.__func__, this_v)
-
-            if this_v == other_v:
-                return other_v
+        # look up the version in the uuid index (which syncs itself with
+        # any versions appended/replaced since the last lookup)
+        if self._version_index is None:
+            self._version_index = UuidIndex()
+        return self._version_index.find(self.versions, this_v)
 
-        return None
+    def update_version(self, version_: Version, **kwargs) -> None:
+        """Updates a version and indexes it under its new uuids."""
+        # (named version_, so a payload's own 'version' field can be passed)
+        version_.update(**kwargs)
+        if self._version_index is not None:
+            self._version_index.add(version_)
 
     def to_inputset(self) -> list:
         """Vanilla project can't be converted to an r2c input set."""
@@ -73,6 +89,30 @@ class Project(object):
                 return True
         return False
 
+    def __getstate__(self):
+        # don't pickle/copy the uuid index; it's rebuilt on demand
+        state = self.__dict__.copy()
+        state['versions'] = self.versions
+        state['_uuid_funcs'] = self._uuid_funcs
+        state['_meta_funcs'] = self._meta_funcs
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+        state.pop('_version_index', None)
+
+        # convert backups made by older versions (dicts of bound methods)
+        if 'uuids_' in state:
+            state['_uuid_funcs'] = unbind(state.pop('uuids_'))
+        if 'meta_' in state:
+            state['_meta_funcs'] = unbind(state.pop('meta_'))
+
+        self.versions = state.pop('versions', [])
+        self._uuid_funcs = state.pop('_uuid_funcs', {})
+        self._meta_funcs = state.pop('_meta_funcs', {})
+        self._version_index = None
+        self.__dict__.update(state)
+
     def __repr__(self):
         # only return project identifiers
         cls = str(type(self).__name__)
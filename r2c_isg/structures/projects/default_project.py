@@ -2,6 +2,8 @@ from r2c_isg.structures.projects import Project
 
 
 class DefaultProject(Project):
+    __slots__ = ()
+
     def check_guarantees(self) -> None:
         """Guarantees a url."""
         assert 'url' in self.uuids_, \
@@ -2,6 +2,8 @@ from r2c_isg.structures.projects import Project
 
 
 class GithubRepo(Project):
+    __slots__ = ()
+
     def check_guarantees(self) -> None:
         """Guarantees a name/org or a url."""
         assert ('url' in self.uuids_ or (
@@ -2,6 +2,8 @@ from r2c_isg.structures.projects import Project
 
 
 class NpmPackage(Project):
+    __slots__ = ()
+
     def check_guarantees(self) -> None:
         """Guarantees a name or a url."""
         assert 'name' in self.uuids_ or 'url' in self.uuids_, \
@@ -0,0 +1,89 @@
+import heapq
+import random
+from typing import Iterable, List, Optional
+
+
+class Reservoir(object):
+    """Keeps a random sample of n items from a stream of items of unknown
+    length, in constant memory (reservoir sampling).
+
+    Items are added one at a time (see add); each is kept or dropped as it
+    arrives, so the stream never has to be held in memory at once. With a
+    weight attribute, items are sampled with probability proportional to
+    their weight (Efraimidis & Spirakis' A-Res algorithm); '1/attr' weighs
+    items by the inverse of attr, eg, '1/dependents_rank' favors the most
+    depended-upon packages. With a strata attribute, n items are sampled
+    for each distinct value of that attribute. Samples are repeatable for
+    a given seed.
+    """
+
+    def __init__(self, n: int, seed: str = None, weight: str = None,
+                 strata: str = None):
+        if n < 0:
+            raise Exception('Sample size cannot be negative.')
+
+        self.n = n
+        self.weight = weight
+        self.strata = strata
+        self.seen = 0
+
+        # Note: Each item gets a random key (u ^ (1 / weight), with u
+        # uniform in [0, 1)); the sample is the n items with the largest
+        # keys, kept in a min-heap of (key, arrival order, item) per
+        # stratum. Unweighted items have weight 1 (ie, key = u).
+        self._rand = random.Random(seed)
+        self._heaps = {}
+
+    def add(self, item) -> Optional[object]:
+        """Offers an item to the sample. Returns the item dropped to make
+        room (the given item itself, if it wasn't kept), or None."""
+        self.seen += 1
+
+        weight = self._get_weight(item)
+        u = self._rand.random()
+        if weight <= 0:
+            return item
+        key = u ** (1 / weight)
+
+        heap = self._heaps.setdefault(
+            getattr(item, self.strata, None) if self.strata else None, [])
+        entry = (key, self.seen, item)
+        if len(heap) < self.n:
+            heapq.heappush(heap, entry)
+            return None
+
+        if heap and key > heap[0][0]:
+            return heapq.heapreplace(heap, entry)[2]
+
+        return item
+
+    def extend(self, items: Iterable) -> None:
+        """Offers each of the items to the sample."""
+        for item in items:
+            self.add(item)
+
+    def items(self) -> List:
+        """Gets the sampled items, in the order they were added."""
+        entries = [e for heap in self._heaps.values() for e in heap]
+        return [item for _, _, item in sorted(entries,
+                                              key=lambda e: e[1])]
+
+    def __len__(self) -> int:
+        return sum(len(heap) for heap in self._heaps.values())
+
+    def _get_weight(self, item) -> float:
+        """Gets an item's sampling weight."""
+        if not self.weight:
+            return 1
+
+        attr, inverse = self.weight, False
+        if attr.startswith('1/'):
+            attr, inverse = attr[2:], True
+
+        if not hasattr(item, attr):
+            raise Exception("Nonexistent sample weight '%s'." % attr)
+
+        weight = float(getattr(item, attr) or 0)
+        if inverse:
+            return 1 / weight if weight > 0 else 0
+        return weight
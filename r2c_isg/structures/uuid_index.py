@@ -0,0 +1,109 @@
+from typing import Optional
+
+from r2c_isg.structures.field_spec import FieldSpec
+
+
+class UuidIndex(object):
+    """Hash index over a list of projects or versions, keyed by
+    (uuid name, uuid value).
+
+    The index is built lazily and kept in sync with the list it indexes:
+    items appended to the list are indexed on the next lookup, and
+    replacing (or shrinking) the list triggers a full rebuild.
+    """
+
+    def __init__(self):
+        self._items = None
+        self._count = 0
+
+        # (uuid name, value) -> items with that uuid value
+        self._keys = {}
+        # uuid name -> {code object (or field spec getter): uuid function};
+        # the distinct uuid functions used to compute lookup keys for a
+        # probe item
+        self._funcs = {}
+        # id(item) -> position in the indexed list (for "first match")
+        self._order = {}
+        # items with unhashable uuid values (can't be hashed; searched
+        # linearly instead)
+        self._unhashable = []
+
+    def invalidate(self) -> None:
+        """Drops the index; it will be rebuilt on the next lookup."""
+        self.__init__()
+
+    def sync(self, items: list) -> None:
+        """Brings the index up to date with the items list."""
+        if items is not self._items or len(items) < self._count:
+            # the list was replaced or shrunk; rebuild from scratch
+            self.invalidate()
+            self._items = items
+
+        # index any items appended since the last sync
+        for item in items[self._count:]:
+            self._order[id(item)] = self._count
+            self._count += 1
+            self.add(item)
+
+    def add(self, item) -> None:
+        """Indexes an item under its current uuid values."""
+        # Note: The item's uuid functions are called directly (rather than
+        # bound through uuids_), and field specs through their compiled
+        # getters, since this runs for every item in the dataset.
+        for name, func in item._uuid_funcs.items():
+            if type(func) is FieldSpec:
+                func = func.getter
+            self._funcs.setdefault(name, {}).setdefault(
+                getattr(func, '__code__', func), func)
+
+            try:
+                bucket = self._keys.setdefault((name, func(item)), [])
+            except TypeError:
+                # unhashable uuid value
+                if not any(other is item for other in self._unhashable):
+                    self._unhashable.append(item)
+                continue
+            except Exception:
+                # uuid can't be computed (eg, missing attribute)
+                continue
+
+            if not any(other is item for other in bucket):
+                bucket.append(item)
+
+    def find(self, items: list, probe) -> Optional[object]:
+        """Gets the first item in the list that shares any uuid value
+        with the probe item."""
+        self.sync(items)
+
+        # gather all items sharing a (uuid name, value) with the probe
+        candidates = list(self._unhashable)
+        for name, funcs in self._funcs.items():
+            for func in funcs.values():
+                try:
+                    candidates.extend(self._keys.get((name, func(probe)), []))
+                except Exception:
+                    # probe lacks this uuid, or its value is unhashable
+                    continue
+
+        # verify the candidates (the index may hold stale values) and
+        # return the match that comes first in the list
+        candidates.sort(key=lambda item: self._order.get(id(item), -1))
+        for item in candidates:
+            if self._order.get(id(item)) is not None and \
+                    self.matches(probe, item):
+                return item
+
+        return None
+
+    @staticmethod
+    def matches(probe, item) -> bool:
+        """Checks whether any of the item's uuids matches the probe's."""
+        for func in item._uuid_funcs.values():
+            # compute the probe's uuid value using the item's uuid function
+            try:
+                if func(probe) == func(item):
+                    return True
+            except Exception:
+                continue
+
+        return False
@@ -1,19 +1,29 @@
-from types import MethodType
+from r2c_isg.structures.func_view import FuncView, unbind
 
 
 class Version(object):
+    # Note: The uuid/meta function dicts live in slots and aren't copied,
+    # so versions made by the same loader/api share them.
+    __slots__ = ('_uuid_funcs', '_meta_funcs', '__dict__')
+
     def __init__(self, uuids_: dict = {}, meta_: dict = {}, **kwargs):
-        # set the uuid/meta functions as method types (to autopass self)
-        self.uuids_ = {}
-        for attr, func in uuids_.items():
-            self.uuids_[attr] = MethodType(func, self)
-        self.meta_ = {}
-        for attr, func in meta_.items():
-            self.meta_[attr] = MethodType(func, self)
+        # set the uuid/meta functions (bound to self when looked up)
+        self._uuid_funcs = uuids_
+        self._meta_funcs = meta_
 
         # load all attributes into the version
         self.update(**kwargs)
 
+    @property
+    def uuids_(self) -> FuncView:
+        """The version's uuid functions (eg, self.uuids_['version']())."""
+        return FuncView(self, self._uuid_funcs)
+
+    @property
+    def meta_(self) -> FuncView:
+        """The version's meta functions."""
+        return FuncView(self, self._meta_funcs)
+
     def update(self, **kwargs) -> None:
         """Populates the version with data from a dictionary."""
         for k, val in kwargs.items():
@@ -41,6 +51,25 @@ class Version(object):
                 return True
         return False
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_uuid_funcs'] = self._uuid_funcs
+        state['_meta_funcs'] = self._meta_funcs
+        return state
+
+    def __setstate__(self, state):
+        state = dict(state)
+
+        # convert backups made by older versions (dicts of bound methods)
+        if 'uuids_' in state:
+            state['_uuid_funcs'] = unbind(state.pop('uuids_'))
+        if 'meta_' in state:
+            state['_meta_funcs'] = unbind(state.pop('meta_'))
+
+        self._uuid_funcs = state.pop('_uuid_funcs', {})
+        self._meta_funcs = state.pop('_meta_funcs', {})
+        self.__dict__.update(state)
+
     def __repr__(self):
         # only return version identifiers
         cls = str(type(self).__name__)
@@ -2,6 +2,8 @@ from r2c_isg.structures.versions import Version
 
 
 class GithubCommit(Version):
+    __slots__ = ()
+
     def check_guarantees(self) -> None:
         """Guarantees a commit hash."""
         assert 'commit' in self.uuids_, \
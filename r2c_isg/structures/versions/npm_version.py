@@ -2,6 +2,8 @@ from r2c_isg.structures.versions import Version
 
 
 class NpmVersion(Version):
+    __slots__ = ()
+
     def check_guarantees(self) -> None:
         """Guarantees a version string."""
         assert 'version' in self.uuids_, \
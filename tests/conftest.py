@@ -0,0 +1,74 @@
+import json
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer(object):
+    """Local http server that serves canned json responses.
+
+    Routes map a request path (including the query string) to either a
+    json-able body, a (status, headers, body) tuple, or a function that
+    takes the request handler and returns such a tuple.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                self._respond()
+
+            def do_POST(self):
+                self._respond()
+
+            def _respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                self.body = self.rfile.read(length) if length else b''
+                stub.requests.append((self.command, self.path,
+                                      dict(self.headers), self.body))
+
+                route = stub.routes.get(self.path, (404, {}, {}))
+                if callable(route):
+                    route = route(self)
+                if not isinstance(route, tuple):
+                    route = (200, {}, route)
+                status, headers, body = route
+
+                payload = b'' if body is None else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                for k, val in headers.items():
+                    self.send_header(k, val)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            # the default backlog (5) drops concurrent connections
+            request_queue_size = 128
+
+        self.httpd = Server(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_port
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       args=(0.01,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    yield server
+    server.close()
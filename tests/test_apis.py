@@ -0,0 +1,381 @@
+from r2c_isg.structures import Dataset
+from r2c_isg.structures.projects import PypiProject
+
+
+def _pypi_dataset(server, names, cache_dir) -> Dataset:
+    ds = Dataset(registry='pypi', nocache=True, cache_dir=str(cache_dir))
+    ds.api._base_api_url = server.url
+    uuids = {'name': lambda p: p.name}
+    ds.projects = [PypiProject(uuids_=uuids, name=n) for n in names]
+
+    for n in names:
+        server.routes['/pypi/%s/json' % n] = {
+            'info': {'version': '1.1', 'summary': 'about %s' % n},
+            'releases': {'1.0': [{'url': '%s-1.0' % n}],
+                         '1.1': [{'url': '%s-1.1' % n}]}
+        }
+
+    return ds
+
+
+def test_concurrent_get(stub_server, tmp_path):
+    names = ['proj%d' % i for i in range(50)]
+    ds = _pypi_dataset(stub_server, names, tmp_path)
+
+    ds.get_projects_meta(workers=8)
+    ds.get_project_versions(workers=8, historical='all')
+
+    # project order is untouched and every project got its own results
+    assert [p.name for p in ds.projects] == names
+    for p in ds.projects:
+        assert p.summary == 'about %s' % p.name
+        assert [v.url for v in p.versions] == ['%s-1.0' % p.name,
+                                               '%s-1.1' % p.name]
+
+
+def test_single_pass_get(stub_server, tmp_path):
+    names = ['proj%d' % i for i in range(5)]
+    ds = _pypi_dataset(stub_server, names, tmp_path)
+
+    # metadata and versions come from one request per project
+    ds.get_projects_meta_and_versions(historical='latest')
+    assert len(stub_server.requests) == len(names)
+    for p in ds.projects:
+        assert p.summary == 'about %s' % p.name
+        assert [v.version for v in p.versions] == ['1.1']
+
+
+def test_cache_backends(stub_server, tmp_path, capsys):
+    import gc
+    import weakref
+    from r2c_isg.apis import Pypi
+    from r2c_isg.caches import DirCache, SqliteCache
+
+    stub_server.routes['/data'] = (200, {'ETag': '"v1"'}, {'a': [1, 2, 3]})
+    url = stub_server.url + '/data'
+
+    # responses are served from the cache after the first request
+    for backend in ['dir', 'sqlite']:
+        api = Pypi(cache_dir=str(tmp_path / backend), cache_backend=backend)
+        assert api.request(url) == (200, {'a': [1, 2, 3]})
+        assert api.request(url) == (200, {'a': [1, 2, 3]})
+
+        # freshness metadata is stored apart from the body
+        [(key, _)] = list(api._get_cache().items())
+        meta = api._get_cache().get_meta(key)
+        assert 'json' not in meta
+        assert meta['status'] == 200 and meta['headers'] == {'ETag': '"v1"'}
+    assert len(stub_server.requests) == 2
+
+    # an old directory cache is pointed out (once) to sqlite users
+    capsys.readouterr()
+    for _ in range(2):
+        Pypi(cache_dir=str(tmp_path / 'dir'))._get_cache().close()
+    assert capsys.readouterr().out.count('migrate-cache') == 1
+
+    # the directory cache migrates into the sqlite cache
+    dir_cache = DirCache(str(tmp_path / 'dir'))
+    sqlite_cache = SqliteCache(str(tmp_path / 'dir'))
+    assert dir_cache.migrate_to(sqlite_cache) == 1
+    [(key, entry)] = list(sqlite_cache.items())
+    assert entry == dir_cache.get(key)
+
+    # caches aren't kept alive (eg, by exit hooks) once they're dropped
+    ref = weakref.ref(sqlite_cache)
+    del sqlite_cache
+    gc.collect()
+    assert ref() is None
+
+    # entries written before sidecars existed are still readable
+    (tmp_path / 'dir' / ('%s.meta' % key)).unlink()
+    assert dir_cache.get_meta(key)['url'] == url
+
+
+def test_conditional_revalidation(stub_server, tmp_path):
+    from datetime import timedelta
+    from r2c_isg.apis import Npm
+
+    def packument(handler):
+        if handler.headers.get('If-None-Match') == '"v1"':
+            return 304, {}, None
+        return 200, {'ETag': '"v1"'}, {'name': 'left-pad'}
+
+    stub_server.routes['/left-pad'] = packument
+    url = stub_server.url + '/left-pad'
+    stale = timedelta(microseconds=1)
+
+    api = Npm(cache_dir=str(tmp_path))
+    assert api.request(url, cache_timeout=stale) == (200, {'name': 'left-pad'})
+
+    # stale entries are revalidated, and a 304 serves the cached body
+    assert api.request(url, cache_timeout=stale) == (200, {'name': 'left-pad'})
+    assert stub_server.requests[-1][2]['If-None-Match'] == '"v1"'
+
+    # ...and resets the entry's age
+    assert api.request(url) == (200, {'name': 'left-pad'})
+    assert len(stub_server.requests) == 2
+
+
+def test_github_rate_limit(stub_server, tmp_path):
+    import time
+    from r2c_isg.apis import Github
+
+    reset = int(time.time()) + 1
+    calls = []
+
+    def repo(handler):
+        calls.append(time.time())
+        if len(calls) == 1:
+            # budget spent; the request should wait for the reset
+            return 403, {'X-RateLimit-Limit': '60',
+                         'X-RateLimit-Remaining': '0',
+                         'X-RateLimit-Reset': str(reset)}, {}
+        return 200, {'X-RateLimit-Limit': '60',
+                     'X-RateLimit-Remaining': '59',
+                     'X-RateLimit-Reset': str(reset + 3600)}, {'id': 1}
+
+    stub_server.routes['/repos/org/repo'] = repo
+    api = Github(cache_dir=str(tmp_path), nocache=True)
+    api._base_api_url = stub_server.url
+
+    assert api.request(stub_server.url + '/repos/org/repo') == (200, {'id': 1})
+    assert calls[1] >= reset
+    assert api.status().startswith('budget 59/60')
+
+
+def test_github_token_pool(stub_server, tmp_path):
+    import time
+    from r2c_isg.apis import Github
+
+    reset = str(int(time.time()) + 3600)
+    used = []
+
+    def repo(handler):
+        used.append(handler.headers.get('Authorization'))
+        if used[-1] == 'token a':
+            # token a's budget is spent
+            return 403, {'X-RateLimit-Limit': '5000',
+                         'X-RateLimit-Remaining': '0',
+                         'X-RateLimit-Reset': reset}, {}
+        return 200, {'X-RateLimit-Limit': '5000',
+                     'X-RateLimit-Remaining': '4999',
+                     'X-RateLimit-Reset': reset}, {'id': 1}
+
+    stub_server.routes['/repos/org/repo'] = repo
+    stub_server.routes['/repos/org/other'] = repo
+    api = Github(cache_dir=str(tmp_path), github_pat='a,b')
+    api._base_api_url = stub_server.url
+
+    # the rejected request is retried with the other token, which then
+    # serves all further requests
+    url = stub_server.url + '/repos/org/repo'
+    assert api.request(url) == (200, {'id': 1})
+    assert api.request(stub_server.url + '/repos/org/other') == (200, {'id': 1})
+    assert used == ['token a', 'token b', 'token b']
+    assert api.status().startswith('budget 4,998/10,000 over 2 tokens')
+
+    # cached responses are shared by all tokens
+    api.configure(github_pat=['c'])
+    assert api.request(url) == (200, {'id': 1})
+    assert len(used) == 3
+
+
+def test_github_graphql_commits(stub_server, tmp_path):
+    import json
+    from r2c_isg.apis import Github
+    from r2c_isg.structures.projects import GithubRepo
+
+    shas = ['%040x' % i for i in range(250)]
+
+    def graphql(handler):
+        variables = json.loads(handler.body)['variables']
+        assert (variables['owner'], variables['name']) == ('org', 'repo')
+        start = int(variables['cursor'] or 0)
+        end = start + variables['first']
+        history = {
+            'pageInfo': {'hasNextPage': end < len(shas),
+                         'endCursor': str(end)},
+            'nodes': [{'oid': sha, 'committedDate': '2019-01-01T00:00:00Z'}
+                      for sha in shas[start:end]]
+        }
+        return {'data': {'repository': {'defaultBranchRef': {
+            'target': {'history': history}}}}}
+
+    stub_server.routes['/graphql'] = graphql
+    api = Github(cache_dir=str(tmp_path), nocache=True, github_pat='a')
+    api._base_api_url = stub_server.url
+    uuids = {'url': lambda p: p.url}
+    repo = GithubRepo(uuids_=uuids, url='https://github.com/org/repo')
+
+    # commits are paged through 100 at a time
+    api.get_versions(repo)
+    assert [v.sha for v in repo.versions] == shas
+    assert repo.versions[0].commit['committer']['date'] == \
+        '2019-01-01T00:00:00Z'
+    assert len(stub_server.requests) == 3
+
+    # trimmed payloads still keep the commit dates
+    api.configure(trim_payloads=True)
+    repo.versions = []
+    api.get_versions(repo)
+    assert repo.versions[-1].commit['committer']['date'] == \
+        '2019-01-01T00:00:00Z'
+
+    # the rest api is the fallback
+    api.configure(commits_api='rest')
+    stub_server.routes['/repos/org/repo/commits?per_page=100&page=1'] = \
+        [{'sha': 'new'}]
+    stub_server.routes['/repos/org/repo/commits?per_page=100&page=2'] = []
+    api.get_versions(repo)
+    assert repo.versions[-1].sha == 'new'
+
+
+def test_github_incremental_commits(stub_server, tmp_path):
+    from r2c_isg.apis import Github
+    from r2c_isg.structures.projects import GithubRepo
+
+    path = '/repos/org/repo/commits?per_page=100&page=%d'
+    history = [{'sha': 'c%d' % i} for i in range(250, 0, -1)]
+    for page in range(1, 5):
+        stub_server.routes[path % page] = history[(page - 1) * 100:page * 100]
+
+    api = Github(cache_dir=str(tmp_path), commits_api='rest')
+    api._base_api_url = stub_server.url
+    uuids = {'url': lambda p: p.url}
+    repo = GithubRepo(uuids_=uuids, url='https://github.com/org/repo')
+    api.get_versions(repo)
+    assert len(repo.versions) == 250 and len(stub_server.requests) == 4
+
+    # three new commits; only the first page is fetched again, and the new
+    # commits go in front
+    history[:0] = [{'sha': 'c%d' % i} for i in range(253, 250, -1)]
+    for page in range(1, 5):
+        stub_server.routes[path % page] = history[(page - 1) * 100:page * 100]
+    api.get_versions(repo, incremental=True)
+    assert [v.sha for v in repo.versions] == [c['sha'] for c in history]
+    assert len(stub_server.requests) == 5
+
+
+def test_npm_change_feed(stub_server, tmp_path):
+    import json
+    from r2c_isg.structures.projects import NpmPackage
+
+    names = ['proj%d' % i for i in range(5)]
+    ds = Dataset(registry='npm', cache_dir=str(tmp_path))
+    ds.api._base_api_url = ds.api._replicate_url = stub_server.url
+    uuids = {'name': lambda p: p.name}
+    ds.projects = [NpmPackage(uuids_=uuids, name=n) for n in names]
+
+    def packument(n, version):
+        return {'name': n, 'dist-tags': {'latest': version},
+                'versions': {version: {'version': version}}}
+
+    for n in names:
+        stub_server.routes['/' + n] = packument(n, '1.0.0')
+    stub_server.routes['/'] = {'update_seq': 1000}
+
+    # the first refresh gets everything (even what's cached, which may
+    # predate the feed's position) and saves the feed's position
+    ds.get_project_versions()
+    assert ds.sync_checkpoint is None
+    del stub_server.requests[:]
+    ds.get_project_versions(incremental=True)
+    assert ds.sync_checkpoint == 1000
+    assert len(stub_server.requests) == 6
+
+    # replay a recorded change feed: only the changed packages are
+    # refetched (bypassing the cache)
+    with open('files/npm_changes.json') as file:
+        changes = json.load(file)
+    stub_server.routes['/_changes?since=1000&limit=10000'] = changes
+    for n in names:
+        stub_server.routes['/' + n] = packument(n, '2.0.0')
+    del stub_server.requests[:]
+
+    ds.get_project_versions(incremental=True)
+    assert ds.sync_checkpoint == 1004
+    assert sorted(r[1] for r in stub_server.requests) == \
+        ['/_changes?since=1000&limit=10000', '/proj1', '/proj3']
+    assert [len(p.versions) for p in ds.projects] == [1, 2, 1, 2, 1]
+
+
+def test_pypi_changelog(tmp_path):
+    import threading
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+    # replay a recorded changelog: (name, version, timestamp, action, serial)
+    changelog = [
+        ['Proj_1', '1.2', 1570000000, 'new release', 5001],
+        ['other', '0.1', 1570000001, 'create', 5002],
+        ['proj.3', '1.2', 1570000002, 'add py3 file', 5003]
+    ]
+    class Handler(SimpleXMLRPCRequestHandler):
+        rpc_paths = ('/pypi',)
+
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), Handler, logRequests=False)
+    server.register_function(lambda: 5000, 'changelog_last_serial')
+    server.register_function(
+        lambda since: [c for c in changelog if c[4] > since],
+        'changelog_since_serial')
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        ds = Dataset(registry='pypi', cache_dir=str(tmp_path))
+        ds.api._base_api_url = 'http://127.0.0.1:%d' % server.server_address[1]
+        uuids = {'name': lambda p: p.name}
+        ds.projects = [PypiProject(uuids_=uuids, name='proj-%d' % i)
+                       for i in range(5)]
+
+        assert ds.api.get_changed_projects(ds.projects) == (None, 5000)
+        changed, checkpoint = ds.api.get_changed_projects(ds.projects, 5000)
+        assert [p.name for p in changed] == ['proj-1', 'proj-3']
+        assert checkpoint == 5003
+        assert ds.api.get_changed_projects(ds.projects, 5003) == ([], 5003)
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_npm_abbreviated_versions(stub_server, tmp_path):
+    from r2c_isg.apis import Npm
+    from r2c_isg.structures.projects import NpmPackage
+
+    stub_server.routes['/big'] = {
+        'name': 'big', 'readme': 'x' * 10000,
+        'dist-tags': {'latest': '1.0.0'},
+        'time': {'1.0.0': '2019-01-01T00:00:00.000Z'},
+        'versions': {'1.0.0': {'version': '1.0.0', 'readme': 'x' * 10000,
+                               'dist': {'tarball': 'big-1.0.0.tgz'}}}
+    }
+    api = Npm(cache_dir=str(tmp_path), abbreviated=True)
+    api._base_api_url = stub_server.url
+    uuids = {'name': lambda p: p.name}
+    package = NpmPackage(uuids_=uuids, name='big')
+
+    # the abbreviated metadata is asked for, and unused fields are dropped
+    # before they're cached or reach the versions
+    api.get_versions(package)
+    assert stub_server.requests[0][2]['Accept'] == \
+        'application/vnd.npm.install-v1+json'
+    [version] = package.versions
+    assert version.dist == {'tarball': 'big-1.0.0.tgz'}
+    assert version.date == '2019-01-01T00:00:00.000Z'
+    assert not hasattr(version, 'readme')
+    [(key, entry)] = list(api._get_cache().items())
+    assert 'readme' not in entry['json']
+
+    # trimmed payloads still keep the fields versions are fetched for
+    api.configure(trim_payloads=True)
+    package.versions = []
+    api.get_versions(package)
+    [version] = package.versions
+    assert vars(version) == {'version': '1.0.0',
+                             'dist': {'tarball': 'big-1.0.0.tgz'},
+                             'date': '2019-01-01T00:00:00.000Z'}
+    api.configure(trim_payloads=False)
+
+    # metadata still comes from the full packument
+    api.get_project(package)
+    assert package.readme == 'x' * 10000
+    assert len(stub_server.requests) == 2
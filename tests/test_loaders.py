@@ -1,4 +1,5 @@
 import os
+import pytest
 from dotenv import load_dotenv
 
 from r2c_isg.structures import Dataset
@@ -75,6 +76,49 @@ def test_import_inputset():
     os.remove('../test.json')
 
 
+
+def test_export_inputset(tmp_path):
+    import gzip
+    import json
+    from r2c_isg.structures.field_spec import field_specs
+    from r2c_isg.structures.projects import NpmPackage
+
+    ds = Dataset.import_inputset('files/git_repo_commit.json',
+                                 registry='github', cache_dir=CACHE_DIR)
+    ds.update(name='test', version='1.0')
+    expected = ds.to_inputset()
+
+    # the streamed json matches the in-memory input set (and reimports)
+    path = str(tmp_path / 'test.json')
+    ds.export_inputset(path)
+    with open(path) as file:
+        assert json.load(file) == expected
+    assert Dataset.import_inputset(path, registry='github',
+                                   cache_dir=CACHE_DIR).to_inputset() \
+        == expected
+
+    # gzipped and ndjson variants
+    ds.export_inputset(path + '.gz')
+    with gzip.open(path + '.gz', 'rt') as file:
+        assert json.load(file) == expected
+
+    ds.export_inputset(str(tmp_path / 'test.ndjson'), ndjson=True)
+    with open(str(tmp_path / 'test.ndjson')) as file:
+        lines = [json.loads(line) for line in file]
+    assert lines[0] == {k: v for k, v in expected.items() if k != 'inputs'}
+    assert lines[1:] == expected['inputs']
+
+    # a failed export leaves the old file as is
+    uuids, _ = field_specs('uuid name = attr "name"')
+    ds.projects.append(NpmPackage(uuids_=uuids, name='no-versions'))
+    with pytest.raises(Exception):
+        ds.export_inputset(path)
+    with open(path) as file:
+        assert json.load(file) == expected
+    assert sorted(os.listdir(str(tmp_path))) == \
+        ['test.json', 'test.json.gz', 'test.ndjson']
+
+
 def test_load_file():
     # test github
     ds = Dataset.load_file(
@@ -182,3 +226,135 @@ def test_load_weblist():
     # cleanup files
     os.remove('../test.p')
     os.remove('../test.json')
+
+
+def test_github_org_pages(stub_server, tmp_path):
+    from r2c_isg.apis import Github
+    from r2c_isg.loaders.web.github_loader import GithubLoader
+
+    repos = [{'name': 'repo%d' % i} for i in range(250)]
+    path = '/orgs/acme/repos?per_page=100&page=%d'
+    link = '<%s%s>; rel="next", <%s%s>; rel="last"' % (
+        stub_server.url, path % 2, stub_server.url, path % 3)
+    stub_server.routes[path % 1] = (200, {'Link': link}, repos[:100])
+    stub_server.routes[path % 2] = repos[100:200]
+    stub_server.routes[path % 3] = repos[200:]
+
+    api = Github(cache_dir=str(tmp_path))
+    api._base_api_url = stub_server.url
+
+    # the Link header's last page bounds the (concurrent) page requests
+    assert GithubLoader._get_org_or_user_repos(api, 'acme', 'org') == repos
+    assert len(stub_server.requests) == 3
+
+    # the Link header is cached along with the first page
+    api.flush_cache()
+    api = Github(cache_dir=str(tmp_path))
+    api._base_api_url = stub_server.url
+    assert GithubLoader._get_org_or_user_repos(api, 'acme', 'org') == repos
+    assert len(stub_server.requests) == 3
+
+
+def test_json_stream():
+    import json
+    from r2c_isg.json_stream import JsonStream
+
+    doc = {'name': 'test', 'inputs': [{'package_name': 'pkg%d' % i,
+                                       'version': '1.%d' % i}
+                                      for i in range(100)] + [12345, 'é€'],
+           'version': 1.5}
+    text = json.dumps(doc, indent=4)
+    encoded = text.encode()
+
+    # any chunking (even splitting numbers and utf-8 characters) decodes
+    # to the same values
+    for size in [1, 2, 7, 64, 100000]:
+        chunks = [encoded[i:i + size] for i in range(0, len(encoded), size)]
+        members = {}
+        for key, val in JsonStream(chunks).members({'inputs'}):
+            members[key] = list(val) if key == 'inputs' else val
+        assert members == doc
+
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert JsonStream(chunks).value() == doc
+
+    stream = JsonStream([json.dumps(doc['inputs'])])
+    assert stream.peek() == '['
+    assert list(stream.items()) == doc['inputs']
+
+    # numbers split at any offset decode whole
+    for number in ['1.5', '-7.25', '1e10']:
+        doc = '[%s, %s]' % (number, number)
+        for i in range(1, len(doc)):
+            chunks = [doc[:i].encode(), doc[i:].encode()]
+            assert list(JsonStream(chunks).items()) == [float(number)] * 2
+
+
+def test_streamed_name_list(stub_server, tmp_path):
+    from r2c_isg.apis import Npm
+    from r2c_isg.loaders.web.npm_loader import NpmLoader
+
+    names = ['pkg%d' % i for i in range(5000)]
+    stub_server.routes['/names.json'] = names
+    url = stub_server.url + '/names.json'
+    api = Npm(cache_dir=str(tmp_path))
+
+    # items are decoded as the response downloads, and the response is
+    # cached once it's been read in full
+    status, items = api.request_stream(url)
+    assert status == 200 and next(items) == 'pkg0'
+    assert list(items) == names[1:]
+    status, items = api.request_stream(url)
+    assert list(items) == names
+    assert len(stub_server.requests) == 1
+
+    # the parser builds packages straight from the stream
+    ds = Dataset(registry='npm', nocache=True, cache_dir=str(tmp_path))
+    NpmLoader._parse_niceregistry(ds, api.request_stream(url)[1])
+    assert [p.name for p in ds.projects] == names
+    assert ds.projects[-1].dependents_rank == 5000
+
+    # partly read responses aren't cached
+    api.clear_cache()
+    status, items = api.request_stream(url)
+    next(items)
+    items.close()
+    assert list(tmp_path.glob('*.gz*')) == []
+
+
+def test_sampled_load(tmp_path):
+    from collections import Counter
+    from r2c_isg.loaders.web.npm_loader import NpmLoader
+    from r2c_isg.structures.reservoir import Reservoir
+
+    # a project's rows needn't be adjacent
+    path = tmp_path / 'names.csv'
+    path.write_text('!name,!org,!v.version\n' + ''.join(
+        'pkg%d,org%d,1.0.%d\n' % (i, i % 4, j)
+        for j in range(3) for i in range(200)))
+
+    def load(**kwargs):
+        return Dataset.load_file(str(path), registry='npm', nocache=True,
+                                 cache_dir=str(tmp_path), **kwargs)
+
+    # sampled projects keep all their rows; dropped ones are skipped
+    ds = load(sample=10, seed='abc')
+    assert len(ds.projects) == 10
+    assert all(len(p.versions) == 3 for p in ds.projects)
+    names = [p.name for p in ds.projects]
+    assert names == sorted(names, key=lambda n: int(n[3:]))
+    assert [p.name for p in load(sample=10, seed='abc').projects] == names
+
+    # stratified samples take n projects per value
+    ds = load(sample=2, seed='abc', strata='org')
+    assert Counter(p.org for p in ds.projects) == \
+        {'org0': 2, 'org1': 2, 'org2': 2, 'org3': 2}
+
+    # weighted samples favor heavier items
+    ds = Dataset(registry='npm', nocache=True, cache_dir=str(tmp_path))
+    sampler = Reservoir(50, 'abc', weight='1/dependents_rank')
+    NpmLoader._parse_niceregistry(
+        ds, ('pkg%d' % i for i in range(10000)), sampler)
+    assert len(ds.projects) == 50 and sampler.seen == 10000
+    ranks = [p.dependents_rank for p in ds.projects]
+    assert ranks == sorted(ranks) and sum(r <= 100 for r in ranks) > 10
@@ -0,0 +1,403 @@
+import pytest
+
+from r2c_isg.structures import Dataset
+from r2c_isg.structures.projects import NpmPackage
+
+
+def _make_dataset(n: int, cache_dir) -> Dataset:
+    ds = Dataset(registry='npm', nocache=True, cache_dir=str(cache_dir))
+    uuids = {
+        'name': lambda p: p.name,
+        'url': lambda p: p.url
+    }
+    for i in range(n):
+        ds.projects.append(NpmPackage(uuids_=uuids, name='p%d' % i,
+                                      url='https://npm.com/p%d' % i))
+    return ds
+
+
+def test_find_project(tmp_path):
+    ds = _make_dataset(1000, tmp_path)
+
+    # any matching uuid finds the project
+    assert ds.find_project(name='p10') is ds.projects[10]
+    assert ds.find_project(url='https://npm.com/p20') is ds.projects[20]
+    assert ds.find_project(name='nope', url='https://npm.com/p30') \
+        is ds.projects[30]
+    assert ds.find_project(name='nope') is None
+
+    # appended projects are found
+    uuids = {'name': lambda p: p.name}
+    ds.projects.append(NpmPackage(uuids_=uuids, name='new'))
+    assert ds.find_project(name='new') is ds.projects[-1]
+
+    # trimmed/sorted/sampled projects stay in sync
+    ds.trim(500)
+    assert ds.find_project(name='p700') is None
+    ds.sort(['desc', 'name'])
+    assert ds.find_project(name='p99') is ds.projects[0]
+    ds.sample(10, on_versions=False, seed='abc')
+    assert ds.find_project(name=ds.projects[5].name) is ds.projects[5]
+
+    # updated projects are found under their new uuid values
+    p = ds.projects[0]
+    ds.update_project(p, url='https://npm.com/moved')
+    assert ds.find_project(url='https://npm.com/moved') is p
+
+
+def test_find_version(tmp_path):
+    from r2c_isg.structures.versions import NpmVersion
+
+    ds = _make_dataset(1, tmp_path)
+    p = ds.projects[0]
+    uuids = {'version': lambda v: v.version}
+    for i in range(1000):
+        p.versions.append(NpmVersion(uuids_=uuids, version='1.0.%d' % i))
+
+    assert p.find_version(version='1.0.10') is p.versions[10]
+    assert p.find_version(version='2.0.0') is None
+
+    # trimmed/sorted/sampled versions stay in sync
+    ds.trim(500, on_versions=True)
+    assert p.find_version(version='1.0.700') is None
+    ds.sort(['desc', 'v.version'])
+    assert p.find_version(version='1.0.99') is p.versions[0]
+    ds.sample(10, on_versions=True, seed='abc')
+    assert p.find_version(version=p.versions[5].version) is p.versions[5]
+
+    # updates (eg, from api payloads) may carry the version's own uuid
+    v = p.versions[5]
+    p.update_version(v, version='3.0.0')
+    assert p.find_version(version='3.0.0') is v
+    ds.update_project(p, project='x')
+
+
+def test_compact_layout(tmp_path):
+    import dill
+    from types import MethodType
+    from r2c_isg.apis import Npm
+    from r2c_isg.structures.projects import NpmPackage
+    from r2c_isg.structures.field_spec import field_specs
+
+    ds = _make_dataset(2, tmp_path)
+    p1, p2 = ds.projects
+
+    # projects share their uuid functions, bound on lookup
+    assert p1._uuid_funcs is p2._uuid_funcs
+    assert p1.uuids_['name']() == 'p0'
+    assert not hasattr(p1, '__weakref__') and 'versions' not in vars(p1)
+
+    # copies keep sharing them
+    ds2 = dill.loads(dill.dumps(ds))
+    q1, q2 = ds2.projects
+    assert q1._uuid_funcs is q2._uuid_funcs
+    assert ds2.find_project(name='p1') is q2
+
+    # backups made by older versions (dicts of bound methods) convert
+    old = NpmPackage.__new__(NpmPackage)
+    old.__setstate__({'name': 'old', 'versions': [],
+                      'uuids_': {'name': MethodType(lambda p: p.name, old)},
+                      'meta_': {}})
+    assert old.uuids_['name']() == 'old' and 'uuids_' not in vars(old)
+
+    # payloads are kept whole, unless trimming is asked for; trimmed ones
+    # keep only the fields uuids read (plus configured ones)
+    api = Npm(nocache=True, cache_dir=str(tmp_path))
+    data = {'name': 'x', 'readme': 'long' * 100, 'license': 'MIT'}
+    assert api._trim_payload(data, p1._uuid_funcs) is data
+    api.configure(trim_payloads=True)
+    assert api._trim_payload(data, p1._uuid_funcs) == {'name': 'x'}
+    assert api._trim_payload(data, field_specs('uuid name = attr "name"')[0]
+                             ) == {'name': 'x'}
+    api.configure(payload_fields=['license'])
+    assert api._trim_payload(data, p1._uuid_funcs) == {'name': 'x',
+                                                       'license': 'MIT'}
+    api.configure(trim_payloads=False)
+    assert api._trim_payload(data, p1._uuid_funcs) is data
+
+
+@pytest.mark.parametrize('vectorized', [True, False])
+def test_sort(tmp_path, monkeypatch, vectorized):
+    from r2c_isg.structures import columns
+    from r2c_isg.structures.versions import NpmVersion
+
+    # sort on the column store's numpy path (if installed) or its fallback
+    monkeypatch.setattr(columns.Columns, 'min_vectorized', 0)
+    if not vectorized:
+        monkeypatch.setattr(columns, 'np', None)
+
+    ds = _make_dataset(8, tmp_path)
+    uuids = {'version': lambda v: v.version}
+    for i, p in enumerate(ds.projects):
+        p.update(stars=i % 3, org='Org%d' % (i % 2))
+        p.versions = [NpmVersion(uuids_=uuids, version='1.0.%d' % j,
+                                 date=str(j % 2)) for j in range(4)]
+
+    # mixed directions; later keys break ties in earlier ones
+    ds.sort(['desc', 'stars', 'asc', 'org', 'desc', 'uuids.name',
+             'v.date', 'asc', 'v.version'])
+    assert [p.name for p in ds.projects] == \
+        ['p2', 'p5', 'p4', 'p7', 'p1', 'p6', 'p0', 'p3']
+    assert [v.version for v in ds.projects[0].versions] == \
+        ['1.0.1', '1.0.3', '1.0.0', '1.0.2']
+    assert ds.find_project(name='p4') is ds.projects[2]
+
+
+
+
+def test_field_specs(tmp_path):
+    import dill
+    from r2c_isg.structures.field_spec import FieldSpec, field_specs
+    from r2c_isg.structures.projects import GithubRepo
+
+    uuids, meta = field_specs('''
+        uuid name = attr "name"
+        uuid url = attr "html_url"
+        meta org = attr "url" split "/" -2 lower
+    ''')
+    p = GithubRepo(uuids_=uuids, meta_=meta, name='r2c',
+                   url='https://api.github.com/repos/Returntocorp/r2c',
+                   html_url='https://github.com/returntocorp/r2c')
+    assert p.uuids_['url']() == 'https://github.com/returntocorp/r2c'
+    assert p.meta_['org']() == 'returntocorp'
+
+    # specs are compiled once and shared; they pickle as their source
+    assert FieldSpec.parse('attr "name"') is uuids['name']
+    assert dill.loads(dill.dumps(uuids))['name'] is uuids['name']
+    assert dill.loads(dill.dumps(p)).uuids_['name']() == 'r2c'
+
+    # datasets describe them without source introspection
+    ds = Dataset(registry='github', nocache=True,
+                 cache_dir=str(tmp_path))
+    ds.projects.append(p)
+    assert ds.to_json()['projects'][0]['meta_'] == \
+        {'org': 'attr "url" split "/" -2 lower'}
+    assert ds.find_project(html_url='https://github.com/returntocorp/r2c') \
+        is p
+
+    # custom functions are described by their source, unless it no longer
+    # matches their code (eg, lambdas restored from an old backup, whose
+    # recorded line now holds something else)
+    from types import FunctionType
+    from r2c_isg.structures.field_spec import describe
+    funcs = {'name': lambda p: p.name}
+    assert describe(funcs['name']) == 'lambda p: p.name'
+    moved = funcs['name'].__code__.replace(co_firstlineno=1)
+    stale = FunctionType(moved, funcs['name'].__globals__)
+    assert describe(stale) == repr(stale)
+
+    # backups store them as their source, restored as the shared specs
+    path = str(tmp_path / 'test.p')
+    ds.backup(path)
+    assert Dataset.restore(path).projects[0]._meta_funcs['org'] \
+        is meta['org']
+
+    with pytest.raises(Exception):
+        FieldSpec('html_url')
+    with pytest.raises(Exception):
+        FieldSpec('attr "url" split "/"')
+    with pytest.raises(Exception):
+        field_specs('name = attr "name"')
+
+
+def test_cancel_on_error(tmp_path):
+    import time
+    from r2c_isg.apis.ratelimit import Cancelled, RateLimiter
+
+    ds = _make_dataset(4, tmp_path)
+    limiter = RateLimiter()
+    limiter.update({'X-RateLimit-Limit': '10', 'X-RateLimit-Remaining': '0',
+                    'X-RateLimit-Reset': str(time.time() + 3600)})
+
+    def get(p):
+        if p.name == 'p0':
+            time.sleep(0.2)
+            raise Exception('failed')
+        # the others wait out the (hour long) rate limit, unless cancelled
+        limiter.acquire(ds.api._cancel)
+
+    # a failed worker stops the others, rather than waiting for them
+    start = time.time()
+    with pytest.raises(Exception, match='failed'):
+        ds._run_on_projects(get, 4, 'Getting')
+    assert time.time() - start < 10
+    assert limiter.waiting == 0
+
+    # once the run has stopped, requests go through again
+    ds.api._check_cancelled()
+    ds.api.cancel_requests()
+    with pytest.raises(Cancelled):
+        ds.api._check_cancelled()
+    ds.api.allow_requests()
+
+
+@pytest.mark.parametrize('encoding', ['msgpack', 'json'])
+def test_backup(tmp_path, monkeypatch, encoding):
+    import os
+    import dill
+    from r2c_isg.structures import archive
+    from r2c_isg.structures.versions import NpmVersion
+
+    if encoding == 'msgpack':
+        pytest.importorskip('msgpack')
+    else:
+        monkeypatch.setattr(archive, 'msgpack', None)
+
+    ds = _make_dataset(30, tmp_path)
+    ds.update(name='test', version='1.0')
+    uuids = {'version': lambda v: v.version}
+    for i, p in enumerate(ds.projects):
+        p.update(stars=i, api_response={'license': 'MIT', 'tags': [1, None]},
+                 span=(i, [i + 1]), ranks={1: 'a'})
+        p.versions = [NpmVersion(uuids_=uuids, version='1.0.%d' % j)
+                      for j in range(3)]
+
+    # every compression round trips, with shared functions kept shared
+    path = str(tmp_path / 'test.p')
+    for compression in ['gzip', 'none']:
+        ds.backup(path, compression=compression)
+        restored = Dataset.restore(path)
+        assert restored.to_json() == ds.to_json()
+        assert restored.projects[1]._uuid_funcs \
+            is restored.projects[2]._uuid_funcs
+        assert restored.find_project(name='p7') is restored.projects[7]
+        assert restored.projects[7].versions[2].uuids_['version']() \
+            == '1.0.2'
+        # (tuples and non-str keys aren't turned into lists/strs)
+        assert restored.projects[7].span == (7, [8])
+        assert restored.projects[7].ranks == {1: 'a'}
+
+    # a failed backup leaves the previous one in place
+    def broken(ds):
+        yield from []
+        raise Exception('disk full')
+    monkeypatch.setattr(archive.Archive, '_records', staticmethod(broken))
+    with pytest.raises(Exception):
+        ds.backup(path, compression='none')
+    monkeypatch.undo()
+    if encoding == 'json':
+        monkeypatch.setattr(archive, 'msgpack', None)
+    assert Dataset.restore(path).to_json() == ds.to_json()
+    assert not os.path.exists(path + '.tmp')
+
+    # a backup cut short is caught
+    with open(path, 'rb') as file:
+        data = file.read()
+    with open(path, 'wb') as file:
+        file.write(data[:len(data) // 2])
+    with pytest.raises(Exception):
+        Dataset.restore(path)
+
+    # pickled backups made by older versions still restore
+    with open(path, 'wb') as file:
+        dill.dump(ds, file)
+    assert Dataset.restore(path).to_json() == ds.to_json()
+
+
+def test_rollback(tmp_path):
+    from r2c_isg.structures.versions import NpmVersion
+
+    ds = _make_dataset(100, tmp_path)
+    uuids = {'version': lambda v: v.version}
+    for p in ds.projects:
+        p.versions = [NpmVersion(uuids_=uuids, version='1.0.%d' % i)
+                      for i in range(5)]
+    before = ds.to_json()
+
+    # transformations and api-style updates are undone
+    ds.begin()
+    ds.sort(['desc', 'name', 'v.version'])
+    ds.trim(50)
+    ds.sample(2, on_versions=True, seed='abc')
+    ds.update(name='changed')
+    ds.update_project(ds.projects[0], url='https://npm.com/moved')
+
+    def get(p):
+        if p is ds.projects[10]:
+            raise Exception('rate limited')
+        p.update(downloads=1)
+        p.versions.append(NpmVersion(uuids_=uuids, version='2.0.0'))
+        p.versions[0].update(version='9.9.9')
+
+    try:
+        ds._run_on_projects(get, 1, 'Getting')
+    except Exception:
+        ds.rollback()
+
+    assert ds.to_json() == before
+    assert ds.find_project(url='https://npm.com/moved') is None
+    assert ds.find_project(name='p99') is ds.projects[99]
+    assert ds.projects[3].find_version(version='1.0.4') \
+        is ds.projects[3].versions[4]
+
+    # committed changes are kept
+    ds.begin()
+    ds.trim(10)
+    ds.commit()
+    ds.rollback()
+    assert len(ds.projects) == 10
+
+
+def test_resume(tmp_path):
+    import os
+    from copy import deepcopy
+    from concurrent.futures import Future
+    from tqdm import tqdm
+    from r2c_isg.structures.progress_log import ProgressLog
+
+    ds = _make_dataset(20, tmp_path)
+    ds.name = 'resumable'
+    fresh = deepcopy(ds)
+
+    def get(p):
+        if p.name == 'p12':
+            raise Exception('rate limited')
+        p.update(downloads=int(p.name[1:]))
+
+    # a failed run keeps the projects it finished...
+    ds.begin()
+    with pytest.raises(Exception):
+        ds._run_on_projects(get, 1, 'Getting', task='meta')
+    assert ds.rollback() == 12
+    assert [p.downloads for p in ds.projects[:12]] == list(range(12))
+    assert not hasattr(ds.projects[12], 'downloads')
+
+    # ...and logs them, so a rerun (eg, after restoring a backup) skips them
+    path = ds._progress_log_path('meta')
+    assert os.path.exists(path)
+
+    calls = []
+
+    def get_rest(p):
+        calls.append(p.name)
+        p.update(downloads=-1)
+
+    fresh._run_on_projects(get_rest, 2, 'Getting', task='meta', resume=True)
+    assert sorted(calls) == sorted('p%d' % i for i in range(12, 20))
+    assert [p.downloads for p in fresh.projects[:12]] == list(range(12))
+    assert fresh.find_project(name='p3') is fresh.projects[3]
+    assert not os.path.exists(path)
+
+    # unnamed datasets would share a log, so they can't be resumed
+    fresh.name = None
+    with pytest.raises(Exception):
+        fresh._run_on_projects(get_rest, 1, 'Getting', task='meta',
+                               resume=True)
+
+    # projects missing a uuid are still logged (under their other uuids)
+    del fresh.projects[0].url
+    assert ProgressLog.key(fresh.projects[0]) == (('name', 'p0'),)
+
+    # a failed project doesn't lose the others that completed with it
+    ds.begin()
+    ok1, ok2, failed = Future(), Future(), Future()
+    failed.set_exception(Exception('rate limited'))
+    ok1.set_result(None)
+    ok2.set_result(None)
+    pending = {failed: ds.projects[0], ok1: ds.projects[1],
+               ok2: ds.projects[2]}
+    log = ProgressLog(str(tmp_path / 'collect.p'))
+    with pytest.raises(Exception):
+        ds._collect(list(pending), pending, tqdm(disable=True), log)
+    assert not pending and ds.rollback() == 2
+    log.remove()